@@ -0,0 +1,261 @@
+### Shared HTTP client used by the Realtor API search functions
+import contextvars
+import os
+import random
+import time
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import count, observe_bytes
+from request_broker import get_default_quota
+
+REALTOR_API_HOST = "realtor16.p.rapidapi.com"
+# Overrides https://<host>, e.g. to run against benchmarks/mock_server.py
+REALTOR_API_BASE_URL = os.environ.get('REALTOR_API_BASE_URL')
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+# Rate limiter of the requests sent from the current context, see rate_limited
+_limiter = contextvars.ContextVar('realtor_request_limiter', default=None)
+
+
+@contextmanager
+def rate_limited(limiter):
+    """
+    Take a token of limiter before every request sent from a block
+
+    Only requests that reach the API are limited: searches answered by the
+    response cache or by an identical search in flight take no token. Threads
+    started with asyncio.to_thread, or run in contextvars.copy_context(),
+    inherit the limiter.
+    """
+    token = _limiter.set(limiter)
+    try:
+        yield
+    finally:
+        _limiter.reset(token)
+
+
+class RealtorClient:
+    """
+    Pooled HTTP client for the Realtor API on RapidAPI
+
+    A single requests.Session is shared by every search so TCP/TLS connections
+    to the API host are kept alive and reused. Idempotent GET requests that fail
+    with a connection error, timeout, 429 or 5xx are retried with jittered
+    exponential backoff, honoring the Retry-After header when the API sends one.
+
+    Parameters:
+        api_key (str, optional): Default RapidAPI key, can be overridden per request
+        host (str): RapidAPI host name
+        base_url (str, optional): Base URL, defaults to https://<host>
+        timeout (float or tuple): (connect, read) timeout in seconds for each attempt
+        max_retries (int): Number of retries after the first attempt
+        backoff_factor (float): Base delay in seconds, doubled on every retry
+        max_backoff (float): Upper bound in seconds for any single wait
+        pool_connections (int): Number of host pools kept by the session
+        pool_maxsize (int): Maximum open connections per host
+        quota (QuotaTracker, optional): Fed with the rate limit headers of every
+                                        response, defaults to the shared tracker
+    """
+
+    def __init__(self, api_key=None, host=REALTOR_API_HOST, base_url=None,
+                 timeout=(3.05, 30), max_retries=3, backoff_factor=0.5,
+                 max_backoff=30.0, pool_connections=4, pool_maxsize=10, quota=None):
+        self.api_key = api_key
+        self.host = host
+        self.base_url = (base_url or f"https://{host}").rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.quota = quota or get_default_quota()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = 0
+        self._pool_lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.ensure_pool_size(pool_maxsize)
+
+    def ensure_pool_size(self, pool_maxsize):
+        """
+        Keep at least pool_maxsize connections per host open
+
+        Callers sending more requests at once than the pool holds grow it
+        first, otherwise the extra connections are closed after every request.
+        """
+        with self._pool_lock:
+            if pool_maxsize <= self.pool_maxsize:
+                return
+            # Retries are handled in get() so the adapter itself never retries
+            adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                  pool_maxsize=pool_maxsize,
+                                  max_retries=0)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.pool_maxsize = pool_maxsize
+
+    def headers(self, api_key=None):
+        """Build the RapidAPI authentication headers"""
+        return {
+            "X-RapidAPI-Key": api_key or self.api_key,
+            "X-RapidAPI-Host": self.host
+        }
+
+    def get(self, path, params=None, api_key=None, timeout=None, stream=False):
+        """
+        Send a GET request to the API, retrying transient failures
+
+        Parameters:
+            path (str): Endpoint path, e.g. "/search/forrent"
+            params (dict, optional): Querystring parameters
+            api_key (str, optional): RapidAPI key for this request
+            timeout (float or tuple, optional): Overrides the client timeout
+            stream (bool): Return as soon as the headers arrive and leave the
+                           body to be read with iter_content. The caller must
+                           close the response.
+
+        Returns:
+            requests.Response: The last response received. Connection errors
+            are re-raised once the retries are exhausted.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        timeout = timeout if timeout is not None else self.timeout
+
+        limiter = _limiter.get()
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                response = self.session.get(url, headers=self.headers(api_key),
+                                            params=params, timeout=timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                count('realtor_api_errors_total', endpoint=path, error=type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            count('realtor_api_responses_total', endpoint=path, status=response.status_code)
+            self.quota.update(response.headers)
+            if not stream:
+                # Streamed bodies are measured by whoever reads them
+                observe_bytes('realtor_api_payload_bytes', len(response.content), endpoint=path)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                return response
+            # Release the connection of the failed attempt to the pool
+            response.close()
+
+            time.sleep(self._backoff(attempt, response.headers.get('Retry-After')))
+            attempt += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt (full jitter, capped)"""
+        delay = parse_retry_after(retry_after)
+        if delay is not None:
+            return min(delay, self.max_backoff)
+        ceiling = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def close(self):
+        """Close every pooled connection"""
+        self.session.close()
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header value
+
+    Returns:
+        float: Seconds to wait, or None when the header is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter
+
+    Parameters:
+        rate (float): Tokens added per second, i.e. the sustained request rate
+        burst (int, optional): Bucket size, defaults to one second of tokens
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+
+def get_host_limiter(host, rate, burst=None):
+    """
+    Return the process-wide rate limiter for a host
+
+    Every caller limiting the same host shares one bucket, so concurrent batch
+    searches together stay under the host's rate limit. The bucket is rebuilt
+    if a different rate is requested.
+    """
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None or limiter.rate != float(rate):
+            limiter = TokenBucket(rate, burst)
+            _host_limiters[host] = limiter
+        return limiter
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """Return the process-wide client shared by the search functions"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = RealtorClient(base_url=REALTOR_API_BASE_URL)
+        return _default_client
+
+
+def set_default_client(client):
+    """Replace the process-wide client, e.g. to change timeouts or retries"""
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
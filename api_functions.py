@@ -1,490 +1,500 @@
 ### These are the functions used to call the API
 import streamlit as st
+import asyncio
 import requests
-import pandas as pd
 import json
+import logging
+import weakref
+import zlib
+from contextlib import ExitStack
 
-def search_rental_properties(api_key, location, limit=1000):
+from api_client import get_default_client
+from instrumentation import count, log_event, observe_bytes, span, timed, StageTimer
+from request_broker import current_priority, get_default_broker, RequestShed, UNSHARED
+from response_cache import cached_search, get_default_cache, iter_body_chunks, make_cache_key, FRESH, STALE
+from listing_schema import extract_rentals, extract_properties, extract_dataframe
+from stream_json import iter_array_pages
+
+def search_rental_properties(api_key, location, limit=1000, client=None, cache=None, offset=None,
+                             stream=False, query=None):
     """
     Search for rental properties using the Realtor API
     
     Parameters:
         api_key (str): Your RapidAPI key
         location (str): Zip, e.g. 63122 or City and state, e.g., "Kirkwood, MO"
-        min_price (int, optional): Minimum rental price
-        max_price (int, optional): Maximum rental price
-        beds (int, optional): Number of bedrooms
-        baths (int, optional): Number of bathrooms
         limit (int, optional): Maximum number of results to return
+        client (RealtorClient, optional): HTTP client, defaults to the shared pooled client
+        cache (ResponseCache, optional): Response cache, defaults to the shared on-disk
+                                         cache. Pass False to always call the API.
+        offset (int, optional): Number of results to skip, used for paging
+        stream (bool): Decode the properties incrementally, see stream_search
+        query (SearchQuery, optional): Filters, the price, beds and baths ones are
+                                       sent to the API. Apply the others with query.apply.
     
     Returns:
-        dict: JSON response from the API
+        dict: JSON response from the API. With stream=True, a generator of
+        response pages instead, or None if the search failed.
     """
-    url = "https://realtor16.p.rapidapi.com/search/forrent"
+    client = client or get_default_client()
     
 
     querystring =  {"location":location, 
                     "search_radius" : "0",
                     "limit":limit}
+    if offset:
+        querystring["offset"] = offset
 
-    # Add optional filters if provided
-    #if min_price:
-    #    querystring["price_min"] = str(min_price)
-    #if max_price:
-    #    querystring["price_max"] = str(max_price)
-    #if beds:
-    #    querystring["beds_min"] = str(beds)
-    #if baths:
-    #    querystring["baths_min"] = str(baths)
-    
-    headers = {
-        "X-RapidAPI-Key": api_key,
-        "X-RapidAPI-Host": "realtor16.p.rapidapi.com"
-    }
-    
-    response = requests.get(url, headers=headers, params=querystring)
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        return None
-
-def display_and_store_rentals(properties_data):
-    """Display rental property information and store in a pandas DataFrame"""
-    if not properties_data or 'properties' not in properties_data:
-        print("No rental properties found or invalid data")
-        return None
-    
-    # List to store property data for DataFrame
-    property_records = []
+    # Filters the API applies itself, so non-matching listings are never sent
+    if query is not None:
+        querystring.update(query.params())
     
-    # Process each property
-    for prop in properties_data['properties']:
+    if stream:
+        return stream_search("/search/forrent", querystring, api_key, client, cache)
+
+    def load():
         try:
-            print(f"\n{'='*50}")
-            
-            # Address information
-            address = prop.get('location', {}).get('address', {})
-            address_line = address.get('line', 'N/A')
-            city = address.get('city', 'N/A')
-            state = address.get('state_code', 'N/A')
-            zip_code = address.get('postal_code', 'N/A')
-            
-            #print(f"Address: {address_line}")
-            #print(f"City: {city}")
-            #print(f"State: {state}")
-            #print(f"Zip: {zip_code}")
-            
-            # Property details
-            description = prop.get('description', {})
-            rent = prop.get('list_price')
-            beds = description.get('beds', 'N/A')
-            baths = description.get('baths_consolidated', 'N/A')
-            sqft = description.get('sqft', 'N/A')
-            property_type_desc = description.get('type', 'N/A')
-            sub_type = description.get('sub_type', 'N/A')
-            
-            # Error handling for rent formatting
-            if rent is not None:
-                try:
-                    #print(f"Monthly Rent: ${rent:,}")
-                    formatted_rent = f"${rent:,}"
-                    rent = rent
-                except (TypeError, ValueError):
-                    #print(f"Monthly Rent: ${rent}")
-                    formatted_rent = f"${rent}"
-                    rent = rent
-            else:
-                #print("Monthly Rent: N/A")
-                formatted_rent = "N/A"
-                rent = "N/A"
-                
-            #print(f"Beds: {beds}")
-            #print(f"Baths: {baths}")
-            #print(f"Sq Ft: {sqft}")
-            #print(f"Property Type: {property_type_desc}")
-            #print(f"Sub Type: {sub_type}")
-            
-            # Status flags
-            flags = prop.get('flags', {})
-            status_flags = []
-            if flags and isinstance(flags, dict):
-                if flags.get('is_new_listing'):
-                    status_flags.append("NEW LISTING")
-                if flags.get('is_pending'):
-                    status_flags.append("PENDING")
-                
-            status = ', '.join(status_flags) if status_flags else "ACTIVE"
-            #print(f"Status: {status}")
-            
-            # Price reduction info
-            price_reduced = prop.get('price_reduced_amount')
-            #if price_reduced is not None:
-            #    try:
-            #        print(f"Price Reduced: ${price_reduced:,}")
-            #    except (TypeError, ValueError):
-            #        print(f"Price Reduced: ${price_reduced}")
-            
-            # Listing information
-            listing_id = prop.get('listing_id', 'N/A')
-            property_id = prop.get('property_id', 'N/A')
-            list_date = prop.get('list_date', 'N/A')
-            
-            #print(f"Listing ID: {listing_id}")
-            #print(f"Property ID: {property_id}")
-            #if list_date:
-            #    print(f"List Date: {list_date}")
-            
-            # Pet policy with error handling
-            pet_policy = prop.get('pet_policy', {})
-            pets_allowed = []
-            
-            try:
-                if pet_policy and isinstance(pet_policy, dict):
-                    if pet_policy.get('cats'):
-                        pets_allowed.append("Cats")
-                    if pet_policy.get('dogs_small'):
-                        pets_allowed.append("Small Dogs")
-                    if pet_policy.get('dogs_large'):
-                        pets_allowed.append("Large Dogs")
-                
-                pets_string = ', '.join(pets_allowed) if pets_allowed else "No information"
-                #print(f"Pets Allowed: {pets_string}")
-            except Exception as e:
-                pets_string = "Error retrieving pet information"
-                print(f"Pets Allowed: Error ({str(e)})")
-            
-            # Get security deposit info from details if available
-            security_deposit = "N/A"
-            availability_date = "N/A"
-            
-            try:
-                details = prop.get('details', [])
-                if details and isinstance(details, list):
-                    for detail in details:
-                        if not isinstance(detail, dict):
-                            continue
-                            
-                        category = detail.get('category')
-                        texts = detail.get('text', [])
-                        
-                        if not isinstance(texts, list):
-                            continue
-                            
-                        if category == "Rental Info":
-                            for text in texts:
-                                if isinstance(text, str) and "Security Deposit:" in text:
-                                    security_deposit = text.split("Security Deposit:")[1].strip()
-                        
-                        if category == "Other Property Info":
-                            for text in texts:
-                                if isinstance(text, str) and "Availability Date:" in text:
-                                    availability_date = text.split("Availability Date:")[1].strip()
-            except Exception as e:
-                print(f"Error processing property details: {str(e)}")
-                
-            #if security_deposit != "N/A":
-            #    print(f"Security Deposit: ${security_deposit}")
-            #if availability_date != "N/A":
-            #    print(f"Available From: {availability_date}")
-            
-            # Images
-            primary_image = "N/A"
-            try:
-                primary_photo = prop.get('primary_photo', {})
-                if primary_photo and isinstance(primary_photo, dict):
-                    primary_image = primary_photo.get('href', 'N/A')
-                
-                #if primary_image != 'N/A':
-                #    print(f"Primary Image: {primary_image}")
-            except Exception as e:
-                print(f"Error processing image: {str(e)}")
-            
-            # Additional photos count
-            additional_photos = 0
-            try:
-                photos = prop.get('photos', [])
-                if photos and isinstance(photos, list):
-                    additional_photos = max(0, len(photos) - 1)
-                
-                #if additional_photos > 0:
-                #    print(f"Additional Photos: {additional_photos}")
-            except Exception as e:
-                print(f"Error counting photos: {str(e)}")
-                additional_photos = "Error"
-            
-            # Virtual tours
-            virtual_tour = "N/A"
-            try:
-                virtual_tours = prop.get('virtual_tours', [])
-                if virtual_tours and isinstance(virtual_tours, list) and len(virtual_tours) > 0:
-                    if isinstance(virtual_tours[0], dict):
-                        virtual_tour = virtual_tours[0].get('href', 'N/A')
-                
-                #if virtual_tour != 'N/A':
-                #    print(f"Virtual Tour: {virtual_tour}")
-            except Exception as e:
-                print(f"Error processing virtual tour: {str(e)}")
-            
-            # Contact info
-            contact_phone = "N/A"
-            try:
-                advertisers = prop.get('advertisers', [])
-                if advertisers and isinstance(advertisers, list):
-                    for advertiser in advertisers:
-                        if not isinstance(advertiser, dict):
-                            continue
-                            
-                        if advertiser.get('type') == "management" and advertiser.get('office'):
-                            office = advertiser.get('office')
-                            if isinstance(office, dict):
-                                phones = office.get('phones', [])
-                                if phones and isinstance(phones, list) and len(phones) > 0:
-                                    if isinstance(phones[0], dict):
-                                        contact_phone = phones[0].get('number', 'N/A')
-                
-                #if contact_phone != 'N/A':
-                #    print(f"Contact Phone: {contact_phone}")
-            except Exception as e:
-                print(f"Error processing contact info: {str(e)}")
-            
-            # Permalink
-            permalink = prop.get('permalink', 'N/A')
-            listing_url = "N/A"
-            try:
-                if permalink != 'N/A':
-                    listing_url = f"https://www.realtor.com/rentals/details/{permalink}"
-                    #print(f"Listing URL: {listing_url}")
-            except Exception as e:
-                print(f"Error creating listing URL: {str(e)}")
-            
-            # Add data to records list
-            try:
-                property_records.append({
-                    "Address": address_line,
-                    "City": city,
-                    "State": state,
-                    "Zip": zip_code,
-                    "Monthly Rent": formatted_rent,
-                    "Rent": rent,
-                    "Beds": beds,
-                    "Baths": baths,
-                    "Sq Ft": sqft,
-                    "Property Type": property_type_desc,
-                    "Sub Type": sub_type,
-                    "Status": status,
-                    "Security Deposit": security_deposit,
-                    "Available From": availability_date,
-                    "Pets Allowed": pets_string,
-                    "Listing ID": listing_id,
-                    "Property ID": property_id,
-                    "List Date": list_date,
-                    "Contact Phone": contact_phone,
-                    "Primary Image": primary_image,
-                    "Additional Photos": additional_photos,
-                    "Virtual Tour": virtual_tour,
-                    "Listing URL": listing_url
-                })
-            except Exception as e:
-                print(f"Error adding property to records: {str(e)}")
+            response = client.get("/search/forrent", params=querystring, api_key=api_key)
+        except requests.exceptions.RequestException as e:
+            log_event('api_error', logging.WARNING, endpoint="/search/forrent", location=location, error=str(e))
+            return None
         
-        except Exception as e:
-            print(f"Error processing property: {str(e)}")
-            continue
+        if response.status_code == 200:
+            return response.json()
+        else:
+            log_event('api_error', logging.WARNING, endpoint="/search/forrent", location=location,
+                      status=response.status_code, body=response.text[:500])
+            return None
+    
+    with span('fetch', feed='rent'):
+        return cached_search("/search/forrent", querystring, brokered("/search/forrent", querystring, load, cache),
+                             cache)
+
+@timed('parse', feed='rent')
+def display_and_store_rentals(properties_data):
+    """
+    Display rental property information and store in a pandas DataFrame
+    
+    properties_data can be a single search response or an iterable of response
+    pages, e.g. from iter_rental_pages. Pages are parsed as they arrive.
+    Columns are defined by RENTAL_SCHEMA in listing_schema.py.
+    """
+    batches = iter_page_batches(properties_data)
+    if batches is None:
+        log_event('no_listings', logging.WARNING, feed='rent')
+        return None
     
-    # Create DataFrame from records
     try:
-        df = pd.DataFrame(property_records)
-        
-        #print(f"\n{'='*50}")
-        #print(f"Found {len(property_records)} rental properties.")
-        #print("Data stored in DataFrame")
-        
-        # Display DataFrame overview
-        #print("\nDataFrame Preview:")
-        #print(f"Shape: {df.shape}")
-        #print(df.head())
-        
-        return df
+        return extract_dataframe(extract_rentals, batches)
     except Exception as e:
-        print(f"Error creating DataFrame: {str(e)}")
+        log_event('parse_error', logging.ERROR, feed='rent', error=str(e))
         return None
 
 
 
 # List to store property data for DataFrame
 
-def search_properties(api_key, location, limit=1000):
+def search_properties(api_key, location, limit=1000, client=None, cache=None, offset=None,
+                      stream=False, query=None):
     """
     Search for properties using the Realtor API
     
     Parameters:
         api_key (str): Your RapidAPI key
         location (str): City and state, e.g., "New York, NY"
-        property_type (str): Type of property (house, condo, apartment)
         limit (int): Maximum number of results to return
+        client (RealtorClient, optional): HTTP client, defaults to the shared pooled client
+        cache (ResponseCache, optional): Response cache, defaults to the shared on-disk
+                                         cache. Pass False to always call the API.
+        offset (int, optional): Number of results to skip, used for paging
+        stream (bool): Decode the properties incrementally, see stream_search
+        query (SearchQuery, optional): Filters, the price, beds and baths ones are
+                                       sent to the API. Apply the others with query.apply.
     
     Returns:
-        dict: JSON response from the API
+        dict: JSON response from the API. With stream=True, a generator of
+        response pages instead, or None if the search failed.
     """
-    url = 'https://realtor16.p.rapidapi.com/search/forsale'
+    client = client or get_default_client()
 
     querystring =  {"location":location, 
                     "search_radius":"0",
                     "limit":limit}
+    if offset:
+        querystring["offset"] = offset
+
+    # Filters the API applies itself, so non-matching listings are never sent
+    if query is not None:
+        querystring.update(query.params())
+    
+    if stream:
+        return stream_search("/search/forsale", querystring, api_key, client, cache)
+
+    def load():
+        try:
+            response = client.get("/search/forsale", params=querystring, api_key=api_key)
+        except requests.exceptions.RequestException as e:
+            log_event('api_error', logging.WARNING, endpoint="/search/forsale", location=location, error=str(e))
+            return None
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            log_event('api_error', logging.WARNING, endpoint="/search/forsale", location=location,
+                      status=response.status_code)
+            return None
+    
+    with span('fetch', feed='sale'):
+        return cached_search("/search/forsale", querystring, brokered("/search/forsale", querystring, load, cache),
+                             cache)
+
+@timed('parse', feed='sale')
+def display_and_store_properties(properties_data):
+    """
+    Display property information in a readable format based on the actual JSON structure
+    
+    properties_data can be a single search response or an iterable of response
+    pages, e.g. from iter_property_pages. Pages are parsed as they arrive.
+    Columns are defined by SALE_SCHEMA in listing_schema.py.
+    """
+    batches = iter_page_batches(properties_data)
+    if batches is None:
+        log_event('no_listings', logging.WARNING, feed='sale')
+        return
+    
+    return extract_dataframe(extract_properties, batches)
+
+
+# Paged search. Each page is a normal search response, fetched with limit set
+# to the page size and an increasing offset, so results can be parsed while the
+# next page is still downloading and dense zips are not capped by one request.
+
+def iter_search_pages(search, api_key, location, page_size=200, max_results=None,
+                      client=None, cache=None):
+    """
+    Walk a search endpoint page by page
     
-    headers = {
-        "X-RapidAPI-Key": api_key,
-        "X-RapidAPI-Host": "realtor16.p.rapidapi.com"
-    }
+    Parameters:
+        search (callable): search_rental_properties or search_properties
+        api_key (str): Your RapidAPI key
+        location (str): Zip, e.g. 63122 or City and state, e.g., "Kirkwood, MO"
+        page_size (int): Number of results requested per page
+        max_results (int, optional): Stop after this many results
+        client (RealtorClient, optional): HTTP client, defaults to the shared pooled client
+        cache (ResponseCache, optional): Response cache, defaults to the shared on-disk cache
     
-    response = requests.get(url, headers=headers, params=querystring)
+    Yields:
+        dict: One JSON response per page, stopping at the first short or failed page
+    """
+    offset = 0
+    while max_results is None or offset < max_results:
+        limit = page_size if max_results is None else min(page_size, max_results - offset)
+        page = search(api_key, location, limit, client, cache, offset)
+        if not page or not page.get('properties'):
+            return
+        yield page
+        received = len(page['properties'])
+        if received < limit:
+            return
+        offset += received
+
+def iter_rental_pages(api_key, location, page_size=200, max_results=None, client=None, cache=None):
+    """Page through the for-rent search, see iter_search_pages"""
+    return iter_search_pages(search_rental_properties, api_key, location, page_size,
+                             max_results, client, cache)
+
+def iter_property_pages(api_key, location, page_size=200, max_results=None, client=None, cache=None):
+    """Page through the for-sale search, see iter_search_pages"""
+    return iter_search_pages(search_properties, api_key, location, page_size,
+                             max_results, client, cache)
+
+def iter_page_batches(properties_data):
+    """
+    Iterate the property lists of a search response or of a stream of pages
     
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: {response.status_code}")
-        #print(response.text)
+    Returns:
+        iterator: One list of property dicts per page, or None if
+                  properties_data holds no properties
+    """
+    if not properties_data:
         return None
+    if isinstance(properties_data, dict):
+        if 'properties' not in properties_data:
+            return None
+        return iter([properties_data['properties'] or []])
+    return (page['properties'] for page in properties_data
+            if page and page.get('properties'))
 
-def display_and_store_properties(properties_data):
-    """Display property information in a readable format based on the actual JSON structure"""
+def iter_parsed_pages(pages, parse):
+    """
+    Parse a stream of pages into one DataFrame per page
+    
+    Parameters:
+        pages (iterable): Search responses, e.g. from iter_rental_pages
+        parse (callable): display_and_store_rentals or display_and_store_properties
+    
+    Yields:
+        pd.DataFrame: Parsed records of each page
+    """
+    for page in pages:
+        df = parse(page)
+        if df is not None and len(df) > 0:
+            yield df
 
-    #Empty df to be filled in
-    property_records = []
+def brokered(endpoint, querystring, load, cache=None):
+    """
+    Send a search through the process-wide request broker
+    
+    Identical searches in flight at the same time share one API call, and the
+    call waits for its turn by priority and quota, see request_broker. A
+    streamed search of the same key shares no payload, it leaves its response
+    in the cache: that is read instead, or the search is sent on its own.
+    
+    Returns:
+        callable: load() wrapped for cached_search, returns None when the
+        search is shed
+    """
+    def load_streamed():
+        if cache is not False:
+            payload, state = (cache or get_default_cache()).get(endpoint, querystring)
+            if payload is not None and state == FRESH:
+                return payload
+        return load()
 
-    if not properties_data or 'properties' not in properties_data:
-        print("No properties found or invalid data")
-        return
+    def send():
+        try:
+            return get_default_broker().call(make_cache_key(endpoint, querystring), load, unshared=load_streamed)
+        except RequestShed:
+            return None
+    return send
+
+# Streaming searches. The request is sent right away, so a failed search still
+# returns None, but the body is decoded only as the parser consumes the pages:
+# properties are decoded a page at a time and dropped once extracted, so the
+# full response tree is never built.
+
+STREAM_CHUNK_SIZE = 65536
+
+# Feed label of the fetch stage of each endpoint
+SEARCH_FEEDS = {"/search/forrent": 'rent', "/search/forsale": 'sale'}
+
+def stream_search(endpoint, querystring, api_key, client=None, cache=None, page_size=250):
+    """
+    Send a search and decode its properties incrementally
     
-    for prop in properties_data['properties']:
-        #print(f"\n{'='*50}")
-        
-        # Address information
-        address = prop.get('location', {}).get('address', {})
-        address_line = address.get('line', 'N/A')
-        city = address.get('city', 'N/A')
-        state = address.get('state_code', 'N/A')
-        zip_code = address.get('postal_code', 'N/A')
-        
-        #print(f"Address: {address_line}")
-        #print(f"City: {city}")
-        #print(f"State: {state}")
-        #print(f"Zip: {zip_code}")
-        
-        # Property details
-        description = prop.get('description', {})
-        price = prop.get('list_price', 'N/A')
-        beds = description.get('beds', 'N/A')
-        baths = description.get('baths_consolidated', 'N/A')
-        sqft = description.get('sqft', 'N/A')
-        lot_sqft = description.get('lot_sqft', 'N/A')
-        property_type_desc = description.get('type', 'N/A')
-        
-        #if price != 'N/A':
-        #    print(f"Price: ${price:,}")
-        #else:
-        #    print(f"Price: {price}")
-        #print(f"Beds: {beds}")
-        #print(f"Baths: {baths}")
-        #print(f"Sq Ft: {sqft}")
-        #print(f"Lot Size (sq ft): {lot_sqft}")
-        #print(f"Property Type: {property_type_desc}")
-        
-        
-        # Status flags
-        flags = prop.get('flags', {})
-        status_flags = []
-        if flags.get('is_new_listing'):
-            status_flags.append("NEW LISTING")
-        if flags.get('is_price_reduced'):
-            status_flags.append("PRICE REDUCED")
-        if flags.get('is_pending'):
-            status_flags.append("PENDING")
-        if flags.get('is_foreclosure'):
-            status_flags.append("FORECLOSURE")
-        if flags.get('is_coming_soon'):
-            status_flags.append("COMING SOON")
-        if flags.get('is_new_construction'):
-            status_flags.append("NEW CONSTRUCTION")
-        if flags.get('is_contingent'):
-            status_flags.append("CONTINGENT")
-            
-        status = ', '.join(status_flags) if status_flags else "ACTIVE"
-        #print(f"Status: {status}")
-        
-        # Listing information
-        listing_id = prop.get('listing_id', 'N/A')
-        property_id = prop.get('property_id', 'N/A')
-        list_date = prop.get('list_date', 'N/A')
-        
-        #print(f"Listing ID: {listing_id}")
-        #print(f"Property ID: {property_id}")
-        #print(f"List Date: {list_date}")
-        
-        # Images
-        primary_image = (prop.get('primary_photo') or {}).get('href', 'N/A')
-        #if primary_image != 'N/A':
-        #    print(f"Primary Image: {primary_image}")
-        
-        # Additional photos count
-        photos = prop.get('photos', [])
-        additional_photos = len(photos) - 1 if photos and len(photos) > 1 else 0
-        #if additional_photos > 0:
-        #    print(f"Additional Photos: {additional_photos}")
-        
-        # Virtual tours
-        virtual_tours = prop.get('virtual_tours', [])
-        virtual_tour = virtual_tours[0].get('href', 'N/A') if virtual_tours and len(virtual_tours) > 0 else 'N/A'
-        #if virtual_tour != 'N/A':
-        #    print(f"Virtual Tour: {virtual_tour}")
-        
-        # Listing agency
-        branding = prop.get('branding', [])
-        listed_by = branding[0].get('name', 'N/A') if branding and len(branding) > 0 else 'N/A'
-        #if listed_by != 'N/A':
-        #    print(f"Listed By: {listed_by}")
-        
-        # Permalink
-        permalink = prop.get('permalink', 'N/A')
-        listing_url = f"https://www.realtor.com/realestateandhomes-detail/{permalink}" if permalink != 'N/A' else 'N/A'
-        #print(f"Listing URL: {listing_url}")
-        
-        # Add data to records list
-        property_records.append({
-            "Address": address_line,
-            "City": city,
-            "State": state,
-            "Zip": zip_code,
-            "Price": price,
-            "Beds": beds,
-            "Baths": baths,
-            "Sq Ft": sqft,
-            "Lot Size (sq ft)": lot_sqft,
-            "Property Type": property_type_desc,
-            "Status": status,
-            "Listing ID": listing_id,
-            "Property ID": property_id,
-            "List Date": list_date,
-            "Primary Image": primary_image,
-            "Additional Photos": additional_photos,
-            "Virtual Tour": virtual_tour,
-            "Listed By": listed_by,
-            "Listing URL": listing_url
-        })
-    
-    # Create DataFrame from records
-    df = pd.DataFrame(property_records)
-    
-    #print(f"\n{'='*50}")
-    #print(f"Found {len(property_records)} properties.")
-    #print("Data stored in DataFrame")
-    
-    # Display DataFrame overview
-    #print("\nDataFrame Preview:")
-    #print(f"Shape: {df.shape}")
-    #print(df.head())
-    
-    return df
\ No newline at end of file
+    A fresh cached response is decompressed and decoded a chunk at a time.
+    Otherwise the body is decoded while it downloads and stored in the cache
+    once read completely. A stale cached response is streamed right away and
+    refreshed in the background (stale-while-revalidate, see ResponseCache).
+    When the same search is already streaming, it waits for that one to be
+    cached and streams the cached body.
+    
+    The fetch stage is recorded once the pages are read: the time to the
+    response headers plus the time spent reading the body, not the time the
+    parser spends on each page.
+    
+    Parameters:
+        endpoint (str): "/search/forrent" or "/search/forsale"
+        querystring (dict): Search parameters
+        api_key (str): Your RapidAPI key
+        client (RealtorClient, optional): HTTP client, defaults to the shared pooled client
+        cache (ResponseCache, optional): Response cache, defaults to the shared on-disk
+                                         cache. Pass False to always call the API.
+        page_size (int): Properties decoded per page
+    
+    Returns:
+        generator: Pages {'properties': [...]} for the display_and_store
+        functions, or None if the search failed
+    """
+    timer = StageTimer('fetch', feed=SEARCH_FEEDS.get(endpoint, endpoint))
+    with timer.running():
+        pages = open_stream(endpoint, querystring, api_key, client, cache, page_size, timer)
+    if pages is None:
+        timer.finish()
+    return pages
+
+def open_stream(endpoint, querystring, api_key, client, cache, page_size, timer):
+    """Send a search for stream_search, every body read is timed by timer"""
+    client = client or get_default_client()
+    if cache is not False:
+        cache = cache or get_default_cache()
+        body, state = cache.get_body(endpoint, querystring)
+        count('realtor_cache_requests_total', cache='response', result=state)
+        if body is not None and (state == FRESH or cache.offline):
+            return iter_array_pages(timer.timed_iter(iter_body_chunks(body, STREAM_CHUNK_SIZE)), page_size=page_size)
+        if body is not None and state == STALE:
+            # Served right away while the entry is refreshed in the background, as ResponseCache.fetch does
+            cache.revalidate(endpoint, querystring, lambda: refresh_stream(endpoint, querystring, api_key, client, cache))
+            return iter_array_pages(timer.timed_iter(iter_body_chunks(body, STREAM_CHUNK_SIZE)), page_size=page_size)
+        if cache.offline:
+            log_event('offline_miss', logging.WARNING, endpoint=endpoint, params=querystring)
+            return None
+    
+    broker = get_default_broker()
+    key = make_cache_key(endpoint, querystring)
+    flight, leader = broker.join(key)
+    if not leader and cache is not False:
+        count('realtor_broker_requests_total', priority=current_priority(), result='coalesced')
+        try:
+            result = broker.wait(flight, broker.max_queue_seconds)
+        except (TimeoutError, RequestShed):
+            result = None
+        if isinstance(result, dict):
+            # Led by a buffered search, its payload is already decoded
+            return timer.timed_iter(iter_payload_pages(result, page_size))
+        shared, state = cache.get_body(endpoint, querystring)
+        if shared is not None and state == FRESH:
+            return iter_array_pages(timer.timed_iter(iter_body_chunks(shared, STREAM_CHUNK_SIZE)),
+                                    page_size=page_size)
+        # The other stream failed or is still reading, send this one on its own
+    
+    # The leader holds a request slot until its body is read and cached, then
+    # hands over to the waiters, which read the cache or send their own request
+    held = ExitStack()
+    if leader:
+        held.callback(broker.finish, key, flight, UNSHARED)
+    try:
+        held.enter_context(broker.slot())
+        count('realtor_broker_requests_total', priority=current_priority(), result='sent')
+        response = client.get(endpoint, params=querystring, api_key=api_key, stream=True)
+    except RequestShed:
+        response = None
+    except requests.exceptions.RequestException as e:
+        log_event('api_error', logging.WARNING, endpoint=endpoint, location=querystring.get('location'),
+                  error=str(e))
+        response = None
+    if response is not None and response.status_code != 200:
+        log_event('api_error', logging.WARNING, endpoint=endpoint, location=querystring.get('location'),
+                  status=response.status_code)
+        response.close()
+        response = None
+    if response is None:
+        held.close()
+        return None
+    
+    def pages():
+        with held:
+            chunks = timer.timed_iter(read_streamed_body(response, endpoint, querystring, cache))
+            yield from iter_array_pages(chunks, page_size=page_size)
+            # Read what follows the properties too, so the whole body gets cached
+            for _ in chunks:
+                pass
+    
+    def release():
+        held.close()
+        timer.finish()
+    
+    generator = pages()
+    # A generator dropped before its first page never runs its body, free the slot anyway
+    weakref.finalize(generator, release)
+    return generator
+
+def iter_payload_pages(payload, page_size=250):
+    """Pages of a decoded search response, shaped like those of stream_search"""
+    properties = payload.get('properties') or []
+    for start in range(0, len(properties), page_size):
+        yield {'properties': properties[start:start + page_size]}
+
+def refresh_stream(endpoint, querystring, api_key, client, cache):
+    """
+    Download a search into the cache without decoding it, the background refresh
+    of a stale streamed search
+
+    Returns:
+        None: The body is stored by read_streamed_body, see ResponseCache.revalidate
+    """
+    with get_default_broker().slot():
+        count('realtor_broker_requests_total', priority=current_priority(), result='sent')
+        response = client.get(endpoint, params=querystring, api_key=api_key, stream=True)
+        if response.status_code != 200:
+            log_event('api_error', logging.WARNING, endpoint=endpoint, location=querystring.get('location'),
+                      status=response.status_code)
+            response.close()
+            return None
+        for _ in read_streamed_body(response, endpoint, querystring, cache):
+            pass
+    return None
+
+def read_streamed_body(response, endpoint, params, cache=None):
+    """
+    Iterate the body of a streamed response in chunks
+    
+    The chunks are compressed on the fly and the response is stored in cache
+    once the body is read to the end. The response is closed either way.
+    """
+    compressor = zlib.compressobj() if cache else None
+    compressed = []
+    size = 0
+    try:
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            size += len(chunk)
+            if compressor is not None:
+                compressed.append(compressor.compress(chunk))
+            yield chunk
+    finally:
+        response.close()
+    observe_bytes('realtor_api_payload_bytes', size, endpoint=endpoint)
+    if compressor is not None:
+        compressed.append(compressor.flush())
+        cache.set_body(endpoint, params, b''.join(compressed))
+
+# Async versions of the search functions. They run the blocking call on the
+# event loop's default executor, so every request still goes through the shared
+# pooled client and concurrent searches reuse the same connections.
+
+async def search_rental_properties_async(api_key, location, limit=1000, client=None, cache=None,
+                                         stream=False, query=None):
+    """Async version of search_rental_properties, see that function for parameters"""
+    client = client or get_default_client()
+    return await asyncio.to_thread(search_rental_properties, api_key, location, limit, client, cache,
+                                   stream=stream, query=query)
+
+async def search_properties_async(api_key, location, limit=1000, client=None, cache=None,
+                                  stream=False, query=None):
+    """Async version of search_properties, see that function for parameters"""
+    client = client or get_default_client()
+    return await asyncio.to_thread(search_properties, api_key, location, limit, client, cache,
+                                   stream=stream, query=query)
+
+async def fetch_rentals_and_properties(api_key, location, limit=1000, client=None, cache=None,
+                                      stream=False, rent_query=None, sale_query=None):
+    """
+    Fetch the for-rent and for-sale listings for a location at the same time
+    
+    Both searches are sent concurrently and each payload is parsed as soon as
+    it arrives, so the slower request no longer delays parsing the faster one.
+    
+    Parameters:
+        api_key (str): Your RapidAPI key
+        location (str): Zip, e.g. 63122 or City and state, e.g., "Kirkwood, MO"
+        limit (int, optional): Maximum number of results per search
+        client (RealtorClient, optional): HTTP client, defaults to the shared pooled client
+        cache (ResponseCache, optional): Response cache, defaults to the shared on-disk cache
+        stream (bool): Decode each body while it downloads, in the parsing
+                       thread, see stream_search
+        rent_query, sale_query (SearchQuery, optional): Filters of each search,
+                                pushed down to the API where it supports them
+                                and applied to the parsed listings otherwise
+    
+    Returns:
+        tuple: (rental DataFrame, for-sale DataFrame), either may be None
+    """
+    client = client or get_default_client()
+
+    async def fetch_rentals():
+        results = await search_rental_properties_async(api_key, location, limit, client, cache, stream,
+                                                       rent_query)
+        if not results:
+            return None
+        df_rent = await asyncio.to_thread(display_and_store_rentals, results)
+        return rent_query.apply(df_rent) if rent_query is not None else df_rent
+
+    async def fetch_properties():
+        results = await search_properties_async(api_key, location, limit, client, cache, stream, sale_query)
+        if not results:
+            return None
+        df_sale = await asyncio.to_thread(display_and_store_properties, results)
+        return sale_query.apply(df_sale) if sale_query is not None else df_sale
+
+    df_rent, df_sale = await asyncio.gather(fetch_rentals(), fetch_properties())
+    return df_rent, df_sale
@@ -1,5 +1,10 @@
 ### Import Libraries
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import asyncio
+import logging
+import os
+import threading
 import requests
 import pandas as pd
 import json
@@ -8,12 +13,197 @@ import pydeck as pdk
 from api_functions import search_rental_properties, display_and_store_rentals
 from api_functions import search_properties, display_and_store_properties
 from data_processing import generate_rent_summary, calculate_investment_metrics, geocode_addresses
+from data_processing import rank_listings
+from listing_store import get_default_store, RENTALS, SALES
+from thumbnail_cache import get_default_thumbnail_cache
+from search_query import SearchQuery
+from instrumentation import configure_logging, start_trace, span, log_event
+from instrumentation import cache_hit_ratio, prometheus_text, start_metrics_server
+from request_broker import get_default_broker
 
 # Configuration Secrets
 REALTOR_API_KEY = st.secrets.realtor_api_key.REALTOR_API_KEY
 MAPBOX_API_KEY = st.secrets.mapbox_api_key.MAPBOX_API_KEY
 pdk.settings.mapbox_key = MAPBOX_API_KEY
 
+# Structured logs on stderr, Prometheus metrics on REALTOR_METRICS_PORT if set
+configure_logging()
+
+@st.cache_resource
+def metrics_server(port):
+    return start_metrics_server(port)
+
+if os.environ.get('REALTOR_METRICS_PORT'):
+    metrics_server(int(os.environ['REALTOR_METRICS_PORT']))
+
+# Spans of this script run, for the debug panel
+trace = start_trace()
+
+# Each pipeline stage is memoized separately, keyed on the zip and the
+# parameters it depends on, and shared across reruns and sessions. Changing the
+# expense assumption only recomputes the metrics stage, the map depends on the
+# listings alone. The price, beds and
+# baths filters are sent with the for-sale search (sale_query), so they select
+# what is downloaded; rentals are always fetched in full as rent comps, so the
+# rentals and their summary are keyed on the zip alone and a filter change only
+# fetches the listings for sale again.
+CACHE_TTL_SECONDS = 3600
+CACHE_MAX_ENTRIES = 64
+
+def snapshot_listings(df, table, zip_code):
+    # Keep a snapshot of new and changed listings to compare runs later
+    try:
+        get_default_store().upsert(df, table)
+    except Exception as e:
+        log_event('snapshot_error', logging.WARNING, zip_code=zip_code, error=str(e))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_rentals(zip_code):
+    """Fetch and parse the for rent listings of a zip"""
+    df_rent = display_and_store_rentals(
+        search_rental_properties(api_key=REALTOR_API_KEY, location=zip_code, stream=True))
+    if df_rent is None:
+        # Raising keeps the failure out of the cache so the next search retries
+        raise LookupError(f"Could not fetch rentals for {zip_code}")
+    snapshot_listings(df_rent, RENTALS, zip_code)
+    return df_rent
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sales(zip_code, sale_query=None):
+    """Fetch and parse the for sale listings of a zip matching the pushed down filters"""
+    df_sale = display_and_store_properties(
+        search_properties(api_key=REALTOR_API_KEY, location=zip_code, stream=True, query=sale_query))
+    if df_sale is None:
+        raise LookupError(f"Could not fetch listings for {zip_code}")
+    snapshot_listings(df_sale, SALES, zip_code)
+    return df_sale
+
+def in_script_run(func):
+    """Run func from another thread as part of this script run, so st.cache_data can be used there"""
+    ctx = get_script_run_ctx()
+    def run(*args):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args)
+    return run
+
+def load_listings(zip_code, sale_query=None):
+    """The for rent and for sale listings of a zip, the stages not cached yet are fetched concurrently"""
+    async def load():
+        return await asyncio.gather(asyncio.to_thread(in_script_run(load_rentals), zip_code),
+                                    asyncio.to_thread(in_script_run(load_sales), zip_code, sale_query))
+    return asyncio.run(load())
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_rent_summary(zip_code):
+    return generate_rent_summary(load_rentals(zip_code))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_investment_metrics(zip_code, expense_ratio, sale_query=None):
+    """Every listing of a zip with its metrics, best cap rate first"""
+    return calculate_investment_metrics(load_sales(zip_code, sale_query), load_rent_summary(zip_code),
+                                        expense_ratio, k=None)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_map(zip_code, sale_query=None):
+    """Coordinates of the listings for sale, which do not depend on the investment assumptions"""
+    return geocode_addresses(df=load_sales(zip_code, sale_query))
+
+# Only one page of property cards is rendered. Sorting and paging happen on
+# the typed DataFrame and rerun just this fragment, not the whole page.
+SORT_COLUMNS = ['Cap Rate', 'NOI', 'Estimated Annual Rent', 'Listing Price', 'Sq Ft']
+PAGE_SIZES = [10, 25, 50]
+
+def render_property_card(row, thumbnail):
+    # Create a container for each property
+    property_container = st.container()
+
+    with property_container:
+        cols = st.columns([2, 3])
+
+        # Column 1: Image
+        with cols[0]:
+            st.image(thumbnail, use_column_width=True)
+
+        # Column 2: Property details with reduced top padding
+        with cols[1]:
+            st.markdown(f"""
+                <div style='line-height: 1.1; padding-top: 0; margin-top: -10px;'>
+                    <h3 style='margin-bottom: 0.2rem; margin-top: 0;'>{row['Address']}</h3>
+                    <p style='margin-bottom: 0.2rem;'>{row['City']}, {row['State']} {row['Zip']}</p>
+                    <p style='font-size: 1.2rem; font-weight: 500;'>${row['Listing Price']:,.0f}</p>
+                </div>
+            """, unsafe_allow_html=True)
+
+            # Add listing price prominently after location
+            #st.markdown(f"### {row['Listing Price']}")
+
+            # Property specs
+            specs_cols = st.columns(3)
+            specs_cols[0].metric("Beds", row['Beds'])
+            specs_cols[1].metric("Baths", row['Baths'])
+            specs_cols[2].metric("Sq Ft", row['Sq Ft'])
+
+
+            # Financial details
+            st.write(f"**Type:** {row['Property Type']} | **Status:** {row['Status']}")
+
+            # Investment metrics with proper formatting
+            metrics_cols = st.columns(3)
+            metrics_cols[0].metric("Annual Rent", f"${row['Estimated Annual Rent']:,.0f}")
+            metrics_cols[1].metric("NOI", f"${row['NOI']:,.0f}")
+            metrics_cols[2].metric("Cap Rate", f"{row['Cap Rate']:.1f}%")
+
+            # Add a link to the listing
+            st.markdown(f"[View Listing]({row['Listing URL']})")
+
+    # Add a divider between properties
+    st.divider()
+
+@st.fragment
+def render_listings(listings):
+    with span('render', section='listings'):
+        st.title("Property Listings")
+        if listings.empty:
+            st.write('No listings match the filters.')
+            return
+
+        sort_cols = st.columns(3)
+        sort_key = sort_cols[0].selectbox('Sort by', SORT_COLUMNS)
+        ascending = sort_cols[1].selectbox('Order', ['Highest first', 'Lowest first']) == 'Lowest first'
+        page_size = sort_cols[2].selectbox('Per page', PAGE_SIZES)
+
+        page_count = -(-len(listings) // page_size)
+        # Filters may leave fewer pages than the one last shown
+        if st.session_state.get('listing_page', 1) > page_count:
+            st.session_state['listing_page'] = page_count
+        page = st.number_input(f'Page (of {page_count})', min_value=1, max_value=page_count,
+                               key='listing_page')
+
+        # Partial selection of just this page, missing values rank last
+        positions = rank_listings(listings[sort_key].to_numpy(dtype='float64', na_value=float('nan')),
+                                  k=page_size, ascending=ascending, offset=(page - 1) * page_size)
+        first = (page - 1) * page_size + 1
+        st.caption(f"Showing {first}-{first + len(positions) - 1} of {len(listings)} listings")
+        page_listings = listings.iloc[positions]
+        # Small cached thumbnails instead of the full-size photos, fetched together
+        thumbnails = get_default_thumbnail_cache().thumbnails(page_listings['Primary Image'].tolist())
+        for (_, row), thumbnail in zip(page_listings.iterrows(), thumbnails):
+            render_property_card(row, thumbnail)
+
+        # Every matching listing, sorted, serialized only when clicked
+        def listings_csv():
+            ranked = rank_listings(listings[sort_key].to_numpy(dtype='float64', na_value=float('nan')),
+                                   k=None, ascending=ascending)
+            return listings.iloc[ranked].to_csv(index=False)
+
+        st.download_button(
+            label=f"Download all {len(listings)} listings as CSV",
+            data=listings_csv,
+            file_name="forsale_listings.csv",
+            mime="text/csv",
+            on_click='ignore',
+        )
+
 # Set page title and description
 st.title('Realtor.com Rental Property Finder')
 st.write('Enter a zip code to find available rental properties in that area.')
@@ -27,95 +217,129 @@ with st.form(key='zip_search_form'):
 if zip_code and not (zip_code.isdigit() and len(zip_code) == 5):
     st.warning('Please enter a valid 5-digit zip code')
 
-# Only process when the search button is clicked and zip code is valid
+# Remember the searched zip so later interactions keep showing its results
 if search_button and zip_code and zip_code.isdigit() and len(zip_code) == 5:
+    st.session_state['searched_zip'] = zip_code
+searched_zip = st.session_state.get('searched_zip')
+
+show_debug = st.sidebar.checkbox('Show debug panel')
+
+expense_percent = st.slider('Projected expenses (% of annual rent)', 0, 100, 50, step=5)
+expense_ratio = expense_percent / 100
+
+# Only process once a valid zip code has been searched
+if searched_zip:
+    # Filters apply to the map and the listings. Price, beds and baths are sent
+    # with the search, property types and status are applied to its results.
+    with st.sidebar:
+        st.subheader('Filter Listings')
+        min_beds = st.selectbox('Minimum Bedrooms', [None, 1, 2, 3, 4, 5],
+                                format_func=lambda v: 'Any' if v is None else str(v))
+        min_baths = st.selectbox('Minimum Bathrooms', [None, 1, 1.5, 2, 3],
+                                 format_func=lambda v: 'Any' if v is None else f'{v:g}')
+        min_price = st.number_input('Minimum Price ($, 0 for any)', min_value=0, value=0, step=25000)
+        max_price = st.number_input('Maximum Price ($, 0 for any)', min_value=0, value=0, step=25000)
+    sale_query = SearchQuery(min_price=min_price or None, max_price=max_price or None,
+                             min_beds=min_beds, min_baths=min_baths)
+
     with st.spinner('Fetching properties...'):
-        # Fetch API
-        results = search_rental_properties(api_key=REALTOR_API_KEY, location=zip_code)
+        try:
+            _, df_sale = load_listings(searched_zip, sale_query)
+            rent_summary = load_rent_summary(searched_zip)
+            if df_sale.empty:
+                st.info('No listings for sale match these filters.')
+                st.stop()
+            sale_results = load_investment_metrics(searched_zip, expense_ratio, sale_query)
+        except LookupError:
+            st.error('Could not fetch listings for this zip code. Please try again.')
+            st.stop()
 
-        if results:
-            # Store results in DataFrame and display
-            df_rent = display_and_store_rentals(results)
-            rent_summary = generate_rent_summary(df_rent)
+        with st.sidebar:
+            property_types = st.multiselect('Property Types',
+                                            sorted(sale_results['Property Type'].dropna().unique()))
+            statuses = st.multiselect('Status', sorted(set(
+                label for status in sale_results['Status'].dropna().unique() for label in status.split(', '))))
+        # One mask over every listing of the search for the cards, the map applies the same query
+        query = SearchQuery(min_price=sale_query.min_price, max_price=sale_query.max_price, min_beds=min_beds,
+                            min_baths=min_baths, property_types=property_types, statuses=statuses)
+        mask = query.mask(sale_results)
+        filtered_results = sale_results[mask]
 
-        
-        # Fetch For Sale Results as well
-        sale_results = search_properties(api_key=REALTOR_API_KEY, location=zip_code)
-        if sale_results:
-            # Store results in DataFrame and display
-            df_sale = display_and_store_properties(sale_results)
-            sale_results = calculate_investment_metrics(df_sale, rent_summary)
-
-        # Display as interactive table
-        st.subheader('Rental Summary of Available Properties')
-
-        # Apply styling to the dataframe
-        styled_summary_rent = rent_summary.style.format({
-            'Min Rent': '${:.0f}',
-            'Median Rent': '${:.0f}',
-            'Max Rent': '${:.0f}',
-            'Count': '{:.0f}',
-            'Beds': '{:.0f}'
-        }).set_properties(**{
-            'text-align': 'center',
-            'font-size': '14px',
-            'border': '1px solid #EAEAEA'
-        }).set_table_styles([
-            {'selector': 'th', 'props': [('background-color', '#f2f2f2'), 
-                                        ('color', '#333'), 
-                                        ('font-weight', 'bold'),
-                                        ('text-align', 'center')]},
-            {'selector': 'tr:hover', 'props': [('background-color', '#f9f9f9')]},
-        ])
-
-        # Display the styled dataframe
-        st.dataframe(styled_summary_rent, use_container_width=True, height=400)
-
-        # Add download button for the data
-        rent_csv = rent_summary.to_csv(index=False)
-        st.download_button(
-            label="Download data as CSV",
-            data=rent_csv,
-            file_name="rental_summary.csv",
-            mime="text/csv",
-        )
+        with span('render', section='summary'):
+            # Display as interactive table
+            st.subheader('Rental Summary of Available Properties')
+
+            # Apply styling to the dataframe
+            styled_summary_rent = rent_summary.style.format({
+                'Min Rent': '${:.0f}',
+                'Median Rent': '${:.0f}',
+                'Max Rent': '${:.0f}',
+                'Count': '{:.0f}',
+                'Beds': '{:.0f}'
+            }).set_properties(**{
+                'text-align': 'center',
+                'font-size': '14px',
+                'border': '1px solid #EAEAEA'
+            }).set_table_styles([
+                {'selector': 'th', 'props': [('background-color', '#f2f2f2'), 
+                                            ('color', '#333'), 
+                                            ('font-weight', 'bold'),
+                                            ('text-align', 'center')]},
+                {'selector': 'tr:hover', 'props': [('background-color', '#f9f9f9')]},
+            ])
 
-        ### Geo Information
-        st.title("Address Map Visualization")
+            # Display the styled dataframe
+            st.dataframe(styled_summary_rent, use_container_width=True, height=400)
+
+            # Add download button for the data
+            rent_csv = rent_summary.to_csv(index=False)
+            st.download_button(
+                label="Download data as CSV",
+                data=rent_csv,
+                file_name="rental_summary.csv",
+                mime="text/csv",
+            )
 
-        # Get Locations
-        map_df, map_center = geocode_addresses(df = sale_results)
+        with span('render', section='map'):
+            ### Geo Information
+            st.title("Address Map Visualization")
 
-        if len(map_df) > 0:
-            st.subheader("Map of Addresses")
+            # Get Locations
+            map_df, map_center = load_map(searched_zip, sale_query)
+            # Only the listings passing the filters, with the columns the map reads. The
+            # filters read listing columns only, so they apply to the map rows directly.
+            map_df = map_df.loc[query.mask(map_df), ['longitude', 'latitude', 'Address']]
+            if len(map_df) > 0:
+                map_center = [map_df['latitude'].mean(), map_df['longitude'].mean()]
+                st.subheader("Map of Addresses")
         
-        map_view = st.pydeck_chart(pdk.Deck(
-            map_style='mapbox://styles/mapbox/streets-v11',
-            initial_view_state=pdk.ViewState(
-                latitude=map_center[0],
-                longitude=map_center[1],
-                zoom=13,
-                pitch=0,
-            ),
-            layers=[
-                pdk.Layer(
-                    'ScatterplotLayer',
-                    data=map_df,
-                    get_position='[longitude, latitude]',
-                    get_color='[200, 30, 0, 160]',
-                    get_radius=50,
-                    pickable=True,
-                    auto_highlight=True
-                )],
-            tooltip={
-                "html": "<b>Address:</b> {Address}",
-                "style": {
-                    "backgroundColor": "steelblue",
-                    "color": "white"
+            map_view = st.pydeck_chart(pdk.Deck(
+                map_style='mapbox://styles/mapbox/streets-v11',
+                initial_view_state=pdk.ViewState(
+                    latitude=map_center[0],
+                    longitude=map_center[1],
+                    zoom=13,
+                    pitch=0,
+                ),
+                layers=[
+                    pdk.Layer(
+                        'ScatterplotLayer',
+                        data=map_df,
+                        get_position='[longitude, latitude]',
+                        get_color='[200, 30, 0, 160]',
+                        get_radius=50,
+                        pickable=True,
+                        auto_highlight=True
+                    )],
+                tooltip={
+                    "html": "<b>Address:</b> {Address}",
+                    "style": {
+                        "backgroundColor": "steelblue",
+                        "color": "white"
+                        }
                     }
-                }
+                )
             )
-        )
 
 
         # #Display For Sale Properties
@@ -160,57 +384,30 @@ if search_button and zip_code and zip_code.isdigit() and len(zip_code) == 5:
         # #max_price = st.slider('Maximum Price ($)', 500, 10000, 10000, step=100)
 
 
-        st.title("Property Listings")
-
-        # Create a card for each property
-        for i, row in sale_results.iterrows():
-            # Create a container for each property
-            property_container = st.container()
-            
-            with property_container:
-                cols = st.columns([2, 3])
-                
-                # Column 1: Image
-                with cols[0]:
-                    st.image(row['Primary Image'], use_column_width=True)
-                
-                # Column 2: Property details with reduced top padding
-                with cols[1]:
-                    st.markdown(f"""
-                        <div style='line-height: 1.1; padding-top: 0; margin-top: -10px;'>
-                            <h3 style='margin-bottom: 0.2rem; margin-top: 0;'>{row['Address']}</h3>
-                            <p style='margin-bottom: 0.2rem;'>{row['City']}, {row['State']} {row['Zip']}</p>
-                            <p style='font-size: 1.2rem; font-weight: 500;'>${row['Listing Price']:,.0f}</p>
-                        </div>
-                    """, unsafe_allow_html=True)
-
-                    # Add listing price prominently after location
-                    #st.markdown(f"### {row['Listing Price']}")
-                    
-                    # Property specs
-                    specs_cols = st.columns(3)
-                    specs_cols[0].metric("Beds", row['Beds'])
-                    specs_cols[1].metric("Baths", row['Baths'])
-                    specs_cols[2].metric("Sq Ft", row['Sq Ft'])
-
-                    
-                    # Financial details
-                    st.write(f"**Type:** {row['Property Type']} | **Status:** {row['Status']}")
-                    
-                    # Investment metrics with proper formatting
-                    metrics_cols = st.columns(3)
-                    metrics_cols[0].metric("Annual Rent", f"${row['Estimated Annual Rent']:,.0f}")
-                    metrics_cols[1].metric("NOI", f"${row['NOI']:,.0f}")
-                    metrics_cols[2].metric("Cap Rate", f"{row['Cap Rate']:.1f}%")
-                    
-                    # Add a link to the listing
-                    st.markdown(f"[View Listing]({row['Listing URL']})")
-            
-            # Add a divider between properties
-            st.divider()
-
-
-
-
+        render_listings(filtered_results)
 
 
+# Where the time of this run went. Stages served from st.cache_data do not run
+# and so do not appear.
+if show_debug:
+    with st.sidebar:
+        st.subheader('Debug')
+        if trace:
+            timings = pd.DataFrame(trace).fillna('')
+            timings['ms'] = (timings.pop('seconds') * 1000).round(1)
+            st.dataframe(timings, use_container_width=True)
+            st.write(f"Total: {timings['ms'].sum():,.0f} ms")
+        else:
+            st.write('No stage ran, every result came from the cache')
+        for cache in ['response', 'geocode']:
+            ratio = cache_hit_ratio(cache)
+            if ratio is not None:
+                st.write(f"{cache.capitalize()} cache hit ratio: {ratio:.0%}")
+        broker = get_default_broker().stats()
+        for name, quota in broker['quota'].items():
+            limit = f" of {quota['limit']:,.0f}" if quota['limit'] else ''
+            reset = f", resets in {quota['reset_in']:,.0f}s" if quota['reset_in'] is not None else ''
+            st.write(f"API quota ({name}): {quota['remaining']:,.0f}{limit} left{reset}")
+        st.write(f"API requests in flight: {broker['in_flight']}, waiting: {sum(broker['waiting'].values())}")
+        with st.expander('Prometheus metrics'):
+            st.code(prometheus_text(), language='text')
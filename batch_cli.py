@@ -0,0 +1,443 @@
+### Headless batch screening of many zips or metros
+# Runs the app's pipeline (search, parse, rent summary, investment metrics)
+# for every location of an input file across a pool of worker processes,
+# without Streamlit. Run from the repository root:
+#     python batch_cli.py zips.txt --output runs/nightly --workers 4
+# The input file holds one zip, city or metro name per line ('#' starts a
+# comment); metro names are expanded with --metro-zips, a JSON file mapping
+# names to lists of zips, and "City, ST" names to the zips of the city. The
+# API key comes from --api-key, the REALTOR_API_KEY environment variable or
+# .streamlit/secrets.toml.
+#
+# Every finished location is checkpointed under <output>/checkpoints and
+# logged to <output>/checkpoint.jsonl, so rerunning the same command resumes
+# where an interrupted or partly failed run stopped. Checkpoints made with
+# another --limit, --expense-ratio or filters are not reused. Once every
+# location ran, the merged rentals.parquet, investments.parquet/.csv, the
+# rent_summary.csv of every location (and changes.csv with --detect-changes)
+# and a report.json are written.
+# --min-price, --max-price, --min-beds and --min-baths are sent with the
+# for-sale searches; --property-type and --status filter their results.
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+import tomllib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from api_client import get_default_client
+from api_functions import display_and_store_rentals, display_and_store_properties
+from batch_search import expand_locations, fetch_locations_async, merge_listings
+from change_detection import refresh_listings
+from data_processing import generate_rent_summary, investment_metric_arrays, rank_listings
+from data_processing import INVESTMENT_METRICS
+from instrumentation import configure_logging, log_event
+from listing_store import get_default_store, RENTALS, SALES
+from request_broker import set_request_priority, LOW
+from search_query import SearchQuery
+
+CHECKPOINT_LOG = 'checkpoint.jsonl'
+OK = 'ok'
+FAILED = 'failed'
+
+RENT_SUMMARY_COLUMNS = ['Search Location', 'Property Type', 'Beds', 'Baths', 'Count', 'Min Rent',
+                        'Median Rent', 'Max Rent']
+
+
+def read_locations(path):
+    """Locations of an input file, one per line, blank lines and '#' comments skipped"""
+    with open(path) as f:
+        lines = (line.split('#', 1)[0].strip() for line in f)
+        return [line for line in lines if line]
+
+
+def read_api_key(api_key=None, secrets_path=os.path.join('.streamlit', 'secrets.toml')):
+    """
+    The RapidAPI key, from the argument, the environment or the Streamlit secrets file
+
+    Returns:
+        str: The key, or None when none is configured
+    """
+    if api_key:
+        return api_key
+    if os.environ.get('REALTOR_API_KEY'):
+        return os.environ['REALTOR_API_KEY']
+    if os.path.exists(secrets_path):
+        with open(secrets_path, 'rb') as f:
+            secrets = tomllib.load(f)
+        return secrets.get('realtor_api_key', {}).get('REALTOR_API_KEY')
+    return None
+
+
+def location_slug(location):
+    """File system safe name of a location, e.g. 'Kirkwood, MO' -> 'kirkwood-mo'"""
+    return re.sub(r'[^0-9a-z]+', '-', location.lower()).strip('-') or 'location'
+
+
+def read_checkpoints(output):
+    """
+    Latest checkpoint record of every location of a previous run
+
+    Returns:
+        dict: location -> record, see screen_location for its fields
+    """
+    path = os.path.join(output, CHECKPOINT_LOG)
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash
+                continue
+            records[record['location']] = record
+    return records
+
+
+### Worker processes
+
+# Set once per worker process by init_worker
+_worker = {}
+
+
+def init_worker(api_key, requests_per_second, cache_enabled, log_level):
+    configure_logging(log_level)
+    # Batch searches leave part of the API quota to the interactive app
+    set_request_priority(LOW)
+    _worker['api_key'] = api_key
+    _worker['client'] = get_default_client()
+    _worker['cache'] = None if cache_enabled else False
+    # Every process gets an equal share of the total request rate
+    _worker['requests_per_second'] = requests_per_second
+
+
+def fetch_location(location, limit, sale_query=None):
+    """Raw rent and sale search responses of one location, fetched concurrently"""
+    [(_, rent_results, sale_results)] = asyncio.run(fetch_locations_async(
+        _worker['api_key'], [location], max_concurrency=2, requests_per_second=_worker['requests_per_second'],
+        limit=limit, client=_worker['client'], cache=_worker['cache'], sale_query=sale_query))
+    return rent_results, sale_results
+
+
+def screen_location(location, directory, limit, expense_ratio, detect, sale_query=None):
+    """
+    Run the pipeline for one location and checkpoint its results to directory
+
+    The files are written to a temporary directory renamed into place at the
+    end, so a checkpoint directory is always complete. Rentals are never
+    filtered, they are the rent comps of every listing for sale. With detect,
+    only the listings that changed since the previous run of the location are
+    parsed, see change_detection.refresh_listings.
+
+    Returns:
+        dict: Checkpoint record with the location, status, listing counts,
+              seconds and, for failures, the error
+    """
+    start = time.perf_counter()
+    record = {'location': location, 'directory': directory}
+    try:
+        rent_results, sale_results = fetch_location(location, limit, sale_query)
+        if not rent_results or not sale_results:
+            raise LookupError(f"Could not fetch listings for {location}")
+
+        if detect:
+            # Only what changed since the previous run of the same searches is parsed
+            reports = []
+            parsed = {}
+            for feed, results, query, parse in [
+                    ('rent', rent_results, None, display_and_store_rentals),
+                    ('sale', sale_results, sale_query, display_and_store_properties)]:
+                # A search cut short by the limit does not show what was delisted
+                complete = len(results.get('properties') or []) < limit
+                parsed[feed], delta = refresh_listings(results, feed, change_scope(location, query), parse,
+                                                       complete=complete)
+                reports.append(delta.report.assign(Feed=feed, **{'Search Location': location}))
+            df_rent, df_sale = parsed['rent'], parsed['sale']
+            changes = pd.concat(reports, ignore_index=True)
+            record['changes'] = int(len(changes))
+        else:
+            df_rent = display_and_store_rentals(rent_results)
+            df_sale = display_and_store_properties(sale_results)
+        if df_rent is None or df_sale is None:
+            raise ValueError(f"Could not parse the listings of {location}")
+        if sale_query is not None:
+            df_sale = sale_query.apply(df_sale)
+        rent_summary = generate_rent_summary(df_rent)
+        investments = df_sale.copy()
+        investments['Search Location'] = location
+        for name, values in investment_metric_arrays(df_sale, rent_summary, expense_ratio).items():
+            investments[name] = values
+
+        temp = f"{directory}.tmp"
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        df_rent.assign(**{'Search Location': location}).to_parquet(
+            os.path.join(temp, 'rentals.parquet'), index=False)
+        investments.to_parquet(os.path.join(temp, 'investments.parquet'), index=False)
+
+        if detect:
+            changes.to_parquet(os.path.join(temp, 'changes.parquet'), index=False)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(temp, directory)
+        record.update(status=OK, rentals=int(len(df_rent)), sales=int(len(df_sale)),
+                      rent_groups=int(len(rent_summary)))
+    except Exception as e:
+        record.update(status=FAILED, error=f"{type(e).__name__}: {e}")
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def change_scope(location, query=None):
+    """
+    Change detection scope of a search, e.g. '63122' or '63122 {"max_price": 400000}'
+
+    Listings are only compared with the previous fetch of the same location
+    and pushed down filters, so changing the filters reports no delistings.
+    """
+    filters = query.pushed_down().to_dict() if query is not None else {}
+    return f"{location} {json.dumps(filters, sort_keys=True)}" if filters else location
+
+
+### Parent process
+
+def checkpoint_settings(limit, expense_ratio, sale_query=None):
+    """Settings that shape the results of a location, recorded with its checkpoint"""
+    return {'limit': limit, 'expense_ratio': expense_ratio,
+            'filters': sale_query.to_dict() if sale_query is not None else {}}
+
+
+def run_locations(locations, output, workers=4, api_key=None, requests_per_second=5, cache_enabled=True,
+                  limit=1000, expense_ratio=0.5, detect=False, retries=1, snapshot=False,
+                  log_level=logging.WARNING, sale_query=None):
+    """
+    Screen every location that has no successful checkpoint with the same settings yet
+
+    Locations are spread over a pool of worker processes sharing the request
+    rate. Failed locations are attempted again up to retries times. Only this
+    process writes the checkpoint log and the listing store. Checkpoints made
+    with another limit, expense ratio or filters are screened again.
+
+    Returns:
+        dict: location -> latest checkpoint record, in input order
+    """
+    records = read_checkpoints(output)
+    settings = checkpoint_settings(limit, expense_ratio, sale_query)
+    stale = [loc for loc in locations
+             if records.get(loc, {}).get('status') == OK and records[loc].get('settings') != settings]
+    if stale:
+        log_event('batch_settings_changed', logging.WARNING, locations=len(stale), settings=settings)
+    pending = [loc for loc in locations
+               if records.get(loc, {}).get('status') != OK or not os.path.isdir(records[loc]['directory'])
+               or loc in stale]
+    resumed = len(locations) - len(pending)
+    if resumed:
+        log_event('batch_resume', locations=len(locations), done=resumed, pending=len(pending))
+    if not pending:
+        return {loc: records[loc] for loc in locations}
+
+    os.makedirs(os.path.join(output, 'checkpoints'), exist_ok=True)
+    per_worker_rate = requests_per_second / workers if requests_per_second else None
+    with open(os.path.join(output, CHECKPOINT_LOG), 'a') as log, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(api_key, per_worker_rate, cache_enabled, log_level)) as pool:
+        for _ in range(1 + retries):
+            if not pending:
+                break
+            futures = [pool.submit(screen_location, loc,
+                                   os.path.join(output, 'checkpoints', location_slug(loc)),
+                                   limit, expense_ratio, detect, sale_query)
+                       for loc in pending]
+            pending = []
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                record['attempts'] = records.get(record['location'], {}).get('attempts', 0) + 1
+                record['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+                record['settings'] = settings
+                records[record['location']] = record
+                # One line per finished location, flushed so a crash loses nothing
+                log.write(json.dumps(record) + '\n')
+                log.flush()
+                os.fsync(log.fileno())
+
+                if record['status'] == OK:
+                    if snapshot:
+                        snapshot_location(record)
+                    print(f"[{done}/{len(futures)}] {record['location']}: {record['sales']} for sale, "
+                          f"{record['rentals']} for rent ({record['seconds']:.1f}s)", flush=True)
+                else:
+                    pending.append(record['location'])
+                    print(f"[{done}/{len(futures)}] {record['location']}: {record['error']}", flush=True)
+    return {loc: records[loc] for loc in locations}
+
+
+def snapshot_location(record):
+    """Upsert the listings of one checkpoint into the shared listing store"""
+    directory = record['directory']
+    try:
+        store = get_default_store()
+        store.upsert(pd.read_parquet(os.path.join(directory, 'rentals.parquet'))
+                     .drop(columns=['Search Location']), RENTALS)
+        store.upsert(pd.read_parquet(os.path.join(directory, 'investments.parquet'))
+                     .drop(columns=INVESTMENT_METRICS + ['Search Location']), SALES)
+    except Exception as e:
+        log_event('snapshot_error', logging.WARNING, location=record['location'], error=str(e))
+
+
+def merge_outputs(records, output):
+    """
+    Merge the checkpoints of the successful locations into the run outputs
+
+    Listings found by more than one location are kept once. Investments are
+    ranked by cap rate, best first. The rent summary holds one
+    generate_rent_summary table per location, built from the rentals of its
+    checkpoint: the medians that priced its investments.
+
+    Returns:
+        tuple: (output name -> path of the files written, number of rentals,
+                number of investments)
+    """
+    done = [r for r in records.values() if r['status'] == OK]
+
+    def read(name):
+        paths = [os.path.join(r['directory'], name) for r in done]
+        return [pd.read_parquet(path) for path in paths if os.path.exists(path)]
+
+    outputs = {}
+    rentals = read('rentals.parquet')
+    df_rent = merge_listings(rentals)
+    investments = merge_listings(read('investments.parquet'))
+    if not investments.empty:
+        ranked = rank_listings(investments['Cap Rate'].to_numpy(dtype='float64', na_value=float('nan')), k=None)
+        investments = investments.iloc[ranked].reset_index(drop=True)
+
+    outputs['rentals'] = os.path.join(output, 'rentals.parquet')
+    df_rent.to_parquet(outputs['rentals'], index=False)
+    outputs['investments'] = os.path.join(output, 'investments.parquet')
+    investments.to_parquet(outputs['investments'], index=False)
+    outputs['investments_csv'] = os.path.join(output, 'investments.csv')
+    investments.to_csv(outputs['investments_csv'], index=False)
+
+    summaries = [generate_rent_summary(rent).assign(**{'Search Location': rent['Search Location'].iloc[0]})
+                 for rent in rentals if not rent.empty]
+    summary = pd.concat(summaries, ignore_index=True) if summaries else pd.DataFrame(columns=RENT_SUMMARY_COLUMNS)
+    outputs['rent_summary'] = os.path.join(output, 'rent_summary.csv')
+    summary[RENT_SUMMARY_COLUMNS].to_csv(outputs['rent_summary'], index=False)
+
+    changes = read('changes.parquet')
+    if changes:
+        outputs['changes'] = os.path.join(output, 'changes.csv')
+        pd.concat(changes, ignore_index=True).to_csv(outputs['changes'], index=False)
+    return outputs, len(df_rent), len(investments)
+
+
+def sale_query_from_arguments(args):
+    return SearchQuery(min_price=args.min_price, max_price=args.max_price, min_beds=args.min_beds,
+                       min_baths=args.min_baths, property_types=args.property_type, statuses=args.status)
+
+
+def write_report(path, args, records, outputs, rentals, sales, started, seconds):
+    """Write the run report, a JSON summary of the run and of every location"""
+    failed = [r for r in records.values() if r['status'] != OK]
+    report = {
+        'started': started,
+        'seconds': round(seconds, 1),
+        'input': args.input,
+        'locations': len(records),
+        'succeeded': len(records) - len(failed),
+        'failed': len(failed),
+        'rentals': rentals,
+        'investments': sales,
+        'settings': {'workers': args.workers, 'requests_per_second': args.requests_per_second,
+                     'limit': args.limit, 'expense_ratio': args.expense_ratio,
+                     'retries': args.retries, 'cache': not args.no_cache,
+                     'detect_changes': args.detect_changes, 'snapshot': args.snapshot,
+                     'filters': sale_query_from_arguments(args).to_dict()},
+        'outputs': outputs,
+        'failures': {r['location']: r.get('error') for r in failed},
+        'per_location': list(records.values()),
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch screening of many zips or metros")
+    parser.add_argument('input', help="File with one zip, city or metro per line")
+    parser.add_argument('--output', default=os.path.join('runs', datetime.date.today().isoformat()),
+                        help="Directory of the checkpoints and outputs, reused to resume a run")
+    parser.add_argument('--metro-zips', help="JSON file mapping metro or city names to lists of zips")
+    parser.add_argument('--api-key', help="RapidAPI key, defaults to $REALTOR_API_KEY or .streamlit/secrets.toml")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument('--requests-per-second', type=float, default=5,
+                        help="Request rate shared by every worker, 0 for no limit")
+    parser.add_argument('--limit', type=int, default=1000, help="Maximum results per search")
+    parser.add_argument('--expense-ratio', type=float, default=0.5,
+                        help="Share of the annual rent projected as expenses")
+    parser.add_argument('--retries', type=int, default=1, help="Extra attempts of failed locations")
+    parser.add_argument('--min-price', type=float, help="Lowest listing price")
+    parser.add_argument('--max-price', type=float, help="Highest listing price")
+    parser.add_argument('--min-beds', type=float, help="Fewest bedrooms")
+    parser.add_argument('--min-baths', type=float, help="Fewest bathrooms")
+    parser.add_argument('--property-type', action='append', help="Property type to keep, e.g. single_family; repeatable")
+    parser.add_argument('--status', action='append', help="Status label to keep, e.g. 'PRICE REDUCED'; repeatable")
+    parser.add_argument('--no-cache', action='store_true', help="Bypass the on-disk response cache")
+    parser.add_argument('--detect-changes', action='store_true',
+                        help="Report new, changed and delisted listings since the previous run")
+    parser.add_argument('--snapshot', action='store_true', help="Also upsert the listings into the listing store")
+    parser.add_argument('--fresh', action='store_true', help="Discard the checkpoints of a previous run")
+    parser.add_argument('--verbose', action='store_true', help="Log every event, not just warnings")
+    args = parser.parse_args()
+
+    api_key = read_api_key(args.api_key)
+    if not api_key:
+        parser.error("No API key, pass --api-key or set REALTOR_API_KEY")
+    metro_zips = None
+    if args.metro_zips:
+        with open(args.metro_zips) as f:
+            metro_zips = json.load(f)
+    locations = expand_locations(read_locations(args.input), metro_zips)
+    if not locations:
+        parser.error(f"No locations in {args.input}")
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    configure_logging(log_level)
+    if args.fresh:
+        shutil.rmtree(os.path.join(args.output, 'checkpoints'), ignore_errors=True)
+        if os.path.exists(os.path.join(args.output, CHECKPOINT_LOG)):
+            os.remove(os.path.join(args.output, CHECKPOINT_LOG))
+    os.makedirs(args.output, exist_ok=True)
+
+    started = datetime.datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    records = run_locations(locations, args.output, max(1, args.workers), api_key,
+                            args.requests_per_second or None, not args.no_cache, args.limit,
+                            args.expense_ratio, args.detect_changes, args.retries, args.snapshot,
+                            log_level, sale_query_from_arguments(args))
+    outputs, rentals, sales = merge_outputs(records, args.output)
+    report = write_report(os.path.join(args.output, 'report.json'), args, records, outputs,
+                          rentals, sales, started, time.perf_counter() - start)
+
+    print(f"{report['succeeded']}/{report['locations']} locations, {sales} for sale and "
+          f"{rentals} for rent listings in {report['seconds']:.0f}s, outputs in {args.output}")
+    if report['failed']:
+        print(f"{report['failed']} failed, rerun the same command to retry them:")
+        for location, error in report['failures'].items():
+            print(f"  {location}: {error}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
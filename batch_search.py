@@ -0,0 +1,176 @@
+### Multi-zip / metro-wide search built on the single-location search functions
+import asyncio
+import contextvars
+import functools
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from api_client import get_default_client, get_host_limiter, rate_limited
+from api_functions import search_rental_properties, search_properties
+from api_functions import display_and_store_rentals, display_and_store_properties
+from instrumentation import log_event
+from zip_centroids import zips_for_city
+
+# "Kirkwood, MO", "St. Louis,MO"
+CITY_STATE = re.compile(r'^(.+?),\s*([A-Za-z]{2})$')
+
+
+def is_zip_code(location):
+    """Check whether a location is a 5-digit zip code"""
+    return isinstance(location, str) and location.isdigit() and len(location) == 5
+
+
+def expand_locations(locations, metro_zips=None):
+    """
+    Expand a list of zips, metros and cities into the locations to search
+
+    Parameters:
+        locations (str or list): A zip, a metro/city name, or a list of them
+        metro_zips (dict, optional): Maps a metro or city name, e.g. "St. Louis metro",
+                                     to the list of zips it covers
+
+    Returns:
+        list: Unique locations in input order. Names found in metro_zips are
+              replaced by their zips, "City, ST" names by the zips of that city
+              in the offline zip table (see zip_centroids.zips_for_city), and
+              anything else is searched as given.
+    """
+    if isinstance(locations, str):
+        locations = [locations]
+    metro_zips = metro_zips or {}
+
+    expanded = []
+    for location in locations:
+        location = str(location).strip()
+        if not location:
+            continue
+        if is_zip_code(location):
+            expanded.append(location)
+        elif location in metro_zips:
+            expanded.extend(str(z).strip() for z in metro_zips[location])
+        else:
+            city = CITY_STATE.match(location)
+            zips = zips_for_city(*city.groups()) if city else []
+            expanded.extend(zips or [location])
+
+    return list(dict.fromkeys(expanded))
+
+
+def merge_listings(frames, key='Property ID'):
+    """
+    Concatenate per-location DataFrames and drop listings seen in more than one
+
+    Parameters:
+        frames (list): DataFrames returned by the display_and_store functions, may contain None
+        key (str): Column identifying a listing
+
+    Returns:
+        pd.DataFrame: Merged listings, first occurrence kept
+    """
+    frames = [df for df in frames if df is not None and len(df) > 0]
+    if not frames:
+        return pd.DataFrame()
+
+    merged = pd.concat(frames, ignore_index=True)
+    # Categoricals with different categories concatenate to plain strings
+    for column, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) and column in merged.columns:
+            merged[column] = merged[column].astype('category')
+    if key in merged.columns:
+        # Listings without an ID cannot be matched, so keep all of them
+        missing = merged[key].isna() | (merged[key] == 'N/A')
+        merged = merged[missing | ~merged.duplicated(subset=key)].reset_index(drop=True)
+    return merged
+
+
+async def fetch_locations_async(api_key, locations, max_concurrency=8, requests_per_second=5,
+                                limit=1000, client=None, cache=None, rent_query=None,
+                                sale_query=None, parse=False):
+    """
+    Fetch the rentals and for-sale listings of many locations concurrently
+
+    The searches run on a pool of max_concurrency threads of their own and
+    the client keeps at least as many connections open, so neither the
+    default executor nor the connection pool holds them back. Only requests
+    that reach the API take a token of the per-host rate limiter, cache hits
+    do not.
+
+    Parameters:
+        api_key (str): Your RapidAPI key
+        locations (list): Zips or cities, searched as given
+        max_concurrency (int): Maximum number of searches in flight at once
+        requests_per_second (float, optional): Per-host request rate, None for no limit
+        limit (int): Maximum number of results per search
+        client (RealtorClient, optional): HTTP client, defaults to the shared pooled client
+        cache (ResponseCache, optional): Response cache, defaults to the shared on-disk cache
+        rent_query, sale_query (SearchQuery, optional): Filters of each search,
+                                only the ones the API applies are used here
+        parse (bool): Parse each response into a DataFrame as soon as it arrives
+
+    Returns:
+        list: (location, rentals, for sale) in input order, search responses
+              or, with parse=True, DataFrames. Failed searches are None.
+    """
+    client = client or get_default_client()
+    client.ensure_pool_size(max_concurrency)
+    limiter = get_host_limiter(client.host, requests_per_second) if requests_per_second else None
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='realtor-search') as pool:
+        async def fetch(search, parse_results, location, query):
+            # Run in a copy of this context so the thread sees the limiter and the request priority
+            context = contextvars.copy_context()
+            results = await loop.run_in_executor(pool, context.run, functools.partial(
+                search, api_key, location, limit, client, cache, query=query))
+            if not results:
+                log_event('no_results', logging.WARNING, location=location)
+                return None
+            if not parse:
+                return results
+            return await asyncio.to_thread(parse_results, results)
+
+        with rate_limited(limiter):
+            tasks = [fetch(search_rental_properties, display_and_store_rentals, loc, rent_query)
+                     for loc in locations]
+            tasks += [fetch(search_properties, display_and_store_properties, loc, sale_query)
+                      for loc in locations]
+            frames = await asyncio.gather(*tasks)
+    return list(zip(locations, frames[:len(locations)], frames[len(locations):]))
+
+
+async def search_locations_async(api_key, locations, max_concurrency=8,
+                                 requests_per_second=5, limit=1000,
+                                 client=None, metro_zips=None, cache=None):
+    """
+    Search many locations for rentals and for-sale listings concurrently
+
+    Parameters:
+        api_key (str): Your RapidAPI key
+        locations (str or list): Zips, metros or cities, see expand_locations
+        max_concurrency (int): Maximum number of requests in flight at once
+        requests_per_second (float, optional): Per-host request rate, None for no limit
+        limit (int): Maximum number of results per search
+        client (RealtorClient, optional): HTTP client, defaults to the shared pooled client
+        metro_zips (dict, optional): Metro/city name to zips mapping
+        cache (ResponseCache, optional): Response cache, defaults to the shared on-disk cache
+
+    Returns:
+        tuple: (rental DataFrame, for-sale DataFrame) merged across locations
+               and deduplicated by Property ID
+    """
+    fetched = await fetch_locations_async(api_key, expand_locations(locations, metro_zips), max_concurrency,
+                                          requests_per_second, limit, client, cache, parse=True)
+    df_rent = merge_listings([rent for _, rent, _ in fetched])
+    df_sale = merge_listings([sale for _, _, sale in fetched])
+    return df_rent, df_sale
+
+
+def search_locations(api_key, locations, max_concurrency=8, requests_per_second=5,
+                     limit=1000, client=None, metro_zips=None, cache=None):
+    """Blocking wrapper around search_locations_async, see that function for parameters"""
+    return asyncio.run(search_locations_async(api_key, locations, max_concurrency,
+                                              requests_per_second, limit, client,
+                                              metro_zips, cache))
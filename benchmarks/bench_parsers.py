@@ -0,0 +1,70 @@
+### Throughput of the schema-driven parsers against the original per-property loops
+# Run from the repository root:
+#     python -m benchmarks.bench_parsers [--sizes 10000 100000]
+# 'loop' times the original parsers alone, 'loop+cast' adds the dtype casts
+# that bring their output to the typed columns the schema parsers return, the
+# like-for-like comparison. Both read every value with a Python dict.get, so
+# expect ratios around 1x; the noise between runs is of the same order.
+import argparse
+import contextlib
+import gc
+import io
+import time
+
+from pandas.testing import assert_frame_equal
+
+from api_functions import display_and_store_rentals, display_and_store_properties
+from benchmarks import reference_parsers
+from benchmarks.payloads import make_payload
+from listing_schema import apply_dtypes, extract_rentals, extract_properties
+
+
+def best_of(func, payload, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        # The original rental loop prints a separator for every listing
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = func(payload)
+        best = min(best, time.perf_counter() - start)
+    return best, df
+
+
+def typed_reference(df, dtypes):
+    """Bring the original parser output to the typed schema columns"""
+    # The formatted rent string is display-only and no longer parsed
+    df = df.drop(columns=['Monthly Rent'], errors='ignore')
+    return apply_dtypes(df, dtypes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the schema-driven parsers against the original per-property loops")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    feeds = [
+        ('rentals', True, reference_parsers.display_and_store_rentals, display_and_store_rentals,
+         extract_rentals.dtypes),
+        ('for sale', False, reference_parsers.display_and_store_properties, display_and_store_properties,
+         extract_properties.dtypes),
+    ]
+
+    print(f"{'feed':<10}{'listings':>10}{'loop /s':>14}{'loop+cast /s':>14}{'schema /s':>14}"
+          f"{'vs loop':>10}{'vs cast':>10}")
+    for name, for_rent, reference, schema, schema_dtypes in feeds:
+        for n in args.sizes:
+            payload = make_payload(n, for_rent, reference_safe=True)
+            ref_time, _ = best_of(reference, payload, args.repeat)
+            cast_time, typed = best_of(lambda payload: typed_reference(reference(payload), schema_dtypes),
+                                       payload, args.repeat)
+            new_time, actual = best_of(schema, payload, args.repeat)
+            # Coordinates were added after the original parsers
+            assert_frame_equal(actual.drop(columns=['Latitude', 'Longitude']), typed)
+            print(f"{name:<10}{n:>10}{n / ref_time:>14,.0f}{n / cast_time:>14,.0f}{n / new_time:>14,.0f}"
+                  f"{ref_time / new_time:>9.2f}x{cast_time / new_time:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+### Throughput, latency and memory of every pipeline stage, checked against a baseline
+# Run from the repository root:
+#     python -m benchmarks.bench_pipeline                    # compare with benchmarks/baseline.json
+#     python -m benchmarks.bench_pipeline --update-baseline  # record a new baseline
+#     python -m benchmarks.bench_pipeline --sizes 1000 10000 --cases parse_rentals
+# The exit status is 1 when a stage got slower or bigger than the baseline by
+# more than --tolerance. Speed is compared at the fastest timed call, which
+# moves far less between runs than the median on a shared or busy machine.
+# Baselines are machine specific, record one per runner.
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from api_functions import display_and_store_rentals, display_and_store_properties
+from benchmarks.payloads import make_pages
+from data_processing import generate_rent_summary, calculate_investment_metrics, geocode_addresses
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+# Timed calls of every stage, even the slowest, so the fastest one is representative
+MIN_RUNS = 5
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+class Inputs:
+    """Payloads and parsed frames of one size, built once and shared by the cases"""
+
+    def __init__(self, n, seed):
+        self.n = n
+        self.seed = seed
+        self._cache = {}
+
+    def get(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def rent_pages(self):
+        return self.get('rent_pages', lambda: make_pages(self.n, True, self.seed))
+
+    def sale_pages(self):
+        return self.get('sale_pages', lambda: make_pages(self.n, False, self.seed + 1000))
+
+    def df_rent(self):
+        return self.get('df_rent', lambda: display_and_store_rentals(self.rent_pages()))
+
+    def df_sale(self):
+        return self.get('df_sale', lambda: display_and_store_properties(self.sale_pages()))
+
+    def rent_summary(self):
+        return self.get('rent_summary', lambda: generate_rent_summary(self.df_rent()))
+
+
+# Stage name -> function of Inputs returning the call to time
+CASES = {
+    'parse_rentals': lambda inputs: (display_and_store_rentals, inputs.rent_pages()),
+    'parse_sales': lambda inputs: (display_and_store_properties, inputs.sale_pages()),
+    'rent_summary': lambda inputs: (generate_rent_summary, inputs.df_rent()),
+    'investment_metrics': lambda inputs: (
+        lambda df: calculate_investment_metrics(df, inputs.rent_summary()), inputs.df_sale()),
+    'geocode': lambda inputs: (geocode_addresses, inputs.df_sale()),
+}
+
+
+def run_once(func, arg):
+    gc.collect()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(arg)
+    return time.perf_counter() - start
+
+
+def peak_memory(func, arg):
+    """Peak memory allocated by one call, in MB"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(arg)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def measure(func, arg, n, repeat, budget, memory):
+    """
+    Time repeated calls of one stage
+
+    One untimed call warms up lazily loaded data (e.g. the zip centroid
+    table). Then at least MIN_RUNS and at most repeat calls are timed, fewer
+    when the first one shows that repeat calls would exceed budget seconds.
+
+    Returns:
+        dict: throughput (listings/s at the median latency), best_throughput
+              (at the fastest call), p50/p95/p99 latency in ms, peak memory
+              in MB (None unless memory) and runs
+    """
+    run_once(func, arg)
+    latencies = [run_once(func, arg)]
+    runs = max(MIN_RUNS, min(repeat, int(budget / max(latencies[0], 1e-9))))
+    latencies += [run_once(func, arg) for _ in range(runs - 1)]
+    latencies = np.array(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        'throughput': n / np.median(latencies),
+        'best_throughput': n / latencies.min(),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'peak_mb': peak_memory(func, arg) if memory else None,
+        'runs': len(latencies),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find the stages that regressed against the baseline
+
+    Throughput is compared at the fastest call; baselines recorded before
+    best_throughput existed are compared at the median.
+
+    Returns:
+        list: Messages, one per regression
+    """
+    regressions = []
+    for case, sizes in results.items():
+        for size, result in sizes.items():
+            expected = baseline.get(case, {}).get(size)
+            if not expected:
+                continue
+            key = 'best_throughput' if 'best_throughput' in expected else 'throughput'
+            if result[key] < expected[key] * (1 - tolerance):
+                regressions.append(f"{case} @ {size}: {result[key]:,.0f} listings/s, "
+                                   f"baseline {expected[key]:,.0f}")
+            if (result['peak_mb'] is not None and expected.get('peak_mb')
+                    and result['peak_mb'] > expected['peak_mb'] * (1 + tolerance)):
+                regressions.append(f"{case} @ {size}: peak {result['peak_mb']:,.1f} MB, "
+                                   f"baseline {expected['peak_mb']:,.1f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput, latency and memory of every pipeline stage, checked against a baseline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=20, help="Most timed calls per stage and size")
+    parser.add_argument('--budget', type=float, default=10.0, help="Seconds of timed calls per stage and size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="Skip the traced peak memory run")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="Allowed relative throughput drop or memory growth")
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = {case: {} for case in args.cases}
+    print(f"{'stage':<20}{'listings':>10}{'listings/s':>14}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'peak MB':>10}")
+    for n in args.sizes:
+        inputs = Inputs(n, args.seed)
+        for case in args.cases:
+            func, arg = CASES[case](inputs)
+            result = measure(func, arg, n, args.repeat, args.budget, not args.no_memory)
+            results[case][str(n)] = result
+            peak = '-' if result['peak_mb'] is None else f"{result['peak_mb']:,.1f}"
+            print(f"{case:<20}{n:>10}{result['throughput']:>14,.0f}{result['p50_ms']:>10,.1f}"
+                  f"{result['p95_ms']:>10,.1f}{result['p99_ms']:>10,.1f}{peak:>10}", flush=True)
+        del inputs
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.pop('_machine', None)
+        for case, sizes in results.items():
+            baseline.setdefault(case, {}).update(
+                {size: {'throughput': round(r['throughput'], 1),
+                        'best_throughput': round(r['best_throughput'], 1),
+                        'peak_mb': None if r['peak_mb'] is None else round(r['peak_mb'], 1)}
+                 for size, r in sizes.items()})
+        baseline = {'_machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                                 'processor': platform.machine()}, **baseline}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to record one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("Regressions:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
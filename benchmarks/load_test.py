@@ -0,0 +1,148 @@
+### End-to-end load test of the app pipeline against the local mock server
+# Replays many concurrent zip lookups through the real code paths the app
+# runs for a search (pooled client with retries, concurrent rent/sale fetch,
+# parsing, rent summary, investment metrics, geocoding) and reports latency
+# percentiles per stage and end to end. Run from the repository root:
+#     python -m benchmarks.load_test --lookups 200 --concurrency 16 --rate-limit-rate 0.05
+# Mock server options (latency, errors, payload sizes) are those of
+# benchmarks.mock_server; pass --url to drive an already running server.
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import random
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import data_processing
+from api_client import RealtorClient
+from api_functions import fetch_rentals_and_properties
+from benchmarks.mock_server import MockServer, add_config_arguments, config_from_arguments
+from data_processing import generate_rent_summary, calculate_investment_metrics, geocode_addresses
+from geocode_cache import GeocodeCache
+from response_cache import ResponseCache
+from zip_centroids import load_zip_centroids
+
+STAGES = ['fetch', 'summary', 'metrics', 'geocode', 'total']
+PERCENTILES = [50, 90, 95, 99]
+
+
+def lookup(zip_code, client, cache, geocode_cache, use_nominatim):
+    """
+    One search as the app runs it
+
+    Returns:
+        dict: Seconds spent per stage, plus 'error' when the search failed
+    """
+    timings = {}
+    start = time.perf_counter()
+    df_rent, df_sale = asyncio.run(
+        fetch_rentals_and_properties('mock-key', zip_code, client=client, cache=cache))
+    timings['fetch'] = time.perf_counter() - start
+    if df_rent is None or df_sale is None or df_rent.empty or df_sale.empty:
+        timings['total'] = time.perf_counter() - start
+        timings['error'] = 'no listings'
+        return timings
+
+    stage = time.perf_counter()
+    rent_summary = generate_rent_summary(df_rent)
+    timings['summary'] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    metrics = calculate_investment_metrics(df_sale, rent_summary)
+    timings['metrics'] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    geocode_addresses(metrics, cache=geocode_cache, use_nominatim=use_nominatim)
+    timings['geocode'] = time.perf_counter() - stage
+    timings['total'] = time.perf_counter() - start
+    return timings
+
+
+def sample_zips(n, state, seed):
+    centroids = load_zip_centroids()
+    zips = centroids.index[centroids['state'] == state].tolist()
+    rng = random.Random(seed)
+    return [rng.choice(zips) for _ in range(n)]
+
+
+def report(results, wall_time, status_counts):
+    errors = Counter(r['error'] for r in results if 'error' in r)
+    ok = [r for r in results if 'error' not in r]
+    print(f"{len(results)} lookups in {wall_time:.1f}s ({len(results) / wall_time:.1f}/s), "
+          f"{len(ok)} ok, {sum(errors.values())} failed {dict(errors) if errors else ''}")
+    print(f"{'stage':<10}" + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}")
+    for stage in STAGES:
+        values = np.array([r[stage] for r in ok if stage in r]) * 1000
+        if not len(values):
+            continue
+        row = ''.join(f"{v:>10,.1f}" for v in np.percentile(values, PERCENTILES))
+        print(f"{stage:<10}{row}{values.max():>10,.1f}")
+    if status_counts:
+        print("server responses:")
+        for (path, status), count in sorted(status_counts.items()):
+            print(f"  {path:<18}{status:>5}{count:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the app pipeline against the local mock server")
+    parser.add_argument('--lookups', type=int, default=100, help="Number of zip searches")
+    parser.add_argument('--concurrency', type=int, default=8, help="Searches in flight at once")
+    parser.add_argument('--state', default='MO', help="State the zips are sampled from")
+    parser.add_argument('--zips', nargs='+', help="Replay these zips instead of sampling")
+    parser.add_argument('--url', help="Use a running mock server instead of starting one")
+    parser.add_argument('--use-cache', action='store_true',
+                        help="Go through a fresh response cache, so repeated zips are served from it")
+    parser.add_argument('--nominatim', action='store_true',
+                        help="Geocode listings without coordinates through the Nominatim endpoint")
+    parser.add_argument('--nominatim-delay', type=float, default=0.0,
+                        help="Seconds between Nominatim requests, 1 in production")
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--backoff-factor', type=float, default=0.1)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    # geopy logs every retried geocode with a traceback, the server counts them anyway
+    logging.getLogger('geopy').setLevel(logging.CRITICAL)
+
+    zips = args.zips * (args.lookups // len(args.zips) + 1) if args.zips else []
+    zips = zips[:args.lookups] or sample_zips(args.lookups, args.state, args.seed)
+
+    with contextlib.ExitStack() as stack:
+        server = None
+        url = args.url
+        if url is None:
+            server = stack.enter_context(MockServer(config_from_arguments(args)))
+            url = server.url
+        workdir = stack.enter_context(tempfile.TemporaryDirectory())
+
+        host_port = url.split('://', 1)[1]
+        data_processing.NOMINATIM_DOMAIN = host_port
+        data_processing.NOMINATIM_SCHEME = url.split('://', 1)[0]
+        data_processing.NOMINATIM_MIN_DELAY_SECONDS = args.nominatim_delay
+
+        client = RealtorClient(api_key='mock-key', base_url=url, max_retries=args.max_retries,
+                               backoff_factor=args.backoff_factor,
+                               pool_maxsize=max(10, 2 * args.concurrency))
+        cache = ResponseCache(os.path.join(workdir, 'responses.sqlite')) if args.use_cache else False
+        geocode_cache = GeocodeCache(os.path.join(workdir, 'geocode.sqlite'))
+
+        start = time.perf_counter()
+        # The search functions print their errors, keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()), \
+                ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(
+                lambda z: lookup(z, client, cache, geocode_cache, args.nominatim), zips))
+        wall_time = time.perf_counter() - start
+        client.close()
+
+        report(results, wall_time, server.status_counts if server else None)
+
+
+if __name__ == '__main__':
+    main()
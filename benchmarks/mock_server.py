@@ -0,0 +1,332 @@
+### Local stand-in for the Realtor API and Nominatim
+# Serves /search/forrent and /search/forsale like the RapidAPI Realtor API
+# (location, limit, offset and price/beds/baths filter parameters,
+# {"properties": [...]} responses) and Nominatim's /search?q=...&format=json,
+# with configurable latency, error injection and payload sizes. Listings come
+# from benchmarks/payloads.py and are placed in the requested zip; geocoding
+# answers with the zip centroid.
+#
+# Run standalone from the repository root:
+#     python -m benchmarks.mock_server --port 8089 --latency lognormal:120,0.5 --error-rate 0.02
+# then point the app at it:
+#     REALTOR_API_BASE_URL=http://127.0.0.1:8089 NOMINATIM_DOMAIN=127.0.0.1:8089 NOMINATIM_SCHEME=http
+import argparse
+import functools
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.payloads import make_payload
+from zip_centroids import load_zip_centroids
+
+
+class LatencyModel:
+    """
+    Random response delay, parsed from a spec string
+
+        fixed:MS                   always MS milliseconds
+        uniform:LOW,HIGH           uniform between LOW and HIGH milliseconds
+        lognormal:MEDIAN,SIGMA     log-normal with the given median in ms, long tail for larger SIGMA
+    """
+
+    def __init__(self, spec='fixed:0'):
+        self.spec = spec
+        kind, _, values = spec.partition(':')
+        numbers = [float(v) for v in values.split(',') if v]
+        if kind == 'fixed' and len(numbers) == 1:
+            self.sample_ms = lambda rng: numbers[0]
+        elif kind == 'uniform' and len(numbers) == 2:
+            self.sample_ms = lambda rng: rng.uniform(*numbers)
+        elif kind == 'lognormal' and len(numbers) == 2:
+            mu = math.log(numbers[0])
+            self.sample_ms = lambda rng: rng.lognormvariate(mu, numbers[1])
+        else:
+            raise ValueError(f"Invalid latency spec {spec!r}, see LatencyModel")
+
+    def sample(self, rng):
+        """Delay in seconds"""
+        return max(0.0, self.sample_ms(rng)) / 1000
+
+
+class MockConfig:
+    """
+    Behaviour of the mock server
+
+    Parameters:
+        latency (str): Realtor endpoint latency, see LatencyModel
+        geocode_latency (str): Nominatim endpoint latency
+        rate_limit_rate (float): Share of requests answered 429 Too Many Requests
+        error_rate (float): Share of requests answered with a random 500/502/503/504
+        retry_after (int): Retry-After seconds sent with 429 responses, whole seconds per HTTP
+        listings (int): Mean number of listings per zip and feed
+        listings_sigma (float): Log-normal spread of the listings per zip, 0 for exactly listings
+        seed (int): Seed of the generated listings and injected faults
+        quota (int, optional): Searches allowed per quota_period, sent in x-ratelimit-requests-*
+                               headers like RapidAPI, 429 once spent. None for no quota.
+        quota_period (float): Seconds after which the quota renews
+    """
+
+    def __init__(self, latency='fixed:0', geocode_latency='fixed:0', rate_limit_rate=0.0,
+                 error_rate=0.0, retry_after=1, listings=200, listings_sigma=0.0, seed=0,
+                 quota=None, quota_period=60.0):
+        self.latency = LatencyModel(latency)
+        self.geocode_latency = LatencyModel(geocode_latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.listings = listings
+        self.listings_sigma = listings_sigma
+        self.seed = seed
+        self.quota = quota
+        self.quota_period = quota_period
+
+
+def matches_filters(prop, params):
+    """Whether a listing passes the price_min/price_max/beds_min/baths_min search parameters"""
+    description = prop.get('description') or {}
+    for param, value, lower in [('price_min', prop.get('list_price'), True),
+                                ('price_max', prop.get('list_price'), False),
+                                ('beds_min', description.get('beds'), True),
+                                ('baths_min', description.get('baths_consolidated'), True)]:
+        if param not in params:
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        bound = float(params[param])
+        if value < bound if lower else value > bound:
+            return False
+    return True
+
+
+def stable_seed(*parts):
+    return int.from_bytes(hashlib.sha256('|'.join(map(str, parts)).encode()).digest()[:8], 'big')
+
+
+class MockServer:
+    """
+    Threaded HTTP server running the mock endpoints in the background
+
+    Usage:
+        with MockServer(MockConfig(latency='lognormal:100,0.4')) as server:
+            client = RealtorClient(api_key='test', base_url=server.url)
+
+    Attributes:
+        url (str): Base URL, e.g. http://127.0.0.1:53811
+        status_counts (Counter): Responses sent per (path, status)
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or MockConfig()
+        self.status_counts = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.config.seed)
+        self._quota_used = 0
+        self._quota_start = time.monotonic()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self.url = f"http://{self.host}:{self.port}"
+        self._thread = None
+
+    @functools.lru_cache(maxsize=1024)
+    def listings(self, feed, zip_code):
+        """Every listing of a zip and feed, the same on every request"""
+        config = self.config
+        rng = random.Random(stable_seed(config.seed, feed, zip_code))
+        n = config.listings
+        if config.listings_sigma:
+            n = int(rng.lognormvariate(math.log(max(config.listings, 1)), config.listings_sigma))
+        centroids = load_zip_centroids()
+        if zip_code in centroids.index:
+            row = centroids.loc[zip_code]
+            zips = [(zip_code, row['city'], row['latitude'], row['longitude'])]
+        else:
+            zips = [(zip_code, 'Springfield', 38.6, -90.3)]
+        # Listing ids are numbered per zip and feed, as unique across them as on the live API
+        first_id = (int(zip_code) * 2 + (feed == 'forrent')) * 10 ** 6
+        return make_payload(n, feed == 'forrent', seed=stable_seed(config.seed, feed, zip_code, 'payload'),
+                            zips=zips, first_id=first_id)['properties']
+
+    def draw(self):
+        """Thread-safe uniform draw from the fault injection generator"""
+        with self._lock:
+            return self._rng.random()
+
+    def sleep(self, latency):
+        with self._lock:
+            delay = latency.sample(self._rng)
+        time.sleep(delay)
+
+    def take_quota(self):
+        """
+        Spend one search of the quota
+
+        Returns:
+            tuple: (allowed, rate limit headers), (True, {}) without a quota
+        """
+        config = self.config
+        if config.quota is None:
+            return True, {}
+        with self._lock:
+            now = time.monotonic()
+            if now - self._quota_start >= config.quota_period:
+                self._quota_start, self._quota_used = now, 0
+            allowed = self._quota_used < config.quota
+            if allowed:
+                self._quota_used += 1
+            reset = config.quota_period - (now - self._quota_start)
+            return allowed, {'X-RateLimit-Requests-Limit': str(config.quota),
+                             'X-RateLimit-Requests-Remaining': str(config.quota - self._quota_used),
+                             'X-RateLimit-Requests-Reset': str(math.ceil(reset))}
+
+    def count(self, path, status):
+        with self._lock:
+            self.status_counts[(path, status)] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                server.count(urlparse(self.path).path, status)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                match = re.fullmatch(r'/search/(forrent|forsale)', url.path)
+                if match:
+                    server.sleep(server.config.latency)
+                    if self.inject_fault():
+                        return
+                    allowed, headers = server.take_quota()
+                    if not allowed:
+                        self.send_json(429, {'message': 'You have exceeded the rate limit per period'}, headers)
+                        return
+                    self.search(match.group(1), params, headers)
+                elif url.path == '/search':
+                    server.sleep(server.config.geocode_latency)
+                    if self.inject_fault():
+                        return
+                    self.geocode(params)
+                else:
+                    self.send_json(404, {'message': 'Not found'})
+
+            def inject_fault(self):
+                draw = server.draw()
+                if draw < server.config.rate_limit_rate:
+                    self.send_json(429, {'message': 'Too many requests'},
+                                   {'Retry-After': str(server.config.retry_after)})
+                    return True
+                if draw < server.config.rate_limit_rate + server.config.error_rate:
+                    status = [500, 502, 503, 504][int(server.draw() * 4)]
+                    self.send_json(status, {'message': 'Injected server error'})
+                    return True
+                return False
+
+            def search(self, feed, params, headers=None):
+                location = params.get('location', '').strip()
+                zip_code = location[:5] if location[:5].isdigit() else str(stable_seed(location) % 90000 + 10000)
+                limit = int(params.get('limit', 200))
+                offset = int(params.get('offset', 0))
+                properties = [p for p in server.listings(feed, zip_code) if matches_filters(p, params)]
+                self.send_json(200, {'properties': properties[offset:offset + limit],
+                                     'total': len(properties)}, headers)
+
+            def geocode(self, params):
+                found = re.search(r'\b(\d{5})\b', params.get('q', ''))
+                centroids = load_zip_centroids()
+                if not found or found.group(1) not in centroids.index:
+                    self.send_json(200, [])
+                    return
+                row = centroids.loc[found.group(1)]
+                self.send_json(200, [{
+                    'place_id': stable_seed(params['q']) % 10 ** 9,
+                    'lat': str(row['latitude']),
+                    'lon': str(row['longitude']),
+                    'display_name': params['q'],
+                    'boundingbox': [str(row['latitude'] - 0.01), str(row['latitude'] + 0.01),
+                                    str(row['longitude'] - 0.01), str(row['longitude'] + 0.01)],
+                }])
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_config_arguments(parser):
+    """Command line options of MockConfig, shared with the load driver"""
+    parser.add_argument('--latency', default='lognormal:100,0.5',
+                        help="Realtor latency: fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    parser.add_argument('--geocode-latency', default='fixed:20')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of 429 responses")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of 5xx responses")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds of 429s")
+    parser.add_argument('--listings', type=int, default=200, help="Mean listings per zip and feed")
+    parser.add_argument('--listings-sigma', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quota', type=int, help="Searches allowed per quota period, unlimited by default")
+    parser.add_argument('--quota-period', type=float, default=60.0, help="Seconds after which the quota renews")
+
+
+def config_from_arguments(args):
+    return MockConfig(latency=args.latency, geocode_latency=args.geocode_latency,
+                      rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+                      retry_after=args.retry_after, listings=args.listings,
+                      listings_sigma=args.listings_sigma, seed=args.seed, quota=args.quota,
+                      quota_period=args.quota_period)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Realtor API and Nominatim")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer(config_from_arguments(args), args.host, args.port)
+    print(f"Serving mock Realtor API and Nominatim on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
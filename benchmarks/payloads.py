@@ -0,0 +1,128 @@
+### Seeded synthetic Realtor search payloads
+# make_payload(n, for_rent, seed) returns a search response shaped like the
+# /search/forrent and /search/forsale results, with every field the parsers,
+# summaries, metrics and geocoder read. A share of the listings is messy the
+# way the live feed is: None prices, beds and coordinates, missing or None
+# flags, non-list details, None locations and numbers sent as strings.
+import random
+
+# A few real zips around St. Louis, so listings spread over several groups and
+# the zip-centroid fallback of the geocoder finds them
+ZIPS = [
+    ('63122', 'Kirkwood', 38.5812, -90.4166),
+    ('63119', 'Webster Groves', 38.5889, -90.3510),
+    ('63117', 'Richmond Heights', 38.6295, -90.3273),
+    ('63105', 'Clayton', 38.6462, -90.3295),
+    ('63139', 'Saint Louis', 38.6105, -90.2922),
+    ('63021', 'Ballwin', 38.5681, -90.5496),
+]
+PROPERTY_TYPES = ['single_family', 'condos', 'apartment', 'townhomes']
+BATHS = ['1', '1.5', '2', '2.5', '3']
+
+
+def make_property(rng, i, for_rent, reference_safe=False, zips=ZIPS, first_id=0):
+    """
+    One synthetic listing
+
+    Parameters:
+        rng (random.Random): Source of randomness, seeded by the caller
+        i (int): Listing number, used for its ids and address
+        for_rent (bool): Rental listing rather than for-sale listing
+        reference_safe (bool): Avoid the cases the original per-property loops
+                               in benchmarks/reference_parsers.py crash on
+        zips (list): (zip, city, latitude, longitude) the listing is placed in
+        first_id (int): Added to i in the ids and permalink, see make_payload
+    """
+    zip_code, city, latitude, longitude = rng.choice(zips)
+    if for_rent:
+        price = rng.randrange(800, 4000)
+    else:
+        price = rng.randrange(90000, 1500000)
+    prop = {
+        'property_id': str(9000000000 + first_id + i),
+        'listing_id': str(2980000000 + first_id + i),
+        'list_date': '2025-05-01T15:47:43.000000Z',
+        'list_price': rng.choice([None, price, price, price]),
+        'permalink': f"{i}-Main-St_{city.replace(' ', '-')}_MO_{zip_code}_M{first_id + i}" if rng.random() > 0.05 else 'N/A',
+        'location': {'address': {
+            'line': f"{i} Main St",
+            'city': city,
+            'state_code': 'MO',
+            'postal_code': zip_code,
+            'coordinate': rng.choice([None, {'lat': latitude + rng.uniform(-0.02, 0.02),
+                                             'lon': longitude + rng.uniform(-0.02, 0.02)}]),
+        }},
+        'description': {
+            'beds': rng.choice([1, 2, 3, 4, None]),
+            'baths_consolidated': rng.choice(BATHS),
+            'sqft': rng.choice([None, rng.randrange(500, 4000)]),
+            'lot_sqft': rng.randrange(2000, 20000),
+            'type': rng.choice(PROPERTY_TYPES),
+            'sub_type': None,
+        },
+        'flags': rng.choice([None, {}, {'is_new_listing': True}, {'is_pending': True, 'is_price_reduced': True}]),
+        'primary_photo': rng.choice([None, {'href': f"https://ap.rdcpix.com/{i}.jpg"}]),
+        'photos': [{'href': 'x'}] * rng.randrange(0, 5),
+        'virtual_tours': rng.choice([None, [], [{'href': 'https://tour'}]]),
+        'branding': rng.choice([[], [{'name': 'Red Key Realty'}]]),
+    }
+    if for_rent:
+        prop['pet_policy'] = rng.choice([None, {'cats': True, 'dogs_small': rng.random() > 0.5}])
+        prop['details'] = rng.choice([None, 'text', [
+            {'category': 'Rental Info', 'text': ['Security Deposit: $1350']},
+            {'category': 'Other Property Info', 'text': ['Availability Date: 2025-04-30']},
+        ]])
+        prop['advertisers'] = [{'type': 'management', 'office': {'phones': [{'number': '8164340652'}]}}]
+        # Unreadable listings are skipped by the rental parser
+        if rng.random() < 0.01:
+            prop['location'] = None
+    elif reference_safe:
+        # The original for-sale loop cannot read missing flags
+        prop['flags'] = prop['flags'] or {}
+    if not reference_safe and rng.random() < 0.05:
+        # Messy cases only the schema parsers handle
+        messy = rng.randrange(3)
+        if messy == 0:
+            del prop['flags']
+        elif messy == 1:
+            prop['list_price'] = str(prop['list_price'])
+        else:
+            prop['description'] = None
+    return prop
+
+
+def make_payload(n, for_rent, seed=0, reference_safe=False, zips=ZIPS, first_id=None):
+    """
+    A search response with n synthetic listings, identical for the same seed
+
+    The listing ids count up from first_id, seed * n by default, so payloads
+    of different seeds (e.g. of different zips) never share a listing.
+    """
+    rng = random.Random(seed)
+    if first_id is None:
+        first_id = seed * n
+    return {'properties': [make_property(rng, i, for_rent, reference_safe, zips, first_id) for i in range(n)]}
+
+
+def make_pages(n, for_rent, seed=0, page_size=100000, distinct_pages=2):
+    """
+    A stream of search response pages holding n listings in total
+
+    Only distinct_pages pages are generated, later pages repeat them, so a
+    million listings do not need a million property dicts in memory. The
+    parsers accept a list of pages as well as a single response.
+    """
+    pool = []
+    pages = []
+    remaining = n
+    while remaining > 0:
+        size = min(page_size, remaining)
+        if len(pool) < distinct_pages or size < page_size:
+            page = make_payload(size, for_rent, seed + len(pool))
+            if size == page_size:
+                pool.append(page)
+        else:
+            page = pool[len(pages) % len(pool)]
+        pages.append(page)
+        remaining -= size
+    return pages
@@ -0,0 +1,328 @@
+### Change detection between successive fetches of the same search
+# Most listings of a zip are unchanged from one refresh to the next. Each raw
+# property object is fingerprinted and compared with the fingerprint stored
+# for its property_id the last time the same search (feed + scope, e.g.
+# "rent" + "63122") was seen. Only added and changed properties are handed
+# to the parsers, and so to the summaries and the geocoder; properties that
+# disappeared are reported as delisted. refresh_listings keeps the listings
+# parsed from the previous fetch next to its fingerprints and parses only the
+# difference into them.
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pandas as pd
+
+from api_functions import iter_page_batches
+from batch_search import merge_listings
+
+DEFAULT_FINGERPRINT_PATH = os.environ.get('REALTOR_FINGERPRINT_PATH',
+                                          os.path.join('.cache', 'fingerprints.sqlite'))
+
+NEW = 'NEW'
+PRICE_CHANGE = 'PRICE CHANGE'
+CHANGED = 'CHANGED'
+DELISTED = 'DELISTED'
+
+REPORT_COLUMNS = ['Property ID', 'Change', 'Address', 'Old Price', 'New Price']
+
+ListingDelta = namedtuple('ListingDelta', ['added', 'changed', 'removed', 'unchanged', 'report'])
+ListingDelta.__doc__ = """
+Difference between a fetch and the previous fetch of the same search
+
+    added (list): Property dicts not seen before, including any without a property_id
+    changed (list): Property dicts whose content changed
+    removed (list): property_ids no longer returned
+    unchanged (int): Number of properties identical to the previous fetch
+    report (pd.DataFrame): One row per change, see REPORT_COLUMNS
+"""
+
+
+def fingerprint(prop):
+    """128-bit digest of a raw property object, independent of key order"""
+    encoded = json.dumps(prop, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+
+
+def property_price(prop):
+    price = prop.get('list_price')
+    return float(price) if isinstance(price, (int, float)) else None
+
+
+def property_address(prop):
+    location = prop.get('location')
+    address = location.get('address') if isinstance(location, dict) else None
+    return address.get('line', 'N/A') if isinstance(address, dict) else 'N/A'
+
+
+class FingerprintStore:
+    """
+    SQLite table of the last seen fingerprint and price of every property per search
+
+    Parameters:
+        path (str): SQLite database file
+    """
+
+    def __init__(self, path=DEFAULT_FINGERPRINT_PATH):
+        self.path = path
+        self._write_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    feed TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    property_id TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    price REAL,
+                    address TEXT,
+                    seen REAL NOT NULL,
+                    PRIMARY KEY (feed, scope, property_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS listings (
+                    feed TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    frame BLOB NOT NULL,
+                    PRIMARY KEY (feed, scope)
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def load(self, feed, scope):
+        """
+        Returns:
+            dict: property_id -> (fingerprint, price, address) last stored for the search
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT property_id, fingerprint, price, address FROM fingerprints "
+                "WHERE feed = ? AND scope = ?", (feed, scope)).fetchall()
+        return {property_id: (fp, price, address) for property_id, fp, price, address in rows}
+
+    def load_listings(self, feed, scope):
+        """
+        Returns:
+            pd.DataFrame: Listings parsed from the last fetch of the search, None if none were stored
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT frame FROM listings WHERE feed = ? AND scope = ?",
+                               (feed, scope)).fetchone()
+        return pd.read_parquet(io.BytesIO(row[0])) if row else None
+
+    def save(self, feed, scope, upserts, removed, listings=False):
+        """
+        Store the new fingerprints of a search and forget its removed properties
+
+        listings, when given, replaces the parsed listings of the search in the
+        same transaction, so they always match the fingerprints. None forgets them.
+        """
+        now = time.time()
+        if listings is not False and listings is not None:
+            buffer = io.BytesIO()
+            listings.to_parquet(buffer, index=False)
+        with self._write_lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(feed, scope, property_id, fingerprint, price, address, seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(feed, scope, property_id, fp, price, address, now)
+                 for property_id, (fp, price, address) in upserts.items()])
+            conn.executemany(
+                "DELETE FROM fingerprints WHERE feed = ? AND scope = ? AND property_id = ?",
+                [(feed, scope, property_id) for property_id in removed])
+            if listings is None:
+                conn.execute("DELETE FROM listings WHERE feed = ? AND scope = ?", (feed, scope))
+            elif listings is not False:
+                conn.execute("INSERT OR REPLACE INTO listings (feed, scope, frame) VALUES (?, ?, ?)",
+                             (feed, scope, buffer.getvalue()))
+
+    def clear(self):
+        """Forget every search"""
+        with self._write_lock, self._connect() as conn:
+            conn.execute("DELETE FROM fingerprints")
+            conn.execute("DELETE FROM listings")
+
+
+_default_fingerprint_store = None
+_default_fingerprint_store_lock = threading.Lock()
+
+
+def get_default_fingerprint_store():
+    """Return the process-wide fingerprint store"""
+    global _default_fingerprint_store
+    with _default_fingerprint_store_lock:
+        if _default_fingerprint_store is None:
+            _default_fingerprint_store = FingerprintStore()
+        return _default_fingerprint_store
+
+
+def detect_changes(properties_data, feed, scope, store=None, complete=True, commit=True):
+    """
+    Compare a fetch with the previous fetch of the same search
+
+    Parameters:
+        properties_data: A search response or an iterable of response pages
+        feed (str): Name of the endpoint, e.g. 'rent' or 'sale'
+        scope (str): Search location, e.g. the zip
+        store (FingerprintStore, optional): Defaults to the shared on-disk store
+        complete (bool): properties_data holds every result of the search, so
+                         previously seen properties missing from it are delisted.
+                         Pass False for a truncated fetch.
+        commit (bool): Remember this fetch as the new baseline
+
+    Returns:
+        ListingDelta: See its docstring
+    """
+    store = store or get_default_fingerprint_store()
+    delta, upserts, _ = compare_fetch(properties_data, store.load(feed, scope), complete)
+    if commit:
+        store.save(feed, scope, upserts, delta.removed)
+    return delta
+
+
+def compare_fetch(properties_data, previous, complete=True):
+    """
+    Compare a fetch with the fingerprints of the previous one, see detect_changes
+
+    Returns:
+        tuple: (ListingDelta, property_id -> (fingerprint, price, address) to
+                store, set of the property_ids returned by the fetch)
+    """
+    added, changed, upserts, report = [], [], {}, []
+    returned = set()
+    unchanged = 0
+    batches = iter_page_batches(properties_data) or []
+    for batch in batches:
+        for prop in batch:
+            if not isinstance(prop, dict):
+                continue
+            property_id = prop.get('property_id')
+            if property_id is None:
+                # Cannot be matched across fetches, always passed on
+                added.append(prop)
+                continue
+            property_id = str(property_id)
+            returned.add(property_id)
+            fp = fingerprint(prop)
+            price = property_price(prop)
+            address = property_address(prop)
+            known = previous.get(property_id)
+            if known is None and property_id not in upserts:
+                added.append(prop)
+                report.append((property_id, NEW, address, None, price))
+            elif known is not None and known[0] == fp:
+                unchanged += 1
+                continue
+            elif known is not None:
+                changed.append(prop)
+                change = PRICE_CHANGE if known[1] != price else CHANGED
+                report.append((property_id, change, address, known[1], price))
+            upserts[property_id] = (fp, price, address)
+
+    removed = [pid for pid in previous if pid not in returned] if complete else []
+    for property_id in removed:
+        _, price, address = previous[property_id]
+        report.append((property_id, DELISTED, address, price, None))
+
+    report = pd.DataFrame(report, columns=REPORT_COLUMNS)
+    report[['Old Price', 'New Price']] = report[['Old Price', 'New Price']].astype('Float64')
+    return ListingDelta(added, changed, removed, unchanged, report), upserts, returned
+
+
+def refresh_listings(properties_data, feed, scope, parse, store=None, complete=True):
+    """
+    Parse a fetch, reusing the listings parsed from the previous fetch of the same search
+
+    Only the added and changed properties are parsed and merged into the
+    stored listings, and an unchanged fetch is not parsed at all. The first
+    fetch of a search, or one whose stored listings were lost, is parsed whole.
+
+    Parameters:
+        properties_data: A search response or an iterable of response pages
+        feed (str): Name of the endpoint, e.g. 'rent' or 'sale'
+        scope (str): Search location, e.g. the zip
+        parse (callable): display_and_store_rentals or display_and_store_properties
+        store (FingerprintStore, optional): Defaults to the shared on-disk store
+        complete (bool): See detect_changes
+
+    Returns:
+        tuple: (pd.DataFrame of the fetched listings as parse would return
+                them, or None if they could not be parsed, ListingDelta)
+    """
+    store = store or get_default_fingerprint_store()
+    previous = store.load(feed, scope)
+    stored = store.load_listings(feed, scope) if previous else None
+    delta, upserts, returned = compare_fetch(properties_data, previous, complete)
+
+    if stored is None:
+        listings = parse(properties_data)
+        # The fingerprints must describe exactly the stored listings
+        forget = [pid for pid in previous if pid not in returned]
+    else:
+        forget = delta.removed
+        if delta.added or delta.changed or delta.removed:
+            parsed = parse(delta_payload(delta))
+            listings = apply_delta(stored, parsed, delta) if parsed is not None else None
+        else:
+            listings = stored
+    store.save(feed, scope, upserts, forget, listings)
+
+    if listings is not None and not complete and not listings.empty:
+        # Listings still stored from earlier fetches are not part of this one
+        ids = listings['Property ID'].astype(str)
+        listings = listings[ids.isin(returned) | ~has_property_id(listings)].reset_index(drop=True)
+    return listings, delta
+
+
+def delta_payload(delta):
+    """The added and changed properties as a search response, for the display_and_store functions"""
+    return {'properties': delta.added + delta.changed}
+
+
+def apply_delta(previous_df, delta_df, delta):
+    """
+    Bring a parsed DataFrame up to date with the parsed added and changed listings
+
+    Parameters:
+        previous_df (pd.DataFrame): Listings parsed from the previous fetch
+        delta_df (pd.DataFrame): delta_payload(delta) parsed by the same display_and_store function
+        delta (ListingDelta): Output of detect_changes
+
+    Returns:
+        pd.DataFrame: previous_df without the changed and removed listings, plus delta_df
+    """
+    if previous_df is None or previous_df.empty:
+        merged = merge_listings([delta_df])
+    else:
+        stale = {str(p.get('property_id')) for p in delta.changed} | set(delta.removed)
+        # Listings without a property_id come again with every delta
+        kept = previous_df[~previous_df['Property ID'].astype(str).isin(stale) & has_property_id(previous_df)]
+        merged = merge_listings([delta_df, kept])
+    if merged.empty:
+        # No listing left, keep the parsed columns
+        return (delta_df if previous_df is None else previous_df).iloc[:0]
+    return merged
+
+
+def has_property_id(df):
+    """Rows of parsed listings carrying a Property ID"""
+    return (df['Property ID'].notna() & (df['Property ID'] != 'N/A')).to_numpy(dtype=bool)
@@ -0,0 +1,133 @@
+### Nearest-comparable rent estimates for sale listings
+# Instead of requiring a rental with exactly the same (type, beds, baths), each
+# sale listing is matched to its k nearest rentals of the same property type in
+# a space of beds, baths, square feet and location, using one KD-tree per type.
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# How much of each feature counts as one unit of distance
+DEFAULT_FEATURE_SCALES = {
+    'Beds': 1.0,
+    'Baths': 1.0,
+    'Sq Ft': 500.0,
+    'km': 2.0,
+}
+
+KM_PER_DEGREE_LATITUDE = 110.57
+KM_PER_DEGREE_LONGITUDE_AT_EQUATOR = 111.32
+
+
+class ComparableRentIndex:
+    """
+    KD-tree index of rental listings partitioned by property type
+
+    Features are beds, baths, square feet and position (converted to km), each
+    divided by its scale in feature_scales. Missing features are filled with
+    the median of the rentals of the same type, so they neither attract nor
+    repel comparables. Rentals without a rent are not indexed.
+
+    Parameters:
+        df_rent (pd.DataFrame): Parsed rentals with Rent, Property Type, Beds,
+                                Baths, Sq Ft, Latitude and Longitude
+        k (int): Number of comparables used per estimate
+        feature_scales (dict, optional): Overrides DEFAULT_FEATURE_SCALES
+        fallback_any_type (bool): Match listings whose type has no rentals
+                                  against rentals of every type
+    """
+
+    def __init__(self, df_rent, k=5, feature_scales=None, fallback_any_type=True):
+        self.k = k
+        self.scales = dict(DEFAULT_FEATURE_SCALES, **(feature_scales or {}))
+        self.fallback_any_type = fallback_any_type
+
+        rent = df_rent['Rent'].astype('float64').to_numpy()
+        rentals = df_rent[~np.isnan(rent)]
+        self.rents = rent[~np.isnan(rent)]
+        self.positions = np.flatnonzero(~np.isnan(rent))
+
+        # Project coordinates around the rentals' mean latitude
+        latitude = rentals['Latitude'].astype('float64').to_numpy()
+        self.latitude0 = np.nanmean(latitude) if np.isfinite(latitude).any() else 0.0
+
+        raw = self._raw_features(rentals)
+        types = rentals['Property Type'].astype(str).to_numpy()
+        self.partitions = {}
+        for property_type in pd.unique(types):
+            members = np.flatnonzero(types == property_type)
+            self.partitions[property_type] = self._build(raw[members], members)
+        self.any_type = self._build(raw, np.arange(len(self.rents))) if len(self.rents) else None
+
+    def _raw_features(self, df):
+        """Unscaled feature matrix, NaN where missing"""
+        latitude = df['Latitude'].astype('float64').to_numpy()
+        longitude = df['Longitude'].astype('float64').to_numpy()
+        km_per_longitude = KM_PER_DEGREE_LONGITUDE_AT_EQUATOR * np.cos(np.radians(self.latitude0))
+        return np.column_stack([
+            df['Beds'].astype('float64').to_numpy() / self.scales['Beds'],
+            df['Baths'].astype('float64').to_numpy() / self.scales['Baths'],
+            df['Sq Ft'].astype('float64').to_numpy() / self.scales['Sq Ft'],
+            latitude * KM_PER_DEGREE_LATITUDE / self.scales['km'],
+            longitude * km_per_longitude / self.scales['km'],
+        ])
+
+    def _build(self, features, members):
+        """KD-tree over one partition, with its fill values for missing features"""
+        fill = np.nanmedian(features, axis=0) if len(features) else np.zeros(features.shape[1])
+        fill = np.where(np.isnan(fill), 0.0, fill)
+        filled = np.where(np.isnan(features), fill, features)
+        return {'tree': cKDTree(filled), 'members': members, 'fill': fill}
+
+    def query(self, sale_df, k=None):
+        """
+        Estimate the rent of every sale listing from its nearest rentals
+
+        Parameters:
+            sale_df (pd.DataFrame): Parsed for-sale listings
+            k (int, optional): Overrides the index's number of comparables
+
+        Returns:
+            pd.DataFrame: Aligned with sale_df, with columns
+                'Estimated Rent'       inverse-distance weighted rent of the comparables
+                'Comparable Count'     number of comparables used
+                'Comparable Distance'  mean distance to them, in feature units
+                'Comparables'          row positions of the comparables in df_rent
+        """
+        k = k or self.k
+        n = len(sale_df)
+        estimate = np.full(n, np.nan)
+        count = np.zeros(n, dtype='int64')
+        distance = np.full(n, np.nan)
+        comparables = np.full((n, k), -1, dtype='int64')
+
+        raw = self._raw_features(sale_df)
+        types = sale_df['Property Type'].astype(str).to_numpy()
+        for property_type in pd.unique(types):
+            rows = np.flatnonzero(types == property_type)
+            partition = self.partitions.get(property_type)
+            if partition is None:
+                if not self.fallback_any_type or self.any_type is None:
+                    continue
+                partition = self.any_type
+            self._query_partition(partition, raw[rows], rows, k, estimate, count, distance, comparables)
+
+        return pd.DataFrame({
+            'Estimated Rent': estimate,
+            'Comparable Count': count,
+            'Comparable Distance': distance,
+            'Comparables': list(comparables),
+        }, index=sale_df.index)
+
+    def _query_partition(self, partition, features, rows, k, estimate, count, distance, comparables):
+        k_used = min(k, len(partition['members']))
+        features = np.where(np.isnan(features), partition['fill'], features)
+        dist, idx = partition['tree'].query(features, k=k_used, workers=-1)
+        dist = dist.reshape(len(rows), k_used)
+        idx = idx.reshape(len(rows), k_used)
+
+        members = partition['members'][idx]
+        weights = 1.0 / (dist + 1e-6)
+        estimate[rows] = (weights * self.rents[members]).sum(axis=1) / weights.sum(axis=1)
+        count[rows] = k_used
+        distance[rows] = dist.mean(axis=1)
+        comparables[rows, :k_used] = self.positions[members]
@@ -1,119 +1,278 @@
 # Data processing functions
+import numpy as np
 import pandas as pd
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
+import logging
+import os
 import time
 
+from geocode_cache import get_default_geocode_cache, normalize_address, NOT_FOUND
+from zip_centroids import zip_centroid_coordinates
+from instrumentation import count, log_event, timed
+
+# Nominatim server and its rate limit, overridable to point at a local instance
+NOMINATIM_DOMAIN = os.environ.get('NOMINATIM_DOMAIN', 'nominatim.openstreetmap.org')
+NOMINATIM_SCHEME = os.environ.get('NOMINATIM_SCHEME', 'https')
+NOMINATIM_MIN_DELAY_SECONDS = float(os.environ.get('NOMINATIM_MIN_DELAY_SECONDS', 1))
+
+@timed('summary')
 def generate_rent_summary(df_rent):
     """
     Generate a summary of rental properties grouped by property type, bedrooms, and bathrooms.
     
     Args:
         df_rent (pd.DataFrame): DataFrame containing rental property data
-                                Must have columns: 'Property Type', 'Beds', 'Baths', 'Monthly Rent v2'
+                                Must have columns: 'Property Type', 'Beds', 'Baths', 'Rent'
     
     Returns:
         pd.DataFrame: Summary statistics with count, min, median, and max rent for each group
     """
-    df_rent['Rent'] = pd.to_numeric(df_rent['Rent'], errors='coerce')
-    #df_rent['Sq Ft'] = pd.to_numeric(df_rent['Sq Ft'], errors='coerce')
-    #df_rent['Rent per Sq Ft'] = df_rent['Rent'] / df_rent['Sq Ft']
+    # Parsed listings already hold a numeric Rent column, only coerce other input
+    rent = df_rent['Rent']
+    if not pd.api.types.is_numeric_dtype(rent):
+        rent = pd.to_numeric(rent, errors='coerce')
     
-    rent_summary = df_rent.groupby(['Property Type', 'Beds', 'Baths'])['Rent'].agg([
+    rent_summary = rent.groupby([df_rent['Property Type'], df_rent['Beds'], df_rent['Baths']],
+                                observed=True).agg([
         ('Count', 'count'),
         ('Min Rent', 'min'),
         ('Median Rent', 'median'),
         ('Max Rent', 'max')
     ]).reset_index()
     
+    # Plain floats for display, the summary is small
+    rent_stats = ['Min Rent', 'Median Rent', 'Max Rent']
+    rent_summary[rent_stats] = rent_summary[rent_stats].astype('float64')
+    rent_summary['Property Type'] = rent_summary['Property Type'].astype(str)
+    
     return rent_summary
 
 
-def calculate_investment_metrics(sale_df, rent_summary):
+# Columns returned by calculate_investment_metrics, in order
+INVESTMENT_COLUMNS = [
+    'Address', 'City', 'State', 'Zip', 'Beds', 'Baths', 'Sq Ft', 
+    'Property Type', 'Status', 'Listing Price', 'Estimated Annual Rent',
+    'Projected Expenses', 'NOI', 'Cap Rate', 'Listing URL', 'Primary Image',
+    'Latitude', 'Longitude'
+]
+INVESTMENT_METRICS = ['Estimated Annual Rent', 'Projected Expenses', 'NOI', 'Cap Rate']
+
+
+@timed('metrics')
+def calculate_investment_metrics(sale_df, rent_summary, expense_ratio=0.5, k=10,
+                                 sort_key='Cap Rate', ascending=False, page=0,
+                                 comparable_index=None):
     """
     Calculate investment metrics for properties by joining rent data and computing financial indicators.
     
+    Metrics are computed as arrays over just the join keys and price, then only
+    the k listings of the requested page are selected (a partial selection,
+    not a full sort) and materialized with their display columns.
+    
     Parameters:
     - sale_df: DataFrame with property listings including Price, Property Type, Beds, Baths
     - rent_summary: DataFrame with rental data including Property Type, Beds, Baths, Median Rent per Sq Ft
+    - expense_ratio: Share of the annual rent projected as expenses, e.g. 0.5 for 50%
+    - k: Number of listings per page, None for every listing
+    - sort_key: Column to rank by, a metric or any numeric column of sale_df
+    - ascending: Rank lowest first instead of highest first
+    - page: Page of the ranking to return, 0 for the top k
+    - comparable_index: ComparableRentIndex to estimate rents from the nearest rentals
+      instead of the exact (type, beds, baths) match in rent_summary
     
     Returns:
-    - DataFrame with original data plus investment metrics, sorted by Cap Rate
+    - DataFrame with the ranked listings and their investment metrics, missing values last
     """
-    # First ensure the column names match exactly between dataframes
-    rent_df_clean = rent_summary.rename(columns={
-        'Property Type': 'Property Type',
-        'Beds': 'Beds',
-        'Baths': 'Baths',
-        'Median Rent': 'Median Rent'
-    })
+    metrics = investment_metric_arrays(sale_df, rent_summary, expense_ratio, comparable_index)
+    if sort_key in metrics:
+        sort_values = metrics[sort_key]
+    else:
+        sort_values = sale_df[sort_key if sort_key != 'Listing Price' else 'Price'].astype('float64').to_numpy()
     
-    # Perform the left join to keep all rows from df
-    result_df = sale_df.merge(
-        rent_df_clean[['Property Type', 'Beds', 'Baths', 'Median Rent']], 
-        on=['Property Type', 'Beds', 'Baths'],
-        how='left'
-    )
+    positions = rank_listings(sort_values, k=k, ascending=ascending, offset=page * (k or 0))
     
-    # 1. Create Estimated Annual Rent column
-    result_df['Estimated Annual Rent'] = result_df['Median Rent'] * 12
+    # Select only the requested columns in the specified order
+    result_df = sale_df.iloc[positions].reset_index(drop=True)
+    result_df['Listing Price'] = result_df['Price']
+    for name in INVESTMENT_METRICS:
+        result_df[name] = metrics[name][positions]
+
+    # Plain floats (NaN for missing) for display
+    numeric_columns = ['Beds', 'Baths', 'Sq Ft', 'Listing Price', 'Estimated Annual Rent', 'Projected Expenses', 'NOI', 'Cap Rate',
+                       'Latitude', 'Longitude']
+    return result_df[INVESTMENT_COLUMNS].astype({col: 'float64' for col in numeric_columns})
+
+
+def investment_metric_arrays(sale_df, rent_summary, expense_ratio=0.5, comparable_index=None):
+    """
+    Compute the investment metrics of every listing as float arrays
     
-    # 2. Create Projected Expenses column
-    result_df['Projected Expenses'] = result_df['Estimated Annual Rent'] * 0.5
+    Only the join keys and price are read from sale_df, nothing is copied.
+    The monthly rent is the matching Median Rent of rent_summary, or the
+    comparable_index estimate when one is given.
     
-    # 3. Create NOI (Net Operating Income) column
-    result_df['NOI'] = result_df['Estimated Annual Rent'] - result_df['Projected Expenses']
+    Returns:
+    - dict of metric name -> np.ndarray aligned with sale_df rows
+    """
+    if comparable_index is not None:
+        median_rent = comparable_index.query(sale_df)['Estimated Rent'].to_numpy()
+    else:
+        median_rent = lookup_rents(sale_df, rent_summary, ['Median Rent'])[:, 0]
+    price = sale_df['Price'].astype('float64').to_numpy()
     
-    # 4. Create Cap Rate column (as a percentage)
-    result_df['Cap Rate'] = 100 * result_df['NOI'] / result_df['Price']
+    annual_rent = median_rent * 12
+    expenses = annual_rent * expense_ratio
+    noi = annual_rent - expenses
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cap_rate = 100 * noi / price
     
-    # Sort by Cap Rate in descending order (highest first)
-    result_df = result_df.sort_values(by='Cap Rate', ascending=False).reset_index()
+    return {
+        'Estimated Annual Rent': annual_rent,
+        'Projected Expenses': expenses,
+        'NOI': noi,
+        'Cap Rate': cap_rate,
+    }
+
+
+def lookup_rents(sale_df, rent_summary, columns):
+    """
+    Look up rent summary statistics for every sale listing
     
-    # Create a renamed copy of Price as Sale Price if needed
-    result_df['Listing Price'] = result_df['Price']
+    Parameters:
+    - sale_df: DataFrame with Property Type, Beds and Baths
+    - rent_summary: Output of generate_rent_summary
+    - columns: Summary columns to return, e.g. ['Min Rent', 'Median Rent', 'Max Rent']
     
-    # Select only the requested columns in the specified order
-    selected_columns = [
-        'Address', 'City', 'State', 'Zip', 'Beds', 'Baths', 'Sq Ft', 
-        'Property Type', 'Status', 'Listing Price', 'Estimated Annual Rent',
-        'Projected Expenses', 'NOI', 'Cap Rate', 'Listing URL', 'Primary Image'
-    ]
+    Returns:
+    - np.ndarray of shape (len(sale_df), len(columns)), NaN where no rentals match
+    """
+    keys = ['Property Type', 'Beds', 'Baths']
+    # Left join on the keys only, the summary has one row per key so row order is kept
+    rents = sale_df[keys].merge(rent_summary[keys + list(columns)], on=keys, how='left')[list(columns)]
+    return rents.astype('float64').to_numpy()
 
-    numeric_columns = ['Beds', 'Baths', 'Sq Ft', 'Listing Price', 'Estimated Annual Rent', 'Projected Expenses', 'NOI', 'Cap Rate']
-    for col in numeric_columns:
-        result_df[col] = pd.to_numeric(result_df[col], errors='coerce')
+
+def rank_listings(values, k=10, ascending=False, offset=0):
+    """
+    Positions of the listings ranked by values, one page at a time
     
-    # Return top 10 results
-    return result_df[selected_columns].head(10)
+    Only offset + k values are selected with np.partition and sorted, so
+    ranking the top few hundred of a large metro costs O(n) rather than a full
+    sort. Ties keep their original order and NaN values rank last.
+    
+    Parameters:
+    - values: Array of sort values
+    - k: Page size, None for every listing after offset
+    - ascending: Rank lowest first instead of highest first
+    - offset: Number of ranked listings to skip
+    
+    Returns:
+    - np.ndarray of row positions for the page
+    """
+    values = np.asarray(values, dtype='float64')
+    valid = np.flatnonzero(~np.isnan(values))
+    keyed = values[valid] if ascending else -values[valid]
+    stop = len(values) if k is None else offset + k
+    
+    if stop < len(valid):
+        # Every value ranked above the stop-th one, then the first of its ties:
+        # argpartition alone would keep an arbitrary subset of the ties
+        kth = np.partition(keyed, stop - 1)[stop - 1]
+        above = np.flatnonzero(keyed < kth)
+        candidates = np.concatenate([above, np.flatnonzero(keyed == kth)[:stop - len(above)]])
+    else:
+        candidates = np.arange(len(valid))
+    ranked = valid[candidates[np.lexsort((valid[candidates], keyed[candidates]))]]
+    
+    if stop > len(valid):
+        ranked = np.concatenate([ranked, np.flatnonzero(np.isnan(values))])
+    return ranked[offset:stop]
+
 
+def listing_mask(df, min_beds=None, min_baths=None, min_price=None, max_price=None,
+                 property_types=None):
+    """
+    Select the listings matching every given filter, as one vectorized pass
 
-def geocode_addresses(df):
+    Parameters:
+    - df: Listings or investment metrics, priced by 'Listing Price', 'Price' or 'Rent'
+    - min_beds, min_baths: Lowest number of bedrooms / bathrooms, None for any
+    - min_price, max_price: Price bounds, inclusive, None for no bound
+    - property_types: Property Type values to keep, None or empty for every type
 
+    Returns:
+    - np.ndarray of bools aligned with df rows. A listing missing a value
+      never matches a filter on that value.
+    """
+    price = next((c for c in ['Listing Price', 'Price', 'Rent'] if c in df.columns), 'Price')
+    mask = np.ones(len(df), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for column, bound, lower in [('Beds', min_beds, True), ('Baths', min_baths, True),
+                                     (price, min_price, True), (price, max_price, False)]:
+            if bound is None:
+                continue
+            values = df[column].astype('float64').to_numpy()
+            mask &= values >= bound if lower else values <= bound
+    if property_types:
+        mask &= df['Property Type'].isin(list(property_types)).to_numpy(dtype=bool)
+    return mask
+
+
+@timed('geocode')
+def geocode_addresses(df, cache=None, use_nominatim=False):
+    """
+    Add latitude and longitude to listings for the map
+    
+    Coordinates come from the listing payload ('Latitude'/'Longitude' columns)
+    whenever it has them. Listings without coordinates are geocoded with
+    Nominatim only if use_nominatim is True, and anything still missing is
+    placed at its zip's centroid from the bundled offline table. The
+    'coordinate_source' column records which of the three was used.
+    
+    Parameters:
+    - df: DataFrame with Address, City, State and Zip columns, and optionally Latitude and Longitude
+    - cache: GeocodeCache for Nominatim results, defaults to the shared on-disk cache
+    - use_nominatim: Geocode listings without coordinates over the network
+    
+    Returns:
+    - (DataFrame of rows with coordinates, [center latitude, center longitude])
+    """
     # A little manipulation
     geo_df = df.copy()
-    geo_df['full_address'] = geo_df['Address'] + ', ' + geo_df['City'] + ', ' + geo_df['State'] + ' ' + geo_df['Zip'].astype(str)
+    geo_df['full_address'] = (geo_df['Address'].astype(str) + ', ' + geo_df['City'].astype(str) + ', '
+                              + geo_df['State'].astype(str) + ' ' + geo_df['Zip'].astype(str))
 
-    # Initialize geocoder with user_agent
-    geolocator = Nominatim(user_agent="streamlit_app")
-    # Use rate limiter to respect API limits
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+    # Coordinates included in the listing payload
+    if 'Latitude' in geo_df.columns and 'Longitude' in geo_df.columns:
+        latitude = geo_df['Latitude'].astype('float64').to_numpy(copy=True)
+        longitude = geo_df['Longitude'].astype('float64').to_numpy(copy=True)
+    else:
+        latitude = np.full(len(geo_df), np.nan)
+        longitude = np.full(len(geo_df), np.nan)
+    source = np.where(np.isnan(latitude) | np.isnan(longitude), None, 'listing').astype(object)
 
-    # Add latitude and longitude columns
-    geo_df['latitude'] = None
-    geo_df['longitude'] = None
+    # Precise but slow: Nominatim, only when asked for
+    missing = np.isnan(latitude) | np.isnan(longitude)
+    if use_nominatim and missing.any():
+        addresses = geo_df['full_address'].to_numpy()[missing]
+        known = nominatim_coordinates(addresses, cache)
+        found = [known.get(normalize_address(a), NOT_FOUND) for a in addresses]
+        latitude[missing] = [np.nan if lat is None else lat for lat, lon in found]
+        longitude[missing] = [np.nan if lon is None else lon for lat, lon in found]
+        source[missing] = ['nominatim' if lat is not None else None for lat, lon in found]
 
-    #Add lat and lon to data
-    for i, row in geo_df.iterrows():
-        try:
-            location = geocode(row['full_address'])
-            if location:
-                geo_df.at[i, 'latitude'] = location.latitude
-                geo_df.at[i, 'longitude'] = location.longitude
-            else:
-                print(f"Could not geocode address: {row['full_address']}")
-        except Exception as e:
-            print(f"Error geocoding address: {row['full_address']} - {str(e)}")
+    # Approximate: the center of the listing's zip
+    missing = np.isnan(latitude) | np.isnan(longitude)
+    if missing.any():
+        zip_latitude, zip_longitude = zip_centroid_coordinates(geo_df['Zip'].to_numpy()[missing])
+        latitude[missing] = zip_latitude
+        longitude[missing] = zip_longitude
+        source[missing] = np.where(np.isnan(zip_latitude), None, 'zip_centroid')
+
+    geo_df['latitude'] = latitude
+    geo_df['longitude'] = longitude
+    geo_df['coordinate_source'] = source
 
     # Filter out rows with missing coordinates
     map_df = geo_df.dropna(subset=['latitude', 'longitude'])
@@ -124,4 +283,58 @@ def geocode_addresses(df):
         map_df['longitude'].mean()
     ]
 
-    return map_df, map_center
\ No newline at end of file
+    return map_df, map_center
+
+
+def nominatim_coordinates(addresses, cache=None):
+    """
+    Geocode addresses with Nominatim through the on-disk geocode cache
+    
+    Only addresses never seen before (or whose cached result expired) go to
+    Nominatim and wait on its 1 request/second rate limit.
+    
+    Parameters:
+    - addresses: Full address strings
+    - cache: GeocodeCache to use, defaults to the shared on-disk cache
+    
+    Returns:
+    - dict of normalized address -> (latitude, longitude), NOT_FOUND if it did not geocode
+    """
+    cache = cache or get_default_geocode_cache()
+
+    # Look every address up in the cache first
+    known = cache.get_many(addresses)
+    misses = {}
+    for address in addresses:
+        key = normalize_address(address)
+        if key not in known:
+            misses.setdefault(key, address)
+    count('realtor_cache_requests_total', len(addresses) - len(misses), cache='geocode', result='hit')
+    count('realtor_cache_requests_total', len(misses), cache='geocode', result='miss')
+
+    if not misses:
+        return known
+
+    # Initialize geocoder with user_agent
+    geolocator = Nominatim(user_agent="streamlit_app", domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+    # Use rate limiter to respect API limits
+    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=NOMINATIM_MIN_DELAY_SECONDS)
+
+    for key, address in misses.items():
+        try:
+            location = geocode(address)
+        except Exception as e:
+            # Errors are not cached so the address is retried next time
+            count('realtor_geocode_total', result='error')
+            log_event('geocode_error', logging.WARNING, address=address, error=str(e))
+            continue
+        count('realtor_geocode_total', result='found' if location else 'not_found')
+        if location:
+            known[key] = (location.latitude, location.longitude)
+            cache.set(address, location.latitude, location.longitude)
+        else:
+            log_event('geocode_not_found', logging.INFO, address=address)
+            known[key] = NOT_FOUND
+            cache.set(address, None, None)
+
+    return known
@@ -0,0 +1,123 @@
+### Persistent cache of geocoding results keyed by normalized address
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+DEFAULT_GEOCODE_CACHE_PATH = os.environ.get('REALTOR_GEOCODE_CACHE_PATH',
+                                            os.path.join('.cache', 'geocode.sqlite'))
+
+# Returned by GeocodeCache.get for an address known not to geocode
+NOT_FOUND = (None, None)
+
+
+def normalize_address(address):
+    """
+    Normalize an address so trivially different spellings share a cache entry
+
+    Case, punctuation and repeated whitespace are ignored, e.g.
+    "1713 Ben Davis Ln,  Kirkwood, MO 63122" -> "1713 ben davis ln kirkwood mo 63122"
+    """
+    address = unicodedata.normalize('NFKC', str(address)).lower()
+    address = re.sub(r"[^\w\s]", " ", address)
+    return " ".join(address.split())
+
+
+class GeocodeCache:
+    """
+    SQLite-backed cache of address -> (latitude, longitude)
+
+    Addresses the geocoder could not resolve are stored too, with a shorter
+    TTL, so they are not looked up again on every render but are retried later.
+
+    Parameters:
+        path (str): SQLite database file
+        ttl (float): Seconds a found location stays valid
+        negative_ttl (float): Seconds a "not found" result stays valid
+    """
+
+    def __init__(self, path=DEFAULT_GEOCODE_CACHE_PATH, ttl=90 * 86400, negative_ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._write_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocodes (
+                    address TEXT PRIMARY KEY,
+                    latitude REAL,
+                    longitude REAL,
+                    created REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, addresses):
+        """
+        Look up many addresses at once
+
+        Returns:
+            dict: normalized address -> (latitude, longitude), or NOT_FOUND for
+                  cached negative results. Missing or expired entries are omitted.
+        """
+        keys = list({normalize_address(a) for a in addresses})
+        now = time.time()
+        found = {}
+        with self._connect() as conn:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT address, latitude, longitude, created FROM geocodes "
+                    f"WHERE address IN ({placeholders})", chunk).fetchall()
+                for address, latitude, longitude, created in rows:
+                    ttl = self.negative_ttl if latitude is None else self.ttl
+                    if now - created <= ttl:
+                        found[address] = (latitude, longitude)
+        return found
+
+    def get(self, address):
+        """Look up one address, returns None on a miss, see get_many"""
+        return self.get_many([address]).get(normalize_address(address))
+
+    def set(self, address, latitude, longitude):
+        """Store a result, pass latitude=longitude=None for an address that did not geocode"""
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocodes (address, latitude, longitude, created) VALUES (?, ?, ?, ?)",
+                (normalize_address(address), latitude, longitude, time.time()))
+
+    def clear(self):
+        """Delete every cached result"""
+        with self._write_lock, self._connect() as conn:
+            conn.execute("DELETE FROM geocodes")
+
+
+_default_geocode_cache = None
+_default_geocode_cache_lock = threading.Lock()
+
+
+def get_default_geocode_cache():
+    """Return the process-wide geocode cache"""
+    global _default_geocode_cache
+    with _default_geocode_cache_lock:
+        if _default_geocode_cache is None:
+            _default_geocode_cache = GeocodeCache()
+        return _default_geocode_cache
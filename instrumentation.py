@@ -0,0 +1,309 @@
+### Lightweight timing, metrics and structured logging
+# Stages are timed with span("fetch"), counters and histograms live in one
+# process-wide registry exported in the Prometheus text format, and events
+# are logged as one JSON object per line on the "realtor" logger. A trace
+# collects the spans of the current request (one Streamlit script run, one
+# batch job...) for the app's debug panel.
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('realtor')
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+# Metric name -> (type, help text), every metric is declared here
+METRICS = {
+    'realtor_stage_seconds': ('histogram', "Time spent in each pipeline stage"),
+    'realtor_api_responses_total': ('counter', "Realtor API responses by endpoint and status code"),
+    'realtor_api_errors_total': ('counter', "Realtor API requests that failed without a response"),
+    'realtor_api_payload_bytes': ('histogram', "Size of Realtor API response bodies"),
+    'realtor_cache_requests_total': ('counter', "Cache lookups by cache and result"),
+    'realtor_parse_errors_total': ('counter', "Values that could not be read, by field"),
+    'realtor_parse_skipped_total': ('counter', "Properties skipped as unreadable, by schema"),
+    'realtor_geocode_total': ('counter', "Nominatim geocoding attempts by result"),
+    'realtor_broker_requests_total': ('counter', "Upstream searches by priority and broker outcome"),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+    """Thread-safe store of labelled counters and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def counter_totals(self, name, by, **match):
+        """Sum of a counter per value of the label by, over the series matching the match labels"""
+        match = dict(_label_key(match))
+        totals = {}
+        with self._lock:
+            for (metric, labels), value in self.counters.items():
+                labels = dict(labels)
+                if metric == name and all(labels.get(k) == v for k, v in match.items()):
+                    totals[labels.get(by)] = totals.get(labels.get(by), 0) + value
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def prometheus_text(self):
+        """Every metric in the Prometheus text exposition format"""
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+            return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS.items():
+                series = self.counters if kind == 'counter' else self.histograms
+                keys = sorted(key for key in series if key[0] == name)
+                if not keys:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key in keys:
+                    labels = key[1]
+                    if kind == 'counter':
+                        lines.append(f"{name}{labels_text(labels)} {series[key]:g}")
+                        continue
+                    histogram = series[key]
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{labels_text(labels, [('le', f'{bound:g}')])} {count}")
+                    lines.append(f"{name}_bucket{labels_text(labels, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{labels_text(labels)} {histogram.sum:g}")
+                    lines.append(f"{name}_count{labels_text(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Spans of the current request, see start_trace
+_trace = contextvars.ContextVar('realtor_trace', default=None)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """Log one structured event as a JSON object"""
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({'event': event, **fields}, default=str))
+
+
+def count(name, value=1, **labels):
+    """Increment a counter declared in METRICS"""
+    registry.inc(name, value, **labels)
+
+
+def observe_bytes(name, size, **labels):
+    """Record a size, e.g. of a response body, in a histogram declared in METRICS"""
+    registry.observe(name, size, BYTES_BUCKETS, **labels)
+
+
+def start_trace():
+    """
+    Start collecting the spans of the current request
+
+    Threads started with asyncio.to_thread inherit the trace.
+
+    Returns:
+        list: The trace, filled with dicts of stage, seconds and labels
+    """
+    trace = []
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def record_span(stage, seconds, error=None, trace=None, **labels):
+    """Record the duration of a stage, see span"""
+    registry.observe('realtor_stage_seconds', seconds, stage=stage, **labels)
+    trace = trace if trace is not None else _trace.get()
+    if trace is not None:
+        trace.append({'stage': stage, 'seconds': seconds, **labels})
+    log_event('span', logging.DEBUG, stage=stage, seconds=round(seconds, 6), error=error, **labels)
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Time a block as one pipeline stage
+
+    The duration goes to the realtor_stage_seconds histogram, to the trace of
+    the current request and, at debug level, to the log. Failures are timed too.
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record_span(stage, time.perf_counter() - start, error, **labels)
+
+
+class StageTimer:
+    """
+    Time a stage that runs in pieces, e.g. a download read while it is parsed
+
+    The pieces timed with running() and timed_iter() add up to one span,
+    recorded by finish() in the trace that was current when the timer was
+    created. Use span() for a stage that runs in one block.
+    """
+
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.seconds = 0.0
+        self.error = None
+        self.finished = False
+        self.trace = _trace.get()
+
+    @contextmanager
+    def running(self):
+        """Time a block as part of the stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.error = type(e).__name__
+            raise
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def timed_iter(self, iterable):
+        """
+        Iterate iterable, timing only the time spent getting each item
+
+        The stage is finished once the iterable is exhausted, fails or is
+        closed, and a generator passed in is closed along with it.
+        """
+        iterator = iter(iterable)
+        try:
+            while True:
+                with self.running():
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            self.finish()
+
+    def finish(self):
+        """Record the stage, once"""
+        if not self.finished:
+            self.finished = True
+            record_span(self.stage, self.seconds, self.error, self.trace, **self.labels)
+
+
+def timed(stage, **labels):
+    """Decorator timing every call of a function as a span"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def cache_hit_ratio(cache):
+    """Share of lookups of a cache ('response', 'geocode') that were served from it, None if unused"""
+    totals = registry.counter_totals('realtor_cache_requests_total', 'result', cache=cache)
+    lookups = sum(totals.values())
+    if not lookups:
+        return None
+    return (lookups - totals.get('miss', 0)) / lookups
+
+
+def configure_logging(level=logging.INFO):
+    """Send the structured log to stderr, unless the application configured handlers already"""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """
+    Serve prometheus_text() on http://host:port/metrics from a background thread
+
+    Returns:
+        ThreadingHTTPServer: Call shutdown() to stop it
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def prometheus_text():
+    """Every metric of the process in the Prometheus text exposition format"""
+    return registry.prometheus_text()
@@ -0,0 +1,378 @@
+### Declarative field schemas for the Realtor listing feeds
+# Each feed is described once as a list of output columns. A Field copies a
+# value found at a path in the property JSON, a Derived column computes its
+# values from the values found at a source path (status flags, pet policy,
+# listing URL...). compile_schema() turns a schema into a columnar batch
+# extractor, see its docstring.
+# A column may declare a dtype: numeric columns become nullable Float64 and
+# low-cardinality text columns categoricals, so the analytics never have to
+# coerce 'N/A' strings. Display formatting (e.g. "$1,250") is left to the app.
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count
+
+Field = namedtuple('Field', ['column', 'path', 'default', 'dtype'])
+Derived = namedtuple('Derived', ['column', 'func', 'source', 'default', 'dtype'])
+
+NUMERIC = 'Float64'
+CATEGORY = 'category'
+
+_EMPTY = {}
+
+
+def field(column, *path, default='N/A', dtype=None):
+    """Column copied from the property JSON at path, default when the key is missing"""
+    return Field(column, path, default, dtype)
+
+
+def derived(column, func, *source, default=None, dtype=None):
+    """Column computed by func(values), values being the list found at source, default when missing"""
+    return Derived(column, func, source, default, dtype)
+
+
+### Derivations shared by the schemas
+# Each takes the source values of a chunk of properties and returns their
+# column, so there is one Python call per chunk rather than one per property.
+
+def status_from_flags(flag_labels):
+    """Build a derivation joining the labels of every set flag, "ACTIVE" if none are"""
+    def statuses(flags_values):
+        column = []
+        for flags in flags_values:
+            if not flags or not isinstance(flags, dict):
+                column.append("ACTIVE")
+                continue
+            labels = [label for flag, label in flag_labels if flags.get(flag)]
+            column.append(', '.join(labels) if labels else "ACTIVE")
+        return column
+    return statuses
+
+
+def pets_from_policy(policy_labels):
+    """Build a derivation listing the pets allowed by the pet policy"""
+    def pets(policies):
+        column = []
+        for pet_policy in policies:
+            if not pet_policy or not isinstance(pet_policy, dict):
+                column.append("No information")
+                continue
+            labels = [label for key, label in policy_labels if pet_policy.get(key)]
+            column.append(', '.join(labels) if labels else "No information")
+        return column
+    return pets
+
+
+def detail_text(category, label):
+    """Build a derivation returning the text after label in a details category"""
+    def text_values(details_values):
+        column = []
+        for details in details_values:
+            value = "N/A"
+            if details and isinstance(details, list):
+                for detail in details:
+                    if not isinstance(detail, dict) or detail.get('category') != category:
+                        continue
+                    texts = detail.get('text', [])
+                    if not isinstance(texts, list):
+                        continue
+                    for text in texts:
+                        if isinstance(text, str) and label in text:
+                            value = text.split(label)[1].strip()
+            column.append(value)
+        return column
+    return text_values
+
+
+def listing_url(base_url):
+    """Build a derivation joining base_url and the property permalink"""
+    def urls(permalinks):
+        return [f"{base_url}{permalink}" if permalink != 'N/A' else 'N/A' for permalink in permalinks]
+    return urls
+
+
+def first_href(items_values):
+    """The href of the first entry of a list, e.g. virtual_tours"""
+    return [items[0].get('href', 'N/A') if items and isinstance(items, list) and isinstance(items[0], dict)
+            else 'N/A' for items in items_values]
+
+
+def coordinate(key):
+    """Build a derivation reading key of location.address.coordinate, None when absent"""
+    def values(coordinates):
+        return [coord.get(key) if isinstance(coord, dict) else None for coord in coordinates]
+    return values
+
+
+def primary_image(photos):
+    return [photo.get('href', 'N/A') if photo and isinstance(photo, dict) else 'N/A' for photo in photos]
+
+
+def additional_photos(photos_values):
+    return [len(photos) - 1 if photos and isinstance(photos, list) else 0 for photos in photos_values]
+
+
+def management_phone(advertisers_values):
+    """Phone number of the last management advertiser listing one"""
+    column = []
+    for advertisers in advertisers_values:
+        contact_phone = "N/A"
+        if advertisers and isinstance(advertisers, list):
+            for advertiser in advertisers:
+                if not isinstance(advertiser, dict):
+                    continue
+                office = advertiser.get('office')
+                if advertiser.get('type') != "management" or not isinstance(office, dict):
+                    continue
+                phones = office.get('phones', [])
+                if phones and isinstance(phones, list) and isinstance(phones[0], dict):
+                    contact_phone = phones[0].get('number', 'N/A')
+        column.append(contact_phone)
+    return column
+
+
+def branding_name(branding_values):
+    return [branding[0].get('name', 'N/A')
+            if branding and isinstance(branding, list) and isinstance(branding[0], dict) else 'N/A'
+            for branding in branding_values]
+
+
+### Feed schemas, in output column order
+
+RENTAL_SCHEMA = [
+    field('Address', 'location', 'address', 'line'),
+    field('City', 'location', 'address', 'city', dtype=CATEGORY),
+    field('State', 'location', 'address', 'state_code', dtype=CATEGORY),
+    field('Zip', 'location', 'address', 'postal_code', dtype=CATEGORY),
+    derived('Latitude', coordinate('lat'), 'location', 'address', 'coordinate', dtype=NUMERIC),
+    derived('Longitude', coordinate('lon'), 'location', 'address', 'coordinate', dtype=NUMERIC),
+    field('Rent', 'list_price', default=None, dtype=NUMERIC),
+    field('Beds', 'description', 'beds', default=None, dtype=NUMERIC),
+    field('Baths', 'description', 'baths_consolidated', default=None, dtype=NUMERIC),
+    field('Sq Ft', 'description', 'sqft', default=None, dtype=NUMERIC),
+    field('Property Type', 'description', 'type', dtype=CATEGORY),
+    field('Sub Type', 'description', 'sub_type'),
+    derived('Status', status_from_flags([
+        ('is_new_listing', "NEW LISTING"),
+        ('is_pending', "PENDING"),
+    ]), 'flags', dtype=CATEGORY),
+    derived('Security Deposit', detail_text("Rental Info", "Security Deposit:"), 'details'),
+    derived('Available From', detail_text("Other Property Info", "Availability Date:"), 'details'),
+    derived('Pets Allowed', pets_from_policy([
+        ('cats', "Cats"),
+        ('dogs_small', "Small Dogs"),
+        ('dogs_large', "Large Dogs"),
+    ]), 'pet_policy'),
+    field('Listing ID', 'listing_id'),
+    field('Property ID', 'property_id'),
+    field('List Date', 'list_date'),
+    derived('Contact Phone', management_phone, 'advertisers'),
+    derived('Primary Image', primary_image, 'primary_photo'),
+    derived('Additional Photos', additional_photos, 'photos'),
+    derived('Virtual Tour', first_href, 'virtual_tours'),
+    derived('Listing URL', listing_url("https://www.realtor.com/rentals/details/"), 'permalink', default='N/A'),
+]
+
+SALE_SCHEMA = [
+    field('Address', 'location', 'address', 'line'),
+    field('City', 'location', 'address', 'city', dtype=CATEGORY),
+    field('State', 'location', 'address', 'state_code', dtype=CATEGORY),
+    field('Zip', 'location', 'address', 'postal_code', dtype=CATEGORY),
+    derived('Latitude', coordinate('lat'), 'location', 'address', 'coordinate', dtype=NUMERIC),
+    derived('Longitude', coordinate('lon'), 'location', 'address', 'coordinate', dtype=NUMERIC),
+    field('Price', 'list_price', default=None, dtype=NUMERIC),
+    field('Beds', 'description', 'beds', default=None, dtype=NUMERIC),
+    field('Baths', 'description', 'baths_consolidated', default=None, dtype=NUMERIC),
+    field('Sq Ft', 'description', 'sqft', default=None, dtype=NUMERIC),
+    field('Lot Size (sq ft)', 'description', 'lot_sqft', default=None, dtype=NUMERIC),
+    field('Property Type', 'description', 'type', dtype=CATEGORY),
+    derived('Status', status_from_flags([
+        ('is_new_listing', "NEW LISTING"),
+        ('is_price_reduced', "PRICE REDUCED"),
+        ('is_pending', "PENDING"),
+        ('is_foreclosure', "FORECLOSURE"),
+        ('is_coming_soon', "COMING SOON"),
+        ('is_new_construction', "NEW CONSTRUCTION"),
+        ('is_contingent', "CONTINGENT"),
+    ]), 'flags', dtype=CATEGORY),
+    field('Listing ID', 'listing_id'),
+    field('Property ID', 'property_id'),
+    field('List Date', 'list_date'),
+    derived('Primary Image', primary_image, 'primary_photo'),
+    derived('Additional Photos', additional_photos, 'photos'),
+    derived('Virtual Tour', first_href, 'virtual_tours'),
+    derived('Listed By', branding_name, 'branding'),
+    derived('Listing URL', listing_url("https://www.realtor.com/realestateandhomes-detail/"), 'permalink',
+            default='N/A'),
+]
+
+
+### Schema compiler
+
+def _all_dicts(values):
+    """Whether every value is a plain dict, checked at C speed"""
+    return set(map(type, values)) <= {dict}
+
+
+def compile_schema(schema, name='listings', chunk_size=256):
+    """
+    Compile a schema into a columnar batch extractor
+
+    The columns are built directly from lists: every object on a field path
+    (location, location.address, description...) is gathered with one list
+    comprehension per level, each Field is a comprehension of dict.get over
+    the list of its parent objects, and each Derived column one call of its
+    derivation over the list of its source values.
+
+    Properties are read chunk_size at a time. Every column makes its own pass
+    over the property dicts, and over a whole 100k-listing response each pass
+    would reload them from main memory; a chunk stays in the CPU cache.
+
+    Every value is still read with a Python dict.get, as the per-property
+    loops did, so parsing is about as fast as those loops (see
+    benchmarks/bench_parsers.py). What the schema buys is one declarative
+    place for the fields and typed columns without a separate cast pass.
+
+    Returns:
+        callable: extract(properties) -> dict of column name -> list of
+        values, with extract.columns holding the column names in order.
+        Properties whose parent objects are not dicts cannot be read and are
+        skipped, and counted per schema name in realtor_parse_skipped_total.
+    """
+    paths = [spec.source if isinstance(spec, Derived) else spec.path for spec in schema]
+    # Every parent object to gather, each after its own parent
+    parent_paths = list(dict.fromkeys(path[:depth] for path in paths for depth in range(1, len(path))))
+
+    def extract_chunk(properties):
+        if not _all_dicts(properties):
+            properties = [prop for prop in properties if isinstance(prop, dict)]
+        parents = {(): properties}
+        for path in parent_paths:
+            objects = [parent.get(path[-1], _EMPTY) for parent in parents[path[:-1]]]
+            if not _all_dicts(objects):
+                keep = [i for i, obj in enumerate(objects) if isinstance(obj, dict)]
+                parents = {known: [values[i] for i in keep] for known, values in parents.items()}
+                objects = [objects[i] for i in keep]
+            parents[path] = objects
+
+        columns = {}
+        values_at = {}
+        for spec, path in zip(schema, paths):
+            default = spec.default
+            if (path, default) not in values_at:
+                key = path[-1]
+                values_at[path, default] = [parent.get(key, default) for parent in parents[path[:-1]]]
+            values = values_at[path, default]
+            columns[spec.column] = spec.func(values) if isinstance(spec, Derived) else values
+        return columns
+
+    def extract(properties):
+        if len(properties) <= chunk_size:
+            columns = extract_chunk(properties)
+        else:
+            columns = {column: [] for column in extract.columns}
+            for start in range(0, len(properties), chunk_size):
+                for column, values in extract_chunk(properties[start:start + chunk_size]).items():
+                    columns[column].extend(values)
+        skipped = len(properties) - len(columns[extract.columns[0]]) if extract.columns else 0
+        if skipped:
+            count('realtor_parse_skipped_total', skipped, schema=name)
+        return columns
+
+    extract.columns = [spec.column for spec in schema]
+    extract.dtypes = {spec.column: spec.dtype for spec in schema if spec.dtype}
+    return extract
+
+
+def extract_dataframe(extractor, batches):
+    """
+    Run an extractor over batches of properties and build one DataFrame
+
+    Parameters:
+        extractor (callable): Compiled schema, see compile_schema
+        batches (iterable): Lists of property dicts, e.g. one per response page
+
+    Returns:
+        pd.DataFrame: Extracted listings, empty with the schema columns if there
+                      are none (e.g. no listing matched the search filters)
+    """
+    parts = [extractor(batch) for batch in batches]
+    if len(parts) == 1:
+        columns = parts[0]
+    else:
+        columns = {column: [value for part in parts for value in part[column]] for column in extractor.columns}
+
+    return pd.DataFrame({column: typed_column(columns[column], extractor.dtypes.get(column), column)
+                         for column in extractor.columns})
+
+
+def typed_column(values, dtype, column):
+    """
+    Build a column from its extracted values, cast to its schema dtype
+
+    Typed columns are built straight from the list rather than inferred first
+    and cast afterwards. Untyped ones are returned as they are, for the
+    DataFrame to infer.
+    """
+    if dtype is None:
+        return values if values else pd.array(values, dtype=object)
+    if dtype == CATEGORY:
+        return pd.Categorical(values)
+    if dtype == NUMERIC:
+        try:
+            # Numbers, numeric strings and None convert in one pass
+            numbers = np.array(values, dtype=float)
+        except (TypeError, ValueError):
+            numbers = None
+        if numbers is not None and numbers.ndim == 1:
+            return pd.array(numbers, dtype=NUMERIC)
+    return cast_column(pd.Series(values), dtype, column).array
+
+
+def cast_column(values, dtype, column):
+    """
+    Cast one column to its schema dtype
+
+    Values that cannot be read as numbers, e.g. 'N/A', become <NA>. Values
+    other than the 'N/A' and None placeholders that do not parse are counted
+    per column in realtor_parse_errors_total.
+
+    Parameters:
+        values (pd.Series): Parsed values of the column
+        dtype (str): NUMERIC or CATEGORY
+        column (str): Column name, for the error count
+
+    Returns:
+        pd.Series: The cast values
+    """
+    if dtype != NUMERIC:
+        return values.astype(dtype)
+    numbers = pd.to_numeric(values, errors='coerce')
+    if not pd.api.types.is_numeric_dtype(values):
+        failed = int((numbers.isna() & values.notna() & (values != 'N/A')).sum())
+        if failed:
+            count('realtor_parse_errors_total', failed, field=column)
+    return numbers.astype(NUMERIC)
+
+
+def apply_dtypes(df, dtypes):
+    """
+    Cast the columns of a parsed DataFrame to their schema dtypes in place, see cast_column
+
+    Parameters:
+        df (pd.DataFrame): Parsed listings
+        dtypes (dict): Column name to NUMERIC or CATEGORY, e.g. extract_rentals.dtypes
+
+    Returns:
+        pd.DataFrame: The same DataFrame
+    """
+    for column, dtype in dtypes.items():
+        if column in df.columns:
+            df[column] = cast_column(df[column], dtype, column)
+    return df
+
+
+extract_rentals = compile_schema(RENTAL_SCHEMA, 'rentals')
+extract_properties = compile_schema(SALE_SCHEMA, 'sales')
@@ -0,0 +1,256 @@
+### Columnar snapshot store of parsed listings
+# Parsed rentals and sales are kept as Parquet files partitioned by zip and
+# snapshot date:
+#
+#     <root>/<kind>/zip=63122/snapshot_date=2024-05-01/part-0.parquet
+#
+# A snapshot only holds the listings that are new or changed since the last
+# time they were stored: every row gets a content hash, and <root>/<kind>/
+# _index.parquet remembers the latest hash per listing key. Reading the store
+# "as of" a date therefore means taking the latest row of every key up to
+# that date. Reads go through pyarrow.dataset, so zip, date and column
+# filters are pushed down to the partitions and row groups.
+import datetime
+import os
+import shutil
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from listing_schema import apply_dtypes, extract_rentals, extract_properties
+
+DEFAULT_STORE_PATH = os.environ.get('REALTOR_STORE_PATH', os.path.join('.cache', 'listings'))
+
+RENTALS = 'rentals'
+SALES = 'sales'
+KIND_DTYPES = {RENTALS: extract_rentals.dtypes, SALES: extract_properties.dtypes}
+
+PARTITIONING = ds.partitioning(pa.schema([('zip', pa.string()), ('snapshot_date', pa.string())]),
+                               flavor='hive')
+INDEX_FILE = '_index.parquet'
+UNKNOWN_ZIP = 'unknown'
+
+
+def listing_keys(df, hashes=None):
+    """
+    Stable key of every listing: its Listing ID, else its Property ID
+
+    Rows carrying neither are keyed by their content hash, see content_hashes.
+    """
+    def known(column):
+        if column not in df.columns:
+            return pd.Series(pd.NA, index=df.index, dtype='string')
+        values = df[column].astype('string')
+        return values.mask(values.isin(['N/A', '', 'None']))
+
+    keys = known('Listing ID').fillna('property:' + known('Property ID'))
+    if hashes is None:
+        hashes = content_hashes(df)
+    return keys.fillna('hash:' + pd.Series(hashes, index=df.index).astype(str)).astype(str)
+
+
+def content_hashes(df):
+    """64-bit hash of every row's values, independent of column dtypes"""
+    return pd.util.hash_pandas_object(normalize_columns(df), index=False).to_numpy()
+
+
+def normalize_columns(df):
+    """Plain float and nullable string columns, as written to Parquet"""
+    out = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            out[column] = values.astype('float64')
+        else:
+            out[column] = values.astype('string')
+    return pd.DataFrame(out, index=df.index)
+
+
+class ListingStore:
+    """
+    Parquet store of listing snapshots with incremental upserts
+
+    Parameters:
+        root (str): Directory holding one sub-directory per kind (rentals, sales)
+    """
+
+    def __init__(self, root=DEFAULT_STORE_PATH):
+        self.root = root
+        self._write_lock = threading.Lock()
+
+    def _kind_path(self, kind):
+        if kind not in KIND_DTYPES:
+            raise ValueError(f"Unknown listing kind {kind!r}, expected one of {sorted(KIND_DTYPES)}")
+        return os.path.join(self.root, kind)
+
+    def _partition_path(self, kind, zip_code, snapshot_date):
+        return os.path.join(self._kind_path(kind), f"zip={zip_code}", f"snapshot_date={snapshot_date}")
+
+    def read_index(self, kind):
+        """Latest content hash, zip and snapshot date of every stored listing key"""
+        path = os.path.join(self._kind_path(kind), INDEX_FILE)
+        if not os.path.exists(path):
+            return pd.DataFrame({'key': pd.Series(dtype=str), 'hash': pd.Series(dtype='uint64'),
+                                 'zip': pd.Series(dtype=str), 'snapshot_date': pd.Series(dtype=str)})
+        return pq.read_table(path).to_pandas()
+
+    def upsert(self, df, kind, snapshot_date=None):
+        """
+        Store the listings of df that are new or changed since they were last stored
+
+        Parameters:
+            df (pd.DataFrame): Parsed listings from display_and_store_rentals/properties
+            kind (str): RENTALS or SALES
+            snapshot_date (str or date, optional): Snapshot to write, defaults to today
+
+        Returns:
+            dict: Number of 'written' and 'unchanged' listings
+        """
+        if df is None or df.empty:
+            return {'written': 0, 'unchanged': 0}
+        snapshot_date = str(snapshot_date or datetime.date.today().isoformat())
+
+        rows = normalize_columns(df).reset_index(drop=True)
+        hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+        rows['_key'] = listing_keys(df, hashes).to_numpy()
+        rows['_hash'] = hashes
+        # The same listing can appear twice in one batch, keep the last
+        rows = rows.drop_duplicates('_key', keep='last')
+        zips = rows['Zip'].fillna(UNKNOWN_ZIP) if 'Zip' in rows.columns else UNKNOWN_ZIP
+        rows['_zip'] = pd.Series(zips, index=rows.index).str.replace(r'[^0-9A-Za-z-]', '', regex=True)
+        rows.loc[rows['_zip'] == '', '_zip'] = UNKNOWN_ZIP
+
+        with self._write_lock:
+            index = self.read_index(kind)
+            stored = index['key'] + ':' + index['hash'].astype(str)
+            changed = ~(rows['_key'] + ':' + rows['_hash'].astype(str)).isin(stored).to_numpy()
+            changed_rows = rows[changed]
+
+            for zip_code, partition in changed_rows.groupby('_zip', sort=False):
+                self._write_partition(kind, zip_code, snapshot_date, partition)
+
+            updates = pd.DataFrame({'key': changed_rows['_key'], 'hash': changed_rows['_hash'],
+                                    'zip': changed_rows['_zip'], 'snapshot_date': snapshot_date})
+            index = pd.concat([index[~index['key'].isin(updates['key'])], updates], ignore_index=True)
+            os.makedirs(self._kind_path(kind), exist_ok=True)
+            pq.write_table(pa.Table.from_pandas(index, preserve_index=False),
+                           os.path.join(self._kind_path(kind), INDEX_FILE))
+
+        return {'written': int(changed.sum()), 'unchanged': int((~changed).sum())}
+
+    def _write_partition(self, kind, zip_code, snapshot_date, rows):
+        """Write rows to a zip/date partition, replacing rows of the same keys stored earlier that day"""
+        directory = self._partition_path(kind, zip_code, snapshot_date)
+        path = os.path.join(directory, 'part-0.parquet')
+        rows = rows.drop(columns=['_hash', '_zip'])
+        if os.path.exists(path):
+            existing = pq.read_table(path).to_pandas()
+            rows = pd.concat([existing[~existing['_key'].isin(rows['_key'])], rows], ignore_index=True)
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), path)
+
+    def dataset(self, kind):
+        """The pyarrow dataset of a kind, with zip and snapshot_date partition fields"""
+        return ds.dataset(self._kind_path(kind), format='parquet', partitioning=PARTITIONING)
+
+    def read(self, kind, zips=None, start=None, end=None, columns=None, filter=None, latest=True):
+        """
+        Read stored listings, pushing the filters down to the Parquet files
+
+        Parameters:
+            kind (str): RENTALS or SALES
+            zips (iterable, optional): Only read these zips
+            start (str, optional): First snapshot date to read, inclusive
+            end (str, optional): Last snapshot date to read, inclusive
+            columns (list, optional): Listing columns to read, defaults to all
+            filter (pyarrow.compute.Expression, optional): Extra row filter,
+                   e.g. pyarrow.dataset.field('Price') < 300000
+            latest (bool): Keep only the latest stored version of every listing
+                           up to end, i.e. the market as of that date. With
+                           False every stored version is returned.
+
+        Returns:
+            pd.DataFrame: Listings with the schema dtypes plus 'snapshot_date',
+                          empty if nothing matches
+        """
+        if not os.path.isdir(self._kind_path(kind)):
+            return pd.DataFrame()
+
+        # The index knows the current version of every listing, so reading the
+        # current market pushes every filter down and then drops stale versions.
+        # As of an earlier date, versions are picked first and filtered after,
+        # so an older matching version cannot stand in for a changed listing.
+        current = latest and end is None
+        conditions = []
+        if zips is not None:
+            conditions.append(ds.field('zip').isin([str(z) for z in zips]))
+        if start is not None:
+            conditions.append(ds.field('snapshot_date') >= str(start))
+        if end is not None:
+            conditions.append(ds.field('snapshot_date') <= str(end))
+        if filter is not None and (current or not latest):
+            conditions.append(filter)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+
+        read_columns = None
+        if columns is not None and (filter is None or current or not latest):
+            read_columns = list(dict.fromkeys(list(columns) + ['_key', 'snapshot_date']))
+        table = self.dataset(kind).to_table(columns=read_columns, filter=expression)
+
+        if current:
+            index = self.read_index(kind)
+            versions = pa.array((index['key'] + '@' + index['snapshot_date']).to_numpy(dtype=object))
+            row_versions = pc.binary_join_element_wise(
+                table.column('_key').cast(pa.string()), table.column('snapshot_date'), '@')
+            table = table.filter(pc.is_in(row_versions, value_set=versions))
+        elif latest and table.num_rows:
+            df = table.to_pandas().sort_values('snapshot_date', kind='stable')
+            table = pa.Table.from_pandas(df.drop_duplicates('_key', keep='last'), preserve_index=False)
+            if filter is not None:
+                table = table.filter(filter)
+
+        df = table.to_pandas()
+        if columns is not None:
+            df = df[list(dict.fromkeys(list(columns) + ['snapshot_date']))]
+        else:
+            df = df.drop(columns=['_key', 'zip'])
+        return apply_dtypes(df.reset_index(drop=True), KIND_DTYPES[kind])
+
+    def price_history(self, kind, zips=None):
+        """
+        Every stored price of every listing, for price reductions and days on market
+
+        Returns:
+            pd.DataFrame: Listing ID, Property ID, snapshot_date, price and List Date,
+                          ordered by listing and date
+        """
+        price = 'Rent' if kind == RENTALS else 'Price'
+        history = self.read(kind, zips=zips, latest=False,
+                            columns=['Listing ID', 'Property ID', price, 'List Date'])
+        if history.empty:
+            return history
+        return history.sort_values(['Listing ID', 'Property ID', 'snapshot_date']).reset_index(drop=True)
+
+    def clear(self):
+        """Delete every stored snapshot"""
+        with self._write_lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    """Return the process-wide listing store"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ListingStore()
+        return _default_store
@@ -0,0 +1,260 @@
+### Incremental, mergeable rent statistics
+# StreamingRentSummary keeps the rent summary of generate_rent_summary up to
+# date as batches of rentals arrive (response pages, zips, workers) without
+# regrouping everything seen so far. Count, min and max are exact; the median
+# and other percentiles come from a quantile sketch per (type, beds, baths).
+#
+# The sketch is a log-bucketed histogram (DDSketch): a rent x falls in bucket
+# ceil(log_gamma(x)) with gamma = (1 + a) / (1 - a), so any quantile is
+# returned within a relative error a of a true rent. Two sketches merge by
+# adding their bucket counts, which is exact and order independent.
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RELATIVE_ACCURACY = 0.005
+
+SUMMARY_KEYS = ['Property Type', 'Beds', 'Baths']
+
+
+class RentSketch:
+    """
+    Count, min, max and a quantile sketch of the rents of one group
+
+    Rents of zero or less cannot be log-bucketed and are counted as zero.
+
+    Parameters:
+        relative_accuracy (float): Relative error bound of the quantiles
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zero_count = 0
+        self.buckets = {}
+
+    def bucket_indexes(self, rents):
+        """Bucket of every positive rent"""
+        return np.ceil(np.log(rents) / math.log(self.gamma)).astype('int64')
+
+    def add(self, rents):
+        """Add an array of rents, NaN values are ignored"""
+        rents = np.asarray(rents, dtype='float64')
+        rents = rents[~np.isnan(rents)]
+        if not len(rents):
+            return self
+        positive = rents[rents > 0]
+        indexes, counts = np.unique(self.bucket_indexes(positive), return_counts=True)
+        self.add_buckets(indexes, counts)
+        self.zero_count += len(rents) - len(positive)
+        self.count += len(rents)
+        self.min = min(self.min, float(rents.min()))
+        self.max = max(self.max, float(rents.max()))
+        return self
+
+    def add_buckets(self, indexes, counts):
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other):
+        """Add the rents summarized by another sketch of the same accuracy"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of different relative accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """
+        Estimate the q-quantile, e.g. 0.5 for the median
+
+        Interpolates linearly between the two ranks around q * (count - 1), as
+        pandas does, so the median of an even-sized group lies between its two
+        middle rents.
+
+        Returns:
+            float: Within relative_accuracy of the exact quantile, NaN if empty
+        """
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        below = math.floor(rank)
+        fraction = rank - below
+        value = self.rank_value(below)
+        if fraction:
+            value += fraction * (self.rank_value(below + 1) - value)
+        return value
+
+    def rank_value(self, rank):
+        """Estimate of the rent at 0-based rank in sorted order, exact for the min and max"""
+        if rank <= 0:
+            return self.min
+        if rank >= self.count - 1:
+            return self.max
+        if rank < self.zero_count:
+            return min(0.0, self.max)
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i] in relative terms
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'count': self.count,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'zero_count': self.zero_count,
+            'buckets': [[index, count] for index, count in sorted(self.buckets.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'])
+        sketch.count = data['count']
+        if sketch.count:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        sketch.zero_count = data['zero_count']
+        sketch.buckets = {index: count for index, count in data['buckets']}
+        return sketch
+
+
+class StreamingRentSummary:
+    """
+    Rent summary by (property type, beds, baths) that can be updated and merged
+
+    Parameters:
+        relative_accuracy (float): Relative error bound of the median and percentiles
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.sketches = {}
+
+    def __len__(self):
+        return len(self.sketches)
+
+    def _sketch(self, key):
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = RentSketch(self.relative_accuracy)
+        return sketch
+
+    def update(self, df_rent):
+        """
+        Add a batch of parsed rentals, e.g. one response page or one zip
+
+        Rows without a rent, beds, baths or property type are ignored, as they
+        are by generate_rent_summary. The batch is grouped once: exact
+        statistics per key and bucket counts per (key, bucket) are computed
+        with vectorized groupbys and folded into the running sketches.
+
+        Parameters:
+            df_rent (pd.DataFrame): Parsed rentals with Property Type, Beds, Baths and Rent
+
+        Returns:
+            StreamingRentSummary: self
+        """
+        if df_rent is None or df_rent.empty:
+            return self
+        batch = pd.DataFrame({
+            'Property Type': df_rent['Property Type'].astype(str),
+            'Beds': df_rent['Beds'].astype('float64'),
+            'Baths': df_rent['Baths'].astype('float64'),
+            'Rent': pd.to_numeric(df_rent['Rent'], errors='coerce').astype('float64'),
+        })
+        batch = batch[df_rent['Property Type'].notna().to_numpy()].dropna()
+        if batch.empty:
+            return self
+
+        groups = batch.groupby(SUMMARY_KEYS, sort=False)['Rent']
+        exact = groups.agg(['count', 'min', 'max'])
+        zeros = (batch['Rent'] <= 0).groupby([batch[k] for k in SUMMARY_KEYS], sort=False).sum()
+
+        positive = batch[batch['Rent'] > 0]
+        probe = RentSketch(self.relative_accuracy)
+        bucket_counts = positive.groupby(
+            [positive[k] for k in SUMMARY_KEYS] + [probe.bucket_indexes(positive['Rent'].to_numpy())],
+            sort=False).size()
+
+        for key, count, low, high in exact.itertuples(name=None):
+            sketch = self._sketch(key)
+            sketch.count += int(count)
+            sketch.min = min(sketch.min, float(low))
+            sketch.max = max(sketch.max, float(high))
+            sketch.zero_count += int(zeros[key])
+        for (*key, index), count in bucket_counts.items():
+            sketch = self.sketches[tuple(key)]
+            sketch.buckets[int(index)] = sketch.buckets.get(int(index), 0) + int(count)
+        return self
+
+    def merge(self, other):
+        """Fold in the summary of other rentals, e.g. another zip or worker"""
+        for key, sketch in other.sketches.items():
+            self._sketch(key).merge(sketch)
+        return self
+
+    def to_frame(self, percentiles=()):
+        """
+        Build the rent summary table
+
+        Parameters:
+            percentiles (sequence): Extra percentiles to report, e.g. (25, 75)
+                                    adds 'P25 Rent' and 'P75 Rent' columns
+
+        Returns:
+            pd.DataFrame: Same columns and dtypes as generate_rent_summary, sorted by key
+        """
+        rows = []
+        for key in sorted(self.sketches):
+            sketch = self.sketches[key]
+            row = list(key) + [sketch.count, sketch.min, sketch.quantile(0.5), sketch.max]
+            row.extend(sketch.quantile(p / 100) for p in percentiles)
+            rows.append(row)
+
+        columns = SUMMARY_KEYS + ['Count', 'Min Rent', 'Median Rent', 'Max Rent']
+        columns += [f'P{p:g} Rent' for p in percentiles]
+        summary = pd.DataFrame(rows, columns=columns)
+        summary['Property Type'] = summary['Property Type'].astype(str)
+        summary[['Beds', 'Baths']] = summary[['Beds', 'Baths']].astype('Float64')
+        summary['Count'] = summary['Count'].astype('Int64')
+        summary[columns[4:]] = summary[columns[4:]].astype('float64')
+        return summary
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'groups': [list(key) + [sketch.to_dict()] for key, sketch in self.sketches.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(data['relative_accuracy'])
+        for property_type, beds, baths, sketch in data['groups']:
+            summary.sketches[(property_type, beds, baths)] = RentSketch.from_dict(sketch)
+        return summary
+
+    def save(self, path):
+        """Write the summary to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """Read a summary written by save"""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
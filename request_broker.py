@@ -0,0 +1,324 @@
+### Process-wide broker of upstream search requests
+# Every Streamlit session runs in the same process, so identical searches sent
+# at the same time (several analysts on one zip) are coalesced: the first
+# caller sends the request and the others wait for its result. The broker also
+# tracks the quota left from the RapidAPI rate limit headers and admits
+# requests by priority: interactive searches (HIGH) go through until the quota
+# is spent, background work (LOW: batch runs, cache revalidation) keeps a
+# reserve of the quota free and is queued until the quota resets, or shed when
+# the reset is too far away.
+import contextvars
+import logging
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import count, log_event
+
+HIGH = 'high'
+LOW = 'low'
+
+# Priority of the requests sent from the current context, see request_priority
+_priority = contextvars.ContextVar('realtor_request_priority', default=HIGH)
+
+# x-ratelimit-requests-limit, x-ratelimit-requests-remaining, x-ratelimit-requests-reset...
+RATE_LIMIT_HEADER = re.compile(r'^x-ratelimit-(.+)-(limit|remaining|reset)$', re.IGNORECASE)
+
+
+@contextmanager
+def request_priority(priority):
+    """Send the requests of a block, and of the threads it starts with asyncio.to_thread, at a priority"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def set_request_priority(priority):
+    """Set the priority of the current context for good, e.g. in a batch worker process"""
+    _priority.set(priority)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class QuotaTracker:
+    """
+    Quota left according to the rate limit headers of the latest responses
+
+    RapidAPI sends x-ratelimit-<name>-limit, -remaining and -reset (seconds
+    until the quota renews) for every quota of the plan. Each is tracked on
+    its own and the most constrained one decides.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.quotas = {}
+
+    def update(self, headers):
+        """Record the rate limit headers of a response"""
+        found = {}
+        for header, value in headers.items():
+            match = RATE_LIMIT_HEADER.match(header)
+            if not match:
+                continue
+            try:
+                found.setdefault(match.group(1).lower(), {})[match.group(2).lower()] = float(value)
+            except ValueError:
+                continue
+        if not found:
+            return
+        now = time.time()
+        with self._lock:
+            for name, values in found.items():
+                if 'remaining' not in values:
+                    continue
+                quota = self.quotas.setdefault(name, {})
+                quota['remaining'] = values['remaining']
+                quota['limit'] = values.get('limit', quota.get('limit'))
+                quota['reset_at'] = now + values['reset'] if 'reset' in values else None
+                quota['updated'] = now
+
+    def blocked_for(self, reserve=0.0, in_flight=0):
+        """
+        Seconds until a request may be sent without eating into the reserve
+
+        Parameters:
+            reserve (float): Share of each quota's limit to keep free
+            in_flight (int): Requests sent but not answered yet, they use quota too
+
+        Returns:
+            float: 0 when a request may go now, the seconds until the blocking
+                   quota resets, or math.inf when its reset time is unknown
+        """
+        now = time.time()
+        wait = 0.0
+        with self._lock:
+            for quota in self.quotas.values():
+                reset_at = quota.get('reset_at')
+                if reset_at is not None and reset_at <= now:
+                    # Renewed since the last response, unknown until the next one
+                    continue
+                floor = math.ceil(reserve * quota['limit']) if quota.get('limit') else 0
+                if quota['remaining'] - in_flight > floor:
+                    continue
+                wait = max(wait, math.inf if reset_at is None else reset_at - now)
+        return wait
+
+    def snapshot(self):
+        """Every tracked quota as {name: {remaining, limit, reset_in}}"""
+        now = time.time()
+        with self._lock:
+            return {name: {'remaining': q['remaining'], 'limit': q.get('limit'),
+                           'reset_in': None if q.get('reset_at') is None else max(0.0, q['reset_at'] - now)}
+                    for name, q in self.quotas.items()}
+
+    def clear(self):
+        with self._lock:
+            self.quotas.clear()
+
+
+class RequestShed(Exception):
+    """A request was not sent because the quota is (nearly) spent"""
+
+
+# Result of a flight whose leader cannot hand its response over, e.g. a streamed
+# search: the body is read by the leader's parser, not kept in memory
+UNSHARED = object()
+
+
+class _Flight:
+    """One upstream request and the callers waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class RequestBroker:
+    """
+    Coalesce identical in-flight requests and admit requests by priority and quota
+
+    Parameters:
+        quota (QuotaTracker, optional): Quota fed by the HTTP client, defaults to the shared tracker
+        max_in_flight (int): Upstream requests sent at once, more wait in line (HIGH first)
+        low_priority_reserve (float): Share of every quota LOW requests leave to HIGH ones
+        max_queue_seconds (float): Longest a request waits for a slot or a quota
+                                   reset before it is shed
+    """
+
+    def __init__(self, quota=None, max_in_flight=16, low_priority_reserve=0.2, max_queue_seconds=30.0):
+        self.quota = quota or get_default_quota()
+        self.max_in_flight = max_in_flight
+        self.low_priority_reserve = low_priority_reserve
+        self.max_queue_seconds = max_queue_seconds
+        self._lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._flights = {}
+        self._in_flight = 0
+        self._waiting = {HIGH: 0, LOW: 0}
+
+    def join(self, key):
+        """
+        Join the in-flight request for key, or become the one sending it
+
+        Returns:
+            tuple: (flight, leader). The leader sends the request and must
+                   call finish(key, flight, ...), with UNSHARED as the result
+                   when it cannot hand its response over. The others call
+                   wait(flight).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        """Hand the result of a request to every caller waiting for it"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def wait(self, flight, timeout=None):
+        """
+        Wait for the leader of a flight
+
+        Parameters:
+            timeout (float, optional): Seconds to wait, None to wait for as long as the leader takes
+
+        Returns:
+            The leader's result. Raises its error, or TimeoutError.
+        """
+        if not flight.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for an identical request in flight")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    @contextmanager
+    def slot(self, priority=None):
+        """
+        Hold one of the upstream request slots
+
+        Waits while max_in_flight requests are out, while HIGH requests are in
+        line ahead of a LOW one, or while the quota is spent (for LOW requests:
+        down to the reserve) if it resets within max_queue_seconds.
+
+        Raises:
+            RequestShed: The request cannot be sent in time
+        """
+        priority = priority or current_priority()
+        reserve = self.low_priority_reserve if priority == LOW else 0.0
+        deadline = time.monotonic() + self.max_queue_seconds
+        queued = False
+        with self._slots:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    blocked = self.quota.blocked_for(reserve, self._in_flight)
+                    behind_high = priority == LOW and self._waiting[HIGH] > 0
+                    if not blocked and self._in_flight < self.max_in_flight and not behind_high:
+                        self._in_flight += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if blocked > remaining or remaining <= 0:
+                        count('realtor_broker_requests_total', priority=priority, result='shed')
+                        log_event('request_shed', logging.WARNING, priority=priority,
+                                  quota=self.quota.snapshot(), blocked_seconds=blocked)
+                        raise RequestShed(f"{priority} priority request shed, quota resets in {blocked:.0f}s")
+                    if blocked and not queued:
+                        queued = True
+                        count('realtor_broker_requests_total', priority=priority, result='queued')
+                    # Woken when a slot frees up, rechecks the quota at least every second
+                    self._slots.wait(min(remaining, max(blocked, 0.05), 1.0))
+            finally:
+                self._waiting[priority] -= 1
+        try:
+            yield
+        finally:
+            with self._slots:
+                self._in_flight -= 1
+                self._slots.notify_all()
+
+    def call(self, key, func, priority=None, unshared=None):
+        """
+        Run func() for key once, however many callers ask for it at the same time
+
+        Parameters:
+            key (str): Identity of the request, e.g. make_cache_key(endpoint, params)
+            func (callable): Sends the request and returns its result
+            priority (str, optional): HIGH or LOW, defaults to the current context's
+            unshared (callable, optional): Run instead of func once the flight
+                                           joined ended with UNSHARED, e.g. to
+                                           read what the leader cached.
+                                           Defaults to func.
+
+        Returns:
+            The result of func(), shared by every caller of the same flight
+
+        Raises:
+            RequestShed: The request was not sent, see slot
+        """
+        priority = priority or current_priority()
+        flight, leader = self.join(key)
+        if not leader:
+            count('realtor_broker_requests_total', priority=priority, result='coalesced')
+            try:
+                result = self.wait(flight)
+            except RequestShed:
+                # The leader was shed at its priority, try again at ours
+                return self.call(key, func, priority, unshared)
+            if result is UNSHARED:
+                # Nothing to share, get the response on our own
+                return self.call(key, unshared or func, priority, unshared)
+            return result
+
+        try:
+            with self.slot(priority):
+                count('realtor_broker_requests_total', priority=priority, result='sent')
+                result = func()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    def stats(self):
+        with self._slots:
+            return {'in_flight': self._in_flight, 'waiting': dict(self._waiting),
+                    'coalescing': len(self._flights), 'quota': self.quota.snapshot()}
+
+
+_default_quota = QuotaTracker()
+
+_default_broker = None
+_default_broker_lock = threading.Lock()
+
+
+def get_default_quota():
+    """Return the process-wide quota tracker fed by the Realtor API client"""
+    return _default_quota
+
+
+def get_default_broker():
+    """Return the process-wide request broker shared by every session"""
+    global _default_broker
+    with _default_broker_lock:
+        if _default_broker is None:
+            _default_broker = RequestBroker(
+                max_in_flight=int(os.environ.get('REALTOR_MAX_IN_FLIGHT', 16)),
+                low_priority_reserve=float(os.environ.get('REALTOR_LOW_PRIORITY_RESERVE', 0.2)))
+        return _default_broker
@@ -0,0 +1,262 @@
+### Persistent on-disk cache for Realtor API search responses
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from instrumentation import count, log_event
+from request_broker import request_priority, LOW
+
+DEFAULT_CACHE_PATH = os.environ.get('REALTOR_CACHE_PATH', os.path.join('.cache', 'realtor_responses.sqlite'))
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+
+def make_cache_key(endpoint, params):
+    """
+    Build the cache key for a search
+
+    The key covers the endpoint and every querystring parameter (location,
+    limit and any filters), so two searches share an entry only when they
+    would send the exact same request. The API key is never part of it.
+    """
+    canonical = json.dumps({'endpoint': endpoint, 'params': params or {}},
+                           sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of JSON search responses
+
+    Entries are stored zlib-compressed. An entry younger than ttl is served as
+    fresh. Up to stale_ttl it is served immediately as stale while a background
+    refresh replaces it (stale-while-revalidate). Once the total stored bytes
+    exceed max_bytes the least recently used entries are evicted.
+
+    Parameters:
+        path (str): SQLite database file
+        ttl (float): Seconds an entry is considered fresh
+        stale_ttl (float): Seconds an entry may still be served while revalidating
+        max_bytes (int): Upper bound on the total compressed size of all entries
+        offline (bool): Serve only from the cache, never call the API
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=3600, stale_ttl=86400,
+                 max_bytes=200 * 1024 * 1024, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._write_lock = threading.Lock()
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, endpoint, params):
+        """
+        Look up a cached response
+
+        Returns:
+            tuple: (payload or None, one of 'fresh', 'stale' or 'miss')
+        """
+        body, state = self.get_body(endpoint, params)
+        if body is None:
+            return None, state
+        return json.loads(zlib.decompress(body)), state
+
+    def get_body(self, endpoint, params):
+        """
+        Look up a cached response without decoding it, see iter_body_chunks
+
+        Returns:
+            tuple: (zlib-compressed JSON bytes or None, one of 'fresh', 'stale' or 'miss')
+        """
+        key = make_cache_key(endpoint, params)
+        with self._connect() as conn:
+            row = conn.execute("SELECT body, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, MISS
+            body, created = row
+            age = time.time() - created
+            if age > self.stale_ttl and not self.offline:
+                return None, MISS
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        return body, FRESH if age <= self.ttl else STALE
+
+    def set(self, endpoint, params, payload):
+        """Store a response and evict old entries if the cache is over its size bound"""
+        self.set_body(endpoint, params, zlib.compress(json.dumps(payload).encode('utf-8')))
+
+    def set_body(self, endpoint, params, body):
+        """Store a response given as zlib-compressed JSON bytes, e.g. compressed while streaming"""
+        key = make_cache_key(endpoint, params)
+        now = time.time()
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, params, body, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, json.dumps(params, sort_keys=True, default=str), body, len(body), now, now))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Delete least recently used entries until the total size fits in max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+        to_delete = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def fetch(self, endpoint, params, loader):
+        """
+        Return the response for a search, calling loader() only when needed
+
+        Parameters:
+            endpoint (str): Endpoint path
+            params (dict): Querystring parameters
+            loader (callable): Fetches the payload from the API, returns None on failure
+
+        Returns:
+            dict: The payload, or None if it is neither cached nor fetchable
+        """
+        payload, state = self.get(endpoint, params)
+        count('realtor_cache_requests_total', cache='response', result=state)
+        if state == FRESH or (self.offline and payload is not None):
+            return payload
+        if self.offline:
+            log_event('offline_miss', logging.WARNING, endpoint=endpoint, params=params)
+            return None
+        if state == STALE:
+            self.revalidate(endpoint, params, loader)
+            return payload
+
+        payload = loader()
+        if payload is not None:
+            self.set(endpoint, params, payload)
+        return payload
+
+    def revalidate(self, endpoint, params, loader):
+        """
+        Refresh a stale entry in a background thread, once per key
+
+        loader() returns the new payload, which is stored unless it is None. A
+        loader that stores the response itself, e.g. while streaming it, returns None.
+        """
+        key = make_cache_key(endpoint, params)
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                # Background work, it must not take the quota of interactive searches
+                with request_priority(LOW):
+                    payload = loader()
+                if payload is not None:
+                    self.set(endpoint, params, payload)
+            except Exception as e:
+                log_event('revalidate_error', logging.WARNING, endpoint=endpoint, error=str(e))
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def clear(self):
+        """Delete every cached response"""
+        with self._write_lock, self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+
+def iter_body_chunks(body, chunk_size=65536):
+    """Decompress a cached body a chunk at a time, for stream_json.iter_array_items"""
+    decompressor = zlib.decompressobj()
+    for start in range(0, len(body), chunk_size):
+        data = body[start:start + chunk_size]
+        # Bound every decompressed chunk too, JSON compresses about tenfold
+        while data:
+            chunk = decompressor.decompress(data, chunk_size)
+            if chunk:
+                yield chunk
+            data = decompressor.unconsumed_tail
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Return the process-wide response cache, honoring REALTOR_OFFLINE=1"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(offline=os.environ.get('REALTOR_OFFLINE') == '1')
+        return _default_cache
+
+
+def set_default_cache(cache):
+    """Replace the process-wide response cache"""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def cached_search(endpoint, params, loader, cache=None):
+    """
+    Run a search through a response cache
+
+    Parameters:
+        endpoint (str): Endpoint path
+        params (dict): Querystring parameters
+        loader (callable): Fetches the payload from the API
+        cache (ResponseCache or False, optional): Cache to use, defaults to the
+            shared cache. Pass False to always call the API.
+    """
+    if cache is False:
+        return loader()
+    cache = cache or get_default_cache()
+    return cache.fetch(endpoint, params, loader)
@@ -0,0 +1,134 @@
+### Cap rate / cash-on-cash sensitivity across many investment scenarios
+# Every listing is evaluated against a grid of scenarios (rent statistic,
+# expense ratio, vacancy, mortgage rate and down payment) in one broadcasted
+# NumPy pass: the result is an N listings x S scenarios float32 array.
+import itertools
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from data_processing import lookup_rents
+
+RENT_STATISTICS = ['Min Rent', 'Median Rent', 'Max Rent']
+
+ScenarioResult = namedtuple('ScenarioResult', ['scenarios', 'values', 'top_positions', 'top_values'])
+
+
+def build_scenarios(rent_statistics=('Median Rent',), expense_ratios=(0.4, 0.5),
+                    vacancy_rates=(0.0,), mortgage_rates=(0.0,), down_payments=(1.0,),
+                    loan_years=30):
+    """
+    Build the grid of every combination of the given assumptions
+
+    Parameters:
+        rent_statistics (sequence): Rent summary columns, see RENT_STATISTICS
+        expense_ratios (sequence): Share of collected rent spent on expenses
+        vacancy_rates (sequence): Share of the year a unit sits empty
+        mortgage_rates (sequence): Annual mortgage interest rates, e.g. 0.065
+        down_payments (sequence): Share of the price paid in cash, 1.0 for no financing
+        loan_years (int): Mortgage term
+
+    Returns:
+        pd.DataFrame: One row per scenario
+    """
+    grid = itertools.product(rent_statistics, expense_ratios, vacancy_rates,
+                             mortgage_rates, down_payments)
+    scenarios = pd.DataFrame(list(grid), columns=['Rent Statistic', 'Expense Ratio', 'Vacancy Rate',
+                                                  'Mortgage Rate', 'Down Payment'])
+    scenarios['Loan Years'] = loan_years
+    # Without a loan the rate is irrelevant, keep a single all-cash scenario per combination
+    all_cash = scenarios['Down Payment'] >= 1
+    scenarios.loc[all_cash, 'Mortgage Rate'] = 0.0
+    return scenarios.drop_duplicates().reset_index(drop=True)
+
+
+def annual_debt_service_factor(rates, years):
+    """Yearly mortgage payments per dollar borrowed, for monthly amortization"""
+    rates = np.asarray(rates, dtype='float64')
+    months = np.asarray(years, dtype='float64') * 12
+    monthly = rates / 12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(monthly > 0, monthly / (1 - (1 + monthly) ** -months), 1 / months)
+    return 12 * factor
+
+
+def evaluate_scenarios(sale_df, rent_summary, scenarios, k=10):
+    """
+    Evaluate every listing against every scenario
+
+    The returned value is the cash-on-cash return in percent:
+    (NOI - annual debt service) / cash invested. For all-cash scenarios
+    (down payment 1.0) this is exactly the cap rate.
+
+    Parameters:
+        sale_df (pd.DataFrame): Parsed for-sale listings with Price, Property Type, Beds, Baths
+        rent_summary (pd.DataFrame): Output of generate_rent_summary
+        scenarios (pd.DataFrame): Output of build_scenarios
+        k (int): Number of top listings kept per scenario
+
+    Returns:
+        ScenarioResult: scenarios, values (N x S float32, NaN where no rent
+        matches), top_positions and top_values (k x S, best first)
+    """
+    statistics = list(dict.fromkeys(scenarios['Rent Statistic']))
+    rents = lookup_rents(sale_df, rent_summary, statistics)
+    price = sale_df['Price'].astype('float64').to_numpy()[:, None]
+
+    # Per-scenario parameters as (1, S) rows, broadcast against (N, 1) listings
+    rent_column = scenarios['Rent Statistic'].map({s: i for i, s in enumerate(statistics)}).to_numpy()
+    expense = scenarios['Expense Ratio'].to_numpy()[None, :]
+    vacancy = scenarios['Vacancy Rate'].to_numpy()[None, :]
+    down = scenarios['Down Payment'].to_numpy()[None, :]
+    debt_factor = annual_debt_service_factor(scenarios['Mortgage Rate'], scenarios['Loan Years'])[None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        noi = rents[:, rent_column] * 12 * (1 - vacancy) * (1 - expense)
+        debt_service = price * (1 - down) * debt_factor
+        values = (100 * (noi - debt_service) / (price * down)).astype('float32')
+    values[~np.isfinite(values)] = np.nan
+
+    top_positions, top_values = top_k_per_scenario(values, k)
+    return ScenarioResult(scenarios, values, top_positions, top_values)
+
+
+def top_k_per_scenario(values, k):
+    """
+    Best k listings of every scenario column, by partial selection
+
+    Returns:
+        tuple: (positions, values), both k x S and ordered best first. Columns
+               with fewer than k valid values are padded with -1 / NaN.
+    """
+    n, s = values.shape
+    k = min(k, n)
+    keyed = np.where(np.isnan(values), -np.inf, values)
+    if k < n:
+        candidates = np.argpartition(-keyed, k - 1, axis=0)[:k]
+    else:
+        candidates = np.broadcast_to(np.arange(n)[:, None], (n, s))
+    candidate_values = np.take_along_axis(keyed, candidates, axis=0)
+    order = np.argsort(-candidate_values, axis=0, kind='stable')
+    positions = np.take_along_axis(candidates, order, axis=0)
+    top_values = np.take_along_axis(values, positions, axis=0)
+    positions = np.where(np.isnan(top_values), -1, positions)
+    return positions, top_values
+
+
+def scenario_top_listings(result, sale_df, scenario):
+    """
+    The top listings of one scenario as a DataFrame
+
+    Parameters:
+        result (ScenarioResult): Output of evaluate_scenarios
+        sale_df (pd.DataFrame): The listings passed to evaluate_scenarios
+        scenario (int): Row of result.scenarios
+
+    Returns:
+        pd.DataFrame: Listings best first, with a 'Return' column in percent
+    """
+    positions = result.top_positions[:, scenario]
+    valid = positions >= 0
+    top = sale_df.iloc[positions[valid]].reset_index(drop=True)
+    top['Return'] = result.top_values[valid, scenario].astype('float64')
+    return top
@@ -0,0 +1,118 @@
+### Filters of a listing search, split between the API and the client
+# The search endpoints filter on price and minimum beds and baths themselves,
+# so those are sent in the querystring and the API returns (and the cache
+# stores, and the parser reads) only matching listings. Property types and
+# status have no querystring parameter and are applied to the parsed
+# DataFrame as one vectorized mask. The querystring is part of the response
+# cache key, so differently filtered searches never share an entry.
+import re
+
+from data_processing import listing_mask
+
+# Query field -> querystring parameter of the search endpoints
+PUSHDOWN_PARAMS = {
+    'min_price': 'price_min',
+    'max_price': 'price_max',
+    'min_beds': 'beds_min',
+    'min_baths': 'baths_min',
+}
+
+
+def format_param(value):
+    """Querystring text of a filter value, whole floats as integers: 1500000.0 -> '1500000'"""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+
+class SearchQuery:
+    """
+    Filters of a for-rent or for-sale search
+
+    Parameters:
+        min_price (float, optional): Lowest price or rent, inclusive
+        max_price (float, optional): Highest price or rent, inclusive
+        min_beds (float, optional): Fewest bedrooms
+        min_baths (float, optional): Fewest bathrooms
+        property_types (iterable, optional): Property Type values to keep, e.g. ['condos']
+        statuses (iterable, optional): Status labels to keep, e.g. ['ACTIVE', 'PRICE REDUCED'].
+                                       A listing matches when any of its labels is wanted.
+    """
+
+    def __init__(self, min_price=None, max_price=None, min_beds=None, min_baths=None,
+                 property_types=None, statuses=None):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_beds = min_beds
+        self.min_baths = min_baths
+        # Sorted so equal queries compare, hash and build cache keys alike
+        self.property_types = tuple(sorted(set(property_types or ())))
+        self.statuses = tuple(sorted(set(statuses or ())))
+
+    def _key(self):
+        return (self.min_price, self.max_price, self.min_beds, self.min_baths,
+                self.property_types, self.statuses)
+
+    def __eq__(self, other):
+        return isinstance(other, SearchQuery) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        filters = ', '.join(f"{name}={value!r}" for name, value in self.to_dict().items())
+        return f"SearchQuery({filters})"
+
+    def __reduce__(self):
+        # Pickles as its filters, which is also how st.cache_data hashes it
+        return SearchQuery, self._key()
+
+    def __bool__(self):
+        return bool(self.to_dict())
+
+    def to_dict(self):
+        """The filters that are set, e.g. for a run report"""
+        return {name: list(value) if isinstance(value, tuple) else value
+                for name, value in zip(['min_price', 'max_price', 'min_beds', 'min_baths',
+                                        'property_types', 'statuses'], self._key())
+                if value not in (None, ())}
+
+    def params(self):
+        """Querystring parameters of the filters the endpoints apply"""
+        params = {}
+        for name, param in PUSHDOWN_PARAMS.items():
+            value = getattr(self, name)
+            if value is not None:
+                params[param] = format_param(value)
+        return params
+
+    def pushed_down(self):
+        """A query with only the filters sent to the API, which decide what is fetched"""
+        return SearchQuery(self.min_price, self.max_price, self.min_beds, self.min_baths)
+
+    def mask(self, df):
+        """
+        Select the listings matching every filter, as one vectorized pass
+
+        The pushed down filters are checked again: it costs little and keeps the
+        result exact should the API ignore or round one of them.
+
+        Returns:
+            np.ndarray: Booleans aligned with the rows of df
+        """
+        mask = listing_mask(df, min_beds=self.min_beds, min_baths=self.min_baths, min_price=self.min_price,
+                            max_price=self.max_price, property_types=self.property_types)
+        if self.statuses:
+            # Status holds every label of a listing joined by ', '
+            labels = '|'.join(re.escape(status) for status in self.statuses)
+            mask &= (df['Status'].astype(str)
+                     .str.contains(rf'(?:^|, )(?:{labels})(?:,|$)', regex=True)
+                     .to_numpy(dtype=bool))
+        return mask
+
+    def apply(self, df):
+        """The rows of df matching the query, df itself when it is empty or no filter is set"""
+        if df is None or df.empty or not self:
+            return df
+        return df[self.mask(df)]
+
@@ -0,0 +1,134 @@
+### Incremental decoding of one array of a JSON response
+# Search responses are {"properties": [{...}, {...}, ...], ...}. Instead of
+# decoding the whole body into one nested tree, iter_array_items walks the top
+# level object as the bytes arrive and decodes the items of the array one at a
+# time with json.JSONDecoder.raw_decode, so only the current chunk and the
+# item being decoded are held in memory.
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+class _TextStream:
+    """Text decoded from a stream of byte chunks, consumed from the front"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Append the next chunk, returns False once the stream is exhausted"""
+        if self.eof:
+            return False
+        # Keep only the text not consumed yet
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.text += self.utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+                return True
+        self.text += self.utf8.decode(b'', final=True)
+        self.eof = True
+        return True
+
+    def peek(self):
+        """Next character that is not whitespace, without consuming it"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.pos)
+                # A number at the very end of the text may continue in the next chunk
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_array_items(chunks, key='properties'):
+    """
+    Decode the items of one top level array of a JSON object incrementally
+
+    Parameters:
+        chunks (iterable): The document as bytes (or str) chunks, e.g.
+                           response.iter_content(65536)
+        key (str): Key of the array in the top level object
+
+    Yields:
+        The items of the array, in order. Nothing when the key is missing or
+        null. The rest of the document after the array is not read.
+
+    Raises:
+        ValueError: The document is not a JSON object or is cut short
+    """
+    stream = _TextStream(chunks)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        name = stream.value()
+        stream.expect(':')
+        if name == key:
+            if stream.peek() != '[':
+                # null or another non-array value, nothing to iterate
+                stream.value()
+                return
+            stream.expect('[')
+            if stream.peek() == ']':
+                return
+            while True:
+                yield stream.value()
+                separator = stream.peek()
+                stream.pos += 1
+                if separator == ']':
+                    return
+                if separator != ',':
+                    raise ValueError(f"Expected ',' or ']' in the {key!r} array, found {separator!r}")
+        stream.value()
+        separator = stream.peek()
+        stream.pos += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or '}}' in the top level object, found {separator!r}")
+
+
+def iter_array_pages(chunks, key='properties', page_size=250):
+    """
+    Group the decoded items into pages shaped like search responses
+
+    Yields:
+        dict: {key: [at most page_size items]}, which the display_and_store
+              functions accept as a stream of pages
+    """
+    page = []
+    for item in iter_array_items(chunks, key):
+        page.append(item)
+        if len(page) >= page_size:
+            yield {key: page}
+            page = []
+    if page:
+        yield {key: page}
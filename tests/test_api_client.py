@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+import types
+from email.utils import formatdate
+
+import pytest
+
+import api_client
+from api_client import RealtorClient, TokenBucket, parse_retry_after
+from benchmarks.mock_server import MockConfig, MockServer
+from request_broker import QuotaTracker
+
+SEARCH = '/search/forsale'
+PARAMS = {'location': '63122', 'limit': 5}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Waits of the client between attempts, recorded instead of slept"""
+    recorded = []
+    monkeypatch.setattr(api_client, 'time', types.SimpleNamespace(
+        sleep=recorded.append, time=time.time, monotonic=time.monotonic))
+    return recorded
+
+
+def scripted(server, draws):
+    """Make the fault injection of server follow draws, then let every request through"""
+    draws = iter(draws)
+    server.draw = lambda: next(draws, 0.999)
+
+
+def client_for(server, **kwargs):
+    return RealtorClient(api_key='test', base_url=server.url, quota=QuotaTracker(), **kwargs)
+
+
+def test_429_is_retried_after_retry_after(sleeps):
+    with MockServer(MockConfig(rate_limit_rate=0.5, retry_after=2)) as server:
+        # One 429, then the search goes through
+        scripted(server, [0.0])
+        response = client_for(server).get(SEARCH, params=PARAMS)
+
+    assert response.status_code == 200
+    assert len(response.json()['properties']) == 5
+    assert sleeps == [2.0]
+    assert server.status_counts == {(SEARCH, 429): 1, (SEARCH, 200): 1}
+
+
+@pytest.mark.parametrize('status_draw', [0.0, 0.3, 0.6, 0.9])
+def test_5xx_is_retried_with_backoff(sleeps, status_draw):
+    with MockServer(MockConfig(error_rate=0.5)) as server:
+        # Two injected errors (a fault draw and a status draw each), then success
+        scripted(server, [0.0, status_draw, 0.0, status_draw])
+        response = client_for(server, backoff_factor=0.5).get(SEARCH, params=PARAMS)
+
+    assert response.status_code == 200
+    status = [500, 502, 503, 504][int(status_draw * 4)]
+    assert server.status_counts == {(SEARCH, status): 2, (SEARCH, 200): 1}
+    # Full jitter below the doubling ceiling, no Retry-After sent
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+
+
+def test_last_response_is_returned_once_retries_are_spent(sleeps):
+    with MockServer(MockConfig(rate_limit_rate=1.0, retry_after=0)) as server:
+        response = client_for(server, max_retries=2).get(SEARCH, params=PARAMS)
+
+    assert response.status_code == 429
+    assert server.status_counts == {(SEARCH, 429): 3}
+    assert sleeps == [0.0, 0.0]
+
+
+def test_client_errors_are_not_retried(sleeps):
+    with MockServer() as server:
+        response = client_for(server).get('/unknown')
+
+    assert response.status_code == 404
+    assert server.status_counts == {('/unknown', 404): 1}
+    assert sleeps == []
+
+
+def test_connection_errors_are_retried_then_raised(sleeps):
+    with MockServer() as server:
+        url = server.url
+    # The server is gone, every attempt is refused
+    client = RealtorClient(api_key='test', base_url=url, max_retries=3, quota=QuotaTracker())
+    with pytest.raises(api_client.requests.exceptions.ConnectionError):
+        client.get(SEARCH, params=PARAMS)
+    assert len(sleeps) == 3
+
+
+def test_backoff_is_capped():
+    client = RealtorClient(api_key='test', backoff_factor=1.0, max_backoff=3.0)
+    for attempt in range(8):
+        assert 0 <= client._backoff(attempt) <= min(3.0, 2 ** attempt)
+    # Retry-After is honored up to max_backoff
+    assert client._backoff(0, '2') == 2.0
+    assert client._backoff(0, '120') == 3.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('7') == 7.0
+    assert parse_retry_after('-3') == 0.0
+    assert parse_retry_after('soon') is None
+    assert 25 <= parse_retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+
+def test_pool_only_grows():
+    client = RealtorClient(api_key='test', pool_maxsize=4)
+    adapter = client.session.get_adapter('https://example.com')
+    assert client.pool_maxsize == adapter._pool_maxsize == 4
+
+    client.ensure_pool_size(16)
+    assert client.pool_maxsize == client.session.get_adapter('https://example.com')._pool_maxsize == 16
+    assert client.session.get_adapter('http://example.com')._pool_maxsize == 16
+    client.ensure_pool_size(8)
+    assert client.pool_maxsize == 16
+
+
+@pytest.mark.parametrize('pool_maxsize, discarded', [(1, True), (8, False)])
+def test_concurrent_requests_reuse_pooled_connections(caplog, pool_maxsize, discarded):
+    with MockServer(MockConfig(latency='fixed:50')) as server:
+        client = client_for(server, pool_maxsize=pool_maxsize)
+        barrier = threading.Barrier(8)
+
+        def search():
+            barrier.wait()
+            client.get(SEARCH, params=PARAMS).close()
+
+        with caplog.at_level(logging.WARNING, logger='urllib3.connectionpool'):
+            threads = [threading.Thread(target=search) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        client.close()
+
+    assert server.status_counts == {(SEARCH, 200): 8}
+    # A pool smaller than the requests in flight closes the extra connections
+    assert any('Connection pool is full' in record.getMessage() for record in caplog.records) == discarded
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=50, burst=2)
+    start = time.monotonic()
+    for _ in range(7):
+        bucket.acquire()
+    # The burst goes right away, the other 5 at 50 per second
+    assert time.monotonic() - start >= 0.09
+
+
+def test_token_bucket_is_shared_by_threads():
+    bucket = TokenBucket(rate=100, burst=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(11)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert time.monotonic() - start >= 0.09
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import api_client
+import request_broker
+from api_client import RealtorClient
+from batch_search import expand_locations, fetch_locations_async, search_locations
+from request_broker import QuotaTracker, RequestBroker
+from response_cache import ResponseCache
+
+ZIPS = [str(63100 + i) for i in range(12)]
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+    content = b''
+
+    def __init__(self, location):
+        self.location = location
+
+    def json(self):
+        return {'properties': [{'property_id': self.location, 'list_price': 1000,
+                                'location': {'address': {'postal_code': self.location}},
+                                'description': {'type': 'condos', 'beds': 2, 'baths_consolidated': '1'}}]}
+
+
+class CountingSession:
+    """Stands in for requests.Session, recording how many requests overlap"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def get(self, url, headers=None, params=None, timeout=None, stream=False):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return FakeResponse(params['location'])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(request_broker, '_default_broker', RequestBroker(quota=QuotaTracker(), max_in_flight=64))
+    monkeypatch.setattr(api_client, '_host_limiters', {})
+    client = RealtorClient(api_key='test', base_url='http://realtor.test', quota=QuotaTracker())
+    client.session = CountingSession()
+    return client
+
+
+def test_concurrency_is_bounded_by_max_concurrency_only(client):
+    # More searches at once than the default executor and the client's connection pool hold
+    fetched = asyncio.run(fetch_locations_async('test', ZIPS, max_concurrency=24, requests_per_second=None,
+                                                client=client, cache=False))
+    assert client.session.peak == 24
+    assert client.pool_maxsize == 24
+    assert [location for location, _, _ in fetched] == ZIPS
+    assert all(rent['properties'][0]['property_id'] == location for location, rent, _ in fetched)
+
+
+def test_cache_hits_take_no_rate_limit_token(client, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    search_locations('test', ZIPS[:2], max_concurrency=4, requests_per_second=None, client=client, cache=cache)
+    assert client.session.calls == 4
+
+    # One token, then one every 1000 seconds: only searches served by the cache can finish
+    rent, sale = asyncio.run(asyncio.wait_for(fetch_locations_async(
+        'test', ZIPS[:2], max_concurrency=4, requests_per_second=0.001, client=client, cache=cache,
+        parse=True), 5))[0][1:]
+    assert client.session.calls == 4
+    assert len(rent) == 1 and len(sale) == 1
+
+
+def test_cities_expand_to_their_zips():
+    assert expand_locations("Kirkwood, MO") == ['63122']
+    # Accepted city names count too, and zips already listed are kept once
+    bay_st_louis = expand_locations('Bay St Louis, ms')
+    assert {'39520', '39521', '39522'} <= set(bay_st_louis)
+    assert expand_locations(['39521', 'Bay St Louis,MS']) == ['39521'] + [z for z in bay_st_louis if z != '39521']
+    # Metro names come from metro_zips, unknown names are searched as given
+    assert expand_locations(['STL metro', 'Nowhere, MO', 'Atlantis'], {'STL metro': [63122, '63119']}) == [
+        '63122', '63119', 'Nowhere, MO', 'Atlantis']
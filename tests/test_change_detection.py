@@ -0,0 +1,64 @@
+import copy
+
+from api_functions import display_and_store_properties
+from change_detection import FingerprintStore, refresh_listings, DELISTED, NEW, PRICE_CHANGE
+
+
+def listing(property_id, price):
+    return {'property_id': property_id, 'list_price': price,
+            'location': {'address': {'line': f"{property_id} Main St", 'postal_code': '63122'}},
+            'description': {'type': 'condos', 'beds': 2, 'baths_consolidated': '1'}}
+
+
+class CountingParser:
+    """Parses like display_and_store_properties, recording what it was given"""
+
+    def __init__(self):
+        self.parsed = []
+
+    def __call__(self, properties_data):
+        self.parsed.append([prop.get('property_id') for prop in properties_data['properties']])
+        return display_and_store_properties(properties_data)
+
+
+def by_id(df):
+    return df.sort_values('Property ID').reset_index(drop=True)
+
+
+def test_refresh_parses_only_the_difference(tmp_path):
+    store = FingerprintStore(str(tmp_path / 'fp.sqlite'))
+    parse = CountingParser()
+    first = {'properties': [listing('1', 100000), listing('2', 200000), listing('3', 300000)]}
+    df, delta = refresh_listings(first, 'sale', '63122', parse, store)
+    assert parse.parsed == [['1', '2', '3']]
+    assert len(df) == 3
+
+    # Unchanged fetch: nothing parsed, the stored listings are returned
+    df, delta = refresh_listings(copy.deepcopy(first), 'sale', '63122', parse, store)
+    assert len(parse.parsed) == 1
+    assert delta.report.empty
+    assert by_id(df)['Price'].tolist() == [100000, 200000, 300000]
+
+    second = {'properties': [listing('1', 100000), listing('2', 180000), listing('4', 400000)]}
+    df, delta = refresh_listings(second, 'sale', '63122', parse, store)
+    assert sorted(parse.parsed[-1]) == ['2', '4']
+    assert dict(zip(delta.report['Property ID'], delta.report['Change'])) == {
+        '2': PRICE_CHANGE, '4': NEW, '3': DELISTED}
+    expected = by_id(display_and_store_properties(second))
+    assert by_id(df)[expected.columns].astype(str).equals(expected.astype(str))
+
+
+def test_truncated_refresh_returns_only_the_fetched_listings(tmp_path):
+    store = FingerprintStore(str(tmp_path / 'fp.sqlite'))
+    parse = CountingParser()
+    refresh_listings({'properties': [listing('1', 100000), listing('2', 200000)]}, 'sale', '63122', parse, store)
+
+    df, delta = refresh_listings({'properties': [listing('2', 200000)]}, 'sale', '63122', parse, store,
+                                 complete=False)
+    assert df['Property ID'].tolist() == ['2']
+    assert delta.removed == []
+    # The listing missing from a truncated fetch is still known, unchanged, next time
+    df, delta = refresh_listings({'properties': [listing('1', 100000), listing('2', 200000)]},
+                                 'sale', '63122', parse, store)
+    assert len(parse.parsed) == 1
+    assert sorted(df['Property ID']) == ['1', '2']
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from comparable_rents import ComparableRentIndex, KM_PER_DEGREE_LATITUDE, KM_PER_DEGREE_LONGITUDE_AT_EQUATOR
+
+LATITUDE = 38.6
+LONGITUDE = -90.4
+
+
+def listings(rows):
+    """Parsed listings from (type, beds, baths, sq ft, km north, km east[, rent]) rows"""
+    columns = ['Property Type', 'Beds', 'Baths', 'Sq Ft', 'north', 'east', 'Rent'][:len(rows[0]) if rows else 7]
+    df = pd.DataFrame(rows, columns=columns)
+    km_per_longitude = KM_PER_DEGREE_LONGITUDE_AT_EQUATOR * np.cos(np.radians(LATITUDE))
+    df['Latitude'] = LATITUDE + df.pop('north') / KM_PER_DEGREE_LATITUDE
+    df['Longitude'] = LONGITUDE + df.pop('east') / km_per_longitude
+    return df
+
+
+def random_rentals(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return listings([
+        (rng.choice(['single_family', 'condos']), rng.integers(1, 5), rng.integers(1, 4),
+         rng.integers(600, 3000), rng.uniform(-20, 20), rng.uniform(-20, 20), rng.integers(800, 3000))
+        for _ in range(n)
+    ])
+
+
+def brute_force_nearest(index, rentals, sale, k):
+    """Positions of the k rentals of the sale's type nearest in scaled features"""
+    same_type = np.flatnonzero(rentals['Property Type'].to_numpy() == sale['Property Type'].iloc[0])
+    features = index._raw_features(rentals)[same_type]
+    distance = np.linalg.norm(features - index._raw_features(sale)[0], axis=1)
+    return same_type[np.argsort(distance, kind='stable')[:k]], np.sort(distance)[:k]
+
+
+@pytest.mark.parametrize('k', [1, 3, 8])
+def test_comparables_are_the_nearest_rentals_of_the_same_type(k):
+    rentals = random_rentals(300)
+    sales = random_rentals(25, seed=1).drop(columns='Rent')
+    index = ComparableRentIndex(rentals, k=k)
+    result = index.query(sales)
+
+    for row in range(len(sales)):
+        sale = sales.iloc[[row]]
+        expected, distance = brute_force_nearest(index, rentals, sale, k)
+        assert sorted(result['Comparables'].iloc[row]) == sorted(expected)
+        assert result['Comparable Count'].iloc[row] == k
+        assert result['Comparable Distance'].iloc[row] == pytest.approx(distance.mean())
+        rents = rentals['Rent'].iloc[expected]
+        assert rents.min() - 1e-6 <= result['Estimated Rent'].iloc[row] <= rents.max() + 1e-6
+
+
+def test_distance_is_measured_in_km():
+    # Same home 1 km and 30 km away: only the close one is a comparable
+    rentals = listings([('condos', 2, 1, 900, 30, 0, 2500), ('condos', 2, 1, 900, 0, 1, 1200),
+                        ('condos', 2, 1, 900, -30, 0, 3000)])
+    sales = listings([('condos', 2, 1, 900, 0, 0)])
+    result = ComparableRentIndex(rentals, k=1).query(sales)
+    assert list(result['Comparables'].iloc[0]) == [1]
+    assert result['Estimated Rent'].iloc[0] == pytest.approx(1200)
+    # 1 km is half a unit at the default km scale of 2
+    assert result['Comparable Distance'].iloc[0] == pytest.approx(0.5, rel=1e-3)
+
+    # At a coarse km scale, distance stops mattering next to a bedroom difference
+    rentals.loc[1, 'Beds'] = 4
+    result = ComparableRentIndex(rentals, k=1, feature_scales={'km': 1000.0}).query(sales)
+    assert list(result['Comparables'].iloc[0]) != [1]
+
+
+def test_exact_match_dominates_the_weighted_rent():
+    rentals = listings([('condos', 2, 1, 900, 0, 0, 1500), ('condos', 3, 2, 1400, 5, 5, 2500)])
+    sales = listings([('condos', 2, 1, 900, 0, 0)])
+    assert ComparableRentIndex(rentals, k=2).query(sales)['Estimated Rent'].iloc[0] == pytest.approx(1500, abs=0.01)
+
+
+def test_k_is_capped_by_the_rentals_of_the_type():
+    rentals = listings([('condos', 2, 1, 900, 0, 0, 1500), ('condos', 3, 2, 1400, 1, 1, 2500),
+                        ('single_family', 3, 2, 1600, 0, 0, 2200)])
+    sales = listings([('condos', 2, 1, 1000, 0, 0)])
+    index = ComparableRentIndex(rentals, k=5)
+
+    result = index.query(sales)
+    assert result['Comparable Count'].iloc[0] == 2
+    assert sorted(result['Comparables'].iloc[0]) == [-1, -1, -1, 0, 1]
+    # The per-query k overrides the index's
+    result = index.query(sales, k=1)
+    assert result['Comparable Count'].iloc[0] == 1
+    assert list(result['Comparables'].iloc[0]) == [0]
+
+
+def test_a_type_without_rentals_falls_back_to_every_type():
+    rentals = listings([('condos', 2, 1, 900, 0, 0, 1500), ('single_family', 3, 2, 1600, 0, 0, 2200)])
+    sales = listings([('townhomes', 3, 2, 1600, 0, 0), ('condos', 2, 1, 900, 0, 0)])
+
+    result = ComparableRentIndex(rentals, k=1).query(sales)
+    assert list(result['Comparables'].iloc[0]) == [1]
+    assert result['Comparable Count'].tolist() == [1, 1]
+
+    result = ComparableRentIndex(rentals, k=1, fallback_any_type=False).query(sales)
+    assert np.isnan(result['Estimated Rent'].iloc[0])
+    assert result['Comparable Count'].iloc[0] == 0
+    assert list(result['Comparables'].iloc[0]) == [-1]
+    assert result['Estimated Rent'].iloc[1] == pytest.approx(1500)
+
+
+def test_no_rentals_leaves_every_estimate_empty():
+    rentals = listings([('condos', 2, 1, 900, 0, 0, np.nan)])
+    sales = listings([('condos', 2, 1, 900, 0, 0), ('single_family', 3, 2, 1600, 1, 1)])
+    result = ComparableRentIndex(rentals, k=3).query(sales)
+    assert result['Estimated Rent'].isna().all()
+    assert result['Comparable Count'].tolist() == [0, 0]
+    assert result.index.equals(sales.index)
+
+
+def test_missing_features_are_filled_with_the_type_median():
+    rentals = listings([('condos', 1, 1, 700, 0, 0, 1000), ('condos', 2, 1, 900, 0, 0, 1500),
+                        ('condos', 3, 2, 1400, 0, 0, 2500)])
+    sales = listings([('condos', np.nan, np.nan, np.nan, 0, 0)])
+    result = ComparableRentIndex(rentals, k=1).query(sales)
+    # Neither attracted to nor repelled from any rental: the median home is nearest
+    assert list(result['Comparables'].iloc[0]) == [1]
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import rank_listings
+
+
+def sorted_positions(values, ascending):
+    """The ranking of a full stable sort_values, NaN last"""
+    return pd.Series(values).sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+
+
+def cap_rates(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # Few distinct values, so most listings tie with others
+    values = rng.choice([-0.02, 0.0, 0.031, 0.05, 0.05, 0.075, np.inf], n)
+    values[rng.random(n) < 0.2] = np.nan
+    return values
+
+
+@pytest.mark.parametrize('ascending', [False, True])
+@pytest.mark.parametrize('k', [1, 5, 37, 100, 1000, None])
+def test_top_k_matches_a_full_sort_with_ties_and_nan(ascending, k):
+    values = cap_rates(500)
+    expected = sorted_positions(values, ascending)
+    stop = len(values) if k is None else k
+    np.testing.assert_array_equal(rank_listings(values, k=k, ascending=ascending), expected[:stop])
+
+
+@pytest.mark.parametrize('ascending', [False, True])
+def test_pages_add_up_to_the_full_sort(ascending):
+    values = cap_rates(503, seed=1)
+    expected = sorted_positions(values, ascending)
+    pages = [rank_listings(values, k=50, ascending=ascending, offset=offset) for offset in range(0, 550, 50)]
+    np.testing.assert_array_equal(np.concatenate(pages), expected)
+    # Past the end there is nothing left
+    assert len(rank_listings(values, k=50, offset=600)) == 0
+
+
+def test_edge_cases():
+    assert len(rank_listings([], k=10)) == 0
+    np.testing.assert_array_equal(rank_listings([np.nan, np.nan, np.nan], k=2), [0, 1])
+    np.testing.assert_array_equal(rank_listings([3.0, np.nan, 3.0, 5.0], k=None), [3, 0, 2, 1])
+    # Nullable columns, as the app passes them
+    values = pd.array([0.05, None, 0.07, 0.05], dtype='Float64').to_numpy(dtype='float64', na_value=np.nan)
+    np.testing.assert_array_equal(rank_listings(values, k=3), [2, 0, 3])
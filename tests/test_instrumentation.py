@@ -0,0 +1,93 @@
+import json
+import time
+
+import pytest
+
+import api_functions
+import request_broker
+from instrumentation import registry, start_trace, StageTimer
+from listing_schema import extract_rentals, extract_properties
+from request_broker import QuotaTracker, RequestBroker
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    registry.reset()
+    yield
+    registry.reset()
+
+
+def test_stage_timer_leaves_out_the_consumer():
+    def slow_items():
+        for item in range(3):
+            time.sleep(0.02)
+            yield item
+
+    trace = start_trace()
+    timer = StageTimer('fetch', feed='rent')
+    for _ in timer.timed_iter(slow_items()):
+        time.sleep(0.05)
+
+    [recorded] = trace
+    assert recorded['stage'] == 'fetch' and recorded['feed'] == 'rent'
+    assert 0.06 <= recorded['seconds'] < 0.15
+
+
+def test_stage_timer_finishes_once_when_closed_early():
+    trace = start_trace()
+    timer = StageTimer('fetch')
+    items = timer.timed_iter(iter(range(10)))
+    next(items)
+    items.close()
+    timer.finish()
+    assert len(trace) == 1
+
+
+def test_skipped_properties_are_counted_per_schema():
+    unreadable = {'property_id': '1', 'location': None}
+    extract_rentals([unreadable, unreadable])
+    extract_properties([unreadable])
+    assert registry.counter_totals('realtor_parse_skipped_total', 'schema') == {'rentals': 2, 'sales': 1}
+
+
+class StreamedResponse:
+    status_code = 200
+
+    def __init__(self, payload, delay):
+        self.body = json.dumps(payload).encode()
+        self.delay = delay
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), 64):
+            time.sleep(self.delay)
+            yield self.body[start:start + 64]
+
+    def close(self):
+        pass
+
+
+class StreamingClient:
+    def __init__(self, payload, delay):
+        self.payload = payload
+        self.delay = delay
+
+    def get(self, path, params=None, api_key=None, stream=False):
+        return StreamedResponse(self.payload, self.delay)
+
+
+def test_streamed_fetch_counts_the_body_download(monkeypatch):
+    monkeypatch.setattr(request_broker, '_default_broker', RequestBroker(quota=QuotaTracker()))
+    payload = {'properties': [{'property_id': str(i)} for i in range(40)]}
+    client = StreamingClient(payload, delay=0.005)
+    chunks = -(-len(json.dumps(payload)) // 64)
+
+    trace = start_trace()
+    pages = api_functions.search_properties('key', '63122', client=client, cache=False, stream=True)
+    assert trace == []
+    for page in pages:
+        # Parsing time, not part of the fetch
+        time.sleep(0.1)
+
+    [recorded] = [span for span in trace if span['stage'] == 'fetch']
+    assert recorded['feed'] == 'sale'
+    assert chunks * 0.005 <= recorded['seconds'] < chunks * 0.005 + 0.05
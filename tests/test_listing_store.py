@@ -0,0 +1,135 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+from api_functions import display_and_store_properties, display_and_store_rentals
+from listing_schema import extract_properties
+from listing_store import ListingStore, RENTALS, SALES, UNKNOWN_ZIP
+
+
+def listing(property_id, price, zip_code='63122', beds=2):
+    return {'property_id': property_id, 'listing_id': f"L{property_id}", 'list_price': price,
+            'location': {'address': {'line': f"{property_id} Main St", 'postal_code': zip_code}},
+            'description': {'type': 'condos', 'beds': beds, 'baths_consolidated': '1'}}
+
+
+def sales(*listings):
+    return display_and_store_properties({'properties': list(listings)})
+
+
+def by_id(df):
+    return df.sort_values('Property ID').reset_index(drop=True)
+
+
+def partition_files(store, kind):
+    root = store._kind_path(kind)
+    return sorted(os.path.relpath(os.path.join(directory, name), root)
+                  for directory, _, names in os.walk(root) for name in names if name != '_index.parquet')
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ListingStore(str(tmp_path / 'listings'))
+
+
+def test_round_trip_keeps_values_and_dtypes(store):
+    df = sales(listing('1', 100000), listing('2', 250000, beds=3), listing('3', 180000, zip_code='63119'))
+    assert store.upsert(df, SALES, '2024-05-01') == {'written': 3, 'unchanged': 0}
+
+    stored = by_id(store.read(SALES))
+    assert stored['snapshot_date'].tolist() == ['2024-05-01'] * 3
+    stored = stored.drop(columns='snapshot_date')
+    assert stored.columns.tolist() == df.columns.tolist()
+    # Schema columns come back with their parsed dtypes, counts as floats
+    for column, dtype in extract_properties.dtypes.items():
+        assert isinstance(stored[column].dtype, pd.CategoricalDtype) == (dtype == 'category'), column
+        assert str(stored[column].dtype) == str(df[column].dtype), column
+    pd.testing.assert_frame_equal(stored, by_id(df), check_dtype=False, check_categorical=False)
+
+    rentals = display_and_store_rentals({'properties': [listing('9', 1500)]})
+    store.upsert(rentals, RENTALS, '2024-05-01')
+    assert store.read(RENTALS)['Rent'].tolist() == [1500]
+
+
+def test_upsert_writes_only_new_and_changed_listings(store):
+    store.upsert(sales(listing('1', 100000), listing('2', 200000)), SALES, '2024-05-01')
+    counts = store.upsert(sales(listing('1', 100000), listing('2', 190000), listing('3', 300000)),
+                          SALES, '2024-05-08')
+    assert counts == {'written': 2, 'unchanged': 1}
+    assert partition_files(store, SALES) == [
+        os.path.join('zip=63122', 'snapshot_date=2024-05-01', 'part-0.parquet'),
+        os.path.join('zip=63122', 'snapshot_date=2024-05-08', 'part-0.parquet'),
+    ]
+    assert len(store.read(SALES, latest=False)) == 4
+
+    current = by_id(store.read(SALES))
+    assert current['Price'].tolist() == [100000, 190000, 300000]
+    assert current['snapshot_date'].tolist() == ['2024-05-01', '2024-05-08', '2024-05-08']
+
+
+def test_rewriting_a_snapshot_replaces_the_listings_of_that_day(store):
+    store.upsert(sales(listing('1', 100000), listing('2', 200000)), SALES, '2024-05-01')
+    store.upsert(sales(listing('2', 210000)), SALES, '2024-05-01')
+    assert len(partition_files(store, SALES)) == 1
+    assert by_id(store.read(SALES, latest=False))['Price'].tolist() == [100000, 210000]
+
+
+def test_reads_as_of_a_date(store):
+    store.upsert(sales(listing('1', 100000), listing('2', 200000)), SALES, '2024-05-01')
+    store.upsert(sales(listing('2', 150000)), SALES, '2024-05-08')
+
+    assert by_id(store.read(SALES, end='2024-05-07'))['Price'].tolist() == [100000, 200000]
+    assert by_id(store.read(SALES, end='2024-05-08'))['Price'].tolist() == [100000, 150000]
+    # The older, matching version of a changed listing does not stand in for it
+    cheap = ds.field('Price') > 180000
+    assert store.read(SALES, end='2024-05-08', filter=cheap).empty
+    assert store.read(SALES, end='2024-05-07', filter=cheap)['Price'].tolist() == [200000]
+    assert store.read(SALES, filter=cheap).empty
+
+
+def test_columns_and_filters(store):
+    store.upsert(sales(listing('1', 100000), listing('2', 250000, beds=3)), SALES, '2024-05-01')
+    df = store.read(SALES, columns=['Property ID', 'Beds'], filter=ds.field('Price') > 200000)
+    assert df.columns.tolist() == ['Property ID', 'Beds', 'snapshot_date']
+    assert df['Property ID'].tolist() == ['2']
+    assert df['Beds'].tolist() == [3]
+
+
+def test_reads_touch_only_the_matching_partitions(store):
+    store.upsert(sales(listing('1', 100000)), SALES, '2024-05-01')
+    store.upsert(sales(listing('2', 200000, zip_code='63130')), SALES, '2024-05-01')
+    store.upsert(sales(listing('1', 90000)), SALES, '2024-05-08')
+
+    # Break every partition a pruned read must not open. The first file stays
+    # readable, the dataset takes its schema from it.
+    for path in [os.path.join('zip=63122', 'snapshot_date=2024-05-08', 'part-0.parquet'),
+                 os.path.join('zip=63130', 'snapshot_date=2024-05-01', 'part-0.parquet')]:
+        with open(os.path.join(store._kind_path(SALES), path), 'wb') as f:
+            f.write(b'not parquet')
+
+    df = store.read(SALES, zips=['63122'], end='2024-05-01')
+    assert df['Price'].tolist() == [100000]
+    with pytest.raises(pa.ArrowInvalid):
+        store.read(SALES, zips=['63130'])
+
+
+def test_listings_without_a_zip_are_kept(store):
+    df = sales(listing('1', 100000, zip_code=None))
+    store.upsert(df, SALES, '2024-05-01')
+    assert partition_files(store, SALES) == [
+        os.path.join(f"zip={UNKNOWN_ZIP}", 'snapshot_date=2024-05-01', 'part-0.parquet')]
+    assert store.read(SALES, zips=[UNKNOWN_ZIP])['Property ID'].tolist() == ['1']
+
+
+def test_empty_and_unknown(store):
+    assert store.read(SALES).empty
+    assert store.upsert(sales(), SALES) == {'written': 0, 'unchanged': 0}
+    with pytest.raises(ValueError):
+        store.read('leases')
+    store.upsert(sales(listing('1', 100000)), SALES, '2024-05-01')
+    assert store.read(SALES, zips=['99999']).empty
+    store.clear()
+    assert store.read(SALES).empty
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import generate_rent_summary
+from rent_statistics import DEFAULT_RELATIVE_ACCURACY, RentSketch, StreamingRentSummary
+
+
+def rentals(n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Property Type': rng.choice(['apartment', 'condos', 'single_family'], n),
+        'Beds': rng.integers(1, 4, n).astype('float64'),
+        'Baths': rng.choice([1.0, 1.5, 2.0], n),
+        'Rent': rng.lognormal(7.2, 0.4, n).round(),
+    })
+    # Rows generate_rent_summary ignores, and rents that cannot be log-bucketed
+    df.loc[::17, 'Rent'] = np.nan
+    df.loc[::23, 'Property Type'] = None
+    df.loc[::29, 'Rent'] = 0.0
+    return df
+
+
+def test_merged_batches_match_one_update():
+    df = rentals(3000)
+    whole = StreamingRentSummary().update(df)
+
+    parts = [StreamingRentSummary().update(df.iloc[start:start + 450]) for start in range(0, len(df), 450)]
+    merged = StreamingRentSummary()
+    for part in reversed(parts):
+        merged.merge(part)
+
+    assert merged.sketches.keys() == whole.sketches.keys()
+    for key, sketch in whole.sketches.items():
+        assert merged.sketches[key].to_dict() == sketch.to_dict()
+    pd.testing.assert_frame_equal(merged.to_frame((25, 75)), whole.to_frame((25, 75)))
+
+
+def test_summary_matches_generate_rent_summary():
+    df = rentals(3000, seed=1)
+    expected = generate_rent_summary(df[df['Property Type'].notna()])
+    expected = expected[expected['Count'] > 0].sort_values(['Property Type', 'Beds', 'Baths'])
+    expected = expected.reset_index(drop=True)
+    summary = StreamingRentSummary().update(df).to_frame()
+
+    assert list(summary.columns) == list(expected.columns)
+    assert summary['Count'].tolist() == expected['Count'].tolist()
+    assert summary['Min Rent'].tolist() == expected['Min Rent'].tolist()
+    assert summary['Max Rent'].tolist() == expected['Max Rent'].tolist()
+    # The median is a sketch estimate, within the relative accuracy of the exact one
+    relative = (summary['Median Rent'] - expected['Median Rent']).abs() / expected['Median Rent']
+    assert (relative <= DEFAULT_RELATIVE_ACCURACY * 1.001).all()
+
+
+@pytest.mark.parametrize('rents', [
+    [1450.0],
+    [1000.0, 2000.0],
+    [1000.0, 1100.0, 3000.0],
+    [1000.0, 1100.0, 3000.0, 3100.0],
+    [800.0, 800.0, 800.0, 5000.0],
+    [0.0, 0.0, 1200.0, 1300.0],
+    [0.0, 950.0],
+    [1200.0, 1250.0, 1300.0, 1700.0, 2400.0, 2450.0],
+])
+def test_small_groups_match_generate_rent_summary(rents):
+    df = pd.DataFrame({'Property Type': 'condos', 'Beds': 2.0, 'Baths': 1.0, 'Rent': rents})
+    expected = generate_rent_summary(df)
+    summary = StreamingRentSummary().update(df).to_frame()
+
+    assert summary['Count'].tolist() == expected['Count'].tolist()
+    assert summary['Min Rent'].tolist() == expected['Min Rent'].tolist()
+    assert summary['Max Rent'].tolist() == expected['Max Rent'].tolist()
+    assert summary['Median Rent'][0] == pytest.approx(expected['Median Rent'][0],
+                                                      rel=DEFAULT_RELATIVE_ACCURACY)
+
+
+def test_percentiles_interpolate_between_ranks():
+    rents = np.arange(1000.0, 2000.0, 100.0)
+    sketch = RentSketch().add(rents)
+    for q in (0, 0.1, 0.25, 0.5, 0.75, 0.9, 1):
+        assert sketch.quantile(q) == pytest.approx(np.quantile(rents, q), rel=DEFAULT_RELATIVE_ACCURACY)
+    # The ends are exact
+    assert sketch.quantile(0) == 1000.0
+    assert sketch.quantile(1) == 1900.0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    summary = StreamingRentSummary(relative_accuracy=0.01).update(rentals(500, seed=2))
+    path = tmp_path / 'rent_summary.json'
+    summary.save(path)
+    loaded = StreamingRentSummary.load(path)
+
+    assert loaded.relative_accuracy == 0.01
+    assert loaded.sketches.keys() == summary.sketches.keys()
+    pd.testing.assert_frame_equal(loaded.to_frame((10, 90)), summary.to_frame((10, 90)))
+
+    # A loaded summary keeps accumulating like the original
+    more = rentals(500, seed=3)
+    summary.update(more)
+    loaded.update(more)
+    assert {key: sketch.to_dict() for key, sketch in loaded.sketches.items()} == \
+        {key: sketch.to_dict() for key, sketch in summary.sketches.items()}
+
+
+def test_empty_summary_round_trip(tmp_path):
+    path = tmp_path / 'rent_summary.json'
+    StreamingRentSummary().update(rentals(0)).save(path)
+    loaded = StreamingRentSummary.load(path)
+    assert len(loaded) == 0
+    assert loaded.to_frame().empty
+    assert np.isnan(RentSketch.from_dict(RentSketch().to_dict()).quantile(0.5))
+
+
+def test_merging_different_accuracies_raises():
+    low = StreamingRentSummary(relative_accuracy=0.01).update(rentals(50))
+    with pytest.raises(ValueError):
+        StreamingRentSummary(DEFAULT_RELATIVE_ACCURACY).update(rentals(50)).merge(low)
@@ -0,0 +1,241 @@
+import json
+import threading
+import time
+
+import pytest
+
+import api_functions
+import request_broker
+from request_broker import QuotaTracker, RequestBroker, RequestShed, UNSHARED
+from response_cache import ResponseCache, make_cache_key
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = RequestBroker(quota=QuotaTracker(), max_queue_seconds=5)
+    monkeypatch.setattr(request_broker, '_default_broker', broker)
+    return broker
+
+
+def wait_for_waiters(broker, key, waiters=1, timeout=5):
+    """Block until the flight of key has the given number of callers waiting on it"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        flight = broker._flights.get(key)
+        if flight is not None and flight.waiters >= waiters:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"No caller joined the flight of {key}")
+
+
+def run_in_thread(func, *args, **kwargs):
+    result = {}
+
+    def run():
+        try:
+            result['value'] = func(*args, **kwargs)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+### Coalescing
+
+def test_identical_calls_share_one_request(broker):
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return {'properties': [1, 2]}
+
+    leader, leader_result = run_in_thread(broker.call, 'key', load)
+    wait_for_waiters(broker, 'key', 0)
+    followers = [run_in_thread(broker.call, 'key', load) for _ in range(3)]
+    wait_for_waiters(broker, 'key', 3)
+    release.set()
+    for thread, _ in [(leader, leader_result)] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert leader_result['value'] == {'properties': [1, 2]}
+    assert all(result['value'] is leader_result['value'] for _, result in followers)
+    assert broker.stats()['coalescing'] == 0
+
+
+def test_different_keys_are_not_coalesced(broker):
+    assert broker.call('a', lambda: 'a') == 'a'
+    assert broker.call('b', lambda: 'b') == 'b'
+
+
+### Cancellation and failures
+
+def test_leader_error_is_raised_in_every_waiter(broker):
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        raise KeyboardInterrupt
+
+    leader, leader_result = run_in_thread(broker.call, 'key', load)
+    wait_for_waiters(broker, 'key', 0)
+    follower, follower_result = run_in_thread(broker.call, 'key', load)
+    wait_for_waiters(broker, 'key', 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert isinstance(leader_result['error'], KeyboardInterrupt)
+    assert isinstance(follower_result['error'], KeyboardInterrupt)
+    # The slot and the flight are released, the next call is sent again
+    assert broker.stats()['in_flight'] == 0
+    assert broker.call('key', lambda: 'again') == 'again'
+
+
+def test_wait_times_out(broker):
+    flight, leader = broker.join('key')
+    assert leader
+    waiter, _ = broker.join('key')
+    with pytest.raises(TimeoutError):
+        broker.wait(waiter, 0.01)
+    broker.finish('key', flight, 'done')
+    assert broker.wait(waiter, 0.01) == 'done'
+
+
+def test_shed_leader_lets_waiters_send_their_own(broker):
+    flight, _ = broker.join('key')
+    follower, result = run_in_thread(broker.call, 'key', lambda: 'own')
+    wait_for_waiters(broker, 'key', 1)
+    broker.finish('key', flight, error=RequestShed('shed'))
+    follower.join(5)
+    assert result['value'] == 'own'
+
+
+def test_unshared_result_runs_the_fallback(broker):
+    flight, _ = broker.join('key')
+    follower, result = run_in_thread(broker.call, 'key', lambda: 'sent', unshared=lambda: 'from cache')
+    wait_for_waiters(broker, 'key', 1)
+    broker.finish('key', flight, UNSHARED)
+    follower.join(5)
+    assert result['value'] == 'from cache'
+
+
+def test_unshared_result_defaults_to_sending_again(broker):
+    flight, _ = broker.join('key')
+    follower, result = run_in_thread(broker.call, 'key', lambda: 'sent')
+    wait_for_waiters(broker, 'key', 1)
+    broker.finish('key', flight, UNSHARED)
+    follower.join(5)
+    assert result['value'] == 'sent'
+
+
+### Streamed and buffered searches of the same key
+
+class FakeResponse:
+    status_code = 200
+    text = ''
+
+    def __init__(self, payload):
+        self.body = json.dumps(payload).encode()
+        self.closed = False
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), 7):
+            yield self.body[start:start + 7]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, payload):
+        self.payload = payload
+        self.calls = []
+
+    def get(self, path, params=None, api_key=None, stream=False):
+        self.calls.append((path, stream))
+        return FakeResponse(self.payload)
+
+
+PAYLOAD = {'properties': [{'property_id': str(i), 'list_price': 1000 + i} for i in range(5)], 'total': 5}
+PARAMS = {'location': '63122', 'search_radius': '0', 'limit': 1000}
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_buffered_search_waiting_on_a_streamed_one(broker, tmp_path, cached):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite')) if cached else False
+    client = FakeClient(PAYLOAD)
+    key = make_cache_key('/search/forsale', PARAMS)
+
+    pages = api_functions.stream_search('/search/forsale', dict(PARAMS), 'key', client, cache)
+    follower, result = run_in_thread(api_functions.search_properties, 'key', '63122', client=client, cache=cache)
+    wait_for_waiters(broker, key, 1)
+    streamed = [prop for page in pages for prop in page['properties']]
+    follower.join(5)
+
+    assert streamed == PAYLOAD['properties']
+    assert result['value'] == PAYLOAD
+    # With a cache the buffered search reads what the stream stored
+    assert client.calls == [('/search/forsale', True)] + ([] if cached else [('/search/forsale', False)])
+    assert broker.stats() == {'in_flight': 0, 'waiting': {'high': 0, 'low': 0}, 'coalescing': 0, 'quota': {}}
+
+
+def test_streamed_search_waiting_on_a_buffered_one(broker, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    client = FakeClient(PAYLOAD)
+    key = make_cache_key('/search/forsale', PARAMS)
+    flight, _ = broker.join(key)
+
+    follower, result = run_in_thread(api_functions.stream_search, '/search/forsale', dict(PARAMS), 'key',
+                                     client, cache, page_size=2)
+    wait_for_waiters(broker, key, 1)
+    broker.finish(key, flight, PAYLOAD)
+    follower.join(5)
+
+    assert [len(page['properties']) for page in result['value']] == [2, 2, 1]
+    assert client.calls == []
+
+
+def test_dropped_stream_releases_its_flight(broker):
+    client = FakeClient(PAYLOAD)
+    key = make_cache_key('/search/forsale', PARAMS)
+
+    pages = api_functions.stream_search('/search/forsale', dict(PARAMS), 'key', client, False)
+    assert broker.stats()['in_flight'] == 1
+    assert broker.stats()['coalescing'] == 1
+    del pages
+
+    assert broker.stats()['in_flight'] == 0
+    assert broker.stats()['coalescing'] == 0
+    assert broker.call(key, lambda: 'sent') == 'sent'
+
+
+def test_stale_stream_is_served_and_refreshed_in_the_background(broker, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), ttl=0)
+    stale = {'properties': [{'property_id': 'old'}]}
+    cache.set('/search/forsale', PARAMS, stale)
+    release = threading.Event()
+
+    class SlowClient(FakeClient):
+        def get(self, path, params=None, api_key=None, stream=False):
+            release.wait(5)
+            return super().get(path, params, api_key, stream)
+
+    client = SlowClient(PAYLOAD)
+    pages = api_functions.stream_search('/search/forsale', dict(PARAMS), 'key', client, cache)
+    # Served from the stale entry without waiting on the API
+    assert [prop for page in pages for prop in page['properties']] == stale['properties']
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while cache.get('/search/forsale', PARAMS)[0] != PAYLOAD and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get('/search/forsale', PARAMS)[0] == PAYLOAD
+    assert client.calls == [('/search/forsale', True)]
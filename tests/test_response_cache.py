@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+import types
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, cached_search, iter_body_chunks, make_cache_key, FRESH, MISS, STALE
+
+SEARCH = '/search/forrent'
+
+
+def params(location='63122', **filters):
+    return {'location': location, 'search_radius': '0', 'limit': 200, **filters}
+
+
+def payload(location='63122', n=3):
+    return {'properties': [{'property_id': f"{location}-{i}", 'list_price': 1000 + i} for i in range(n)]}
+
+
+class Clock:
+    """Stands in for time.time in response_cache"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, 'time', types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+class Loader:
+    """Counts its calls and returns payloads in turn"""
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.calls = 0
+        self.done = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        result = self.payloads.pop(0) if self.payloads else None
+        self.done.set()
+        return result
+
+
+def test_key_covers_every_parameter_in_any_order():
+    assert make_cache_key(SEARCH, {'a': 1, 'b': 2}) == make_cache_key(SEARCH, {'b': 2, 'a': 1})
+    assert make_cache_key(SEARCH, params()) != make_cache_key(SEARCH, params(price_max='1500000'))
+    assert make_cache_key(SEARCH, params()) != make_cache_key('/search/forsale', params())
+
+
+def test_fresh_stale_and_expired(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=60, stale_ttl=600)
+    assert cache.get(SEARCH, params()) == (None, MISS)
+    cache.set(SEARCH, params(), payload())
+
+    clock.now += 60
+    assert cache.get(SEARCH, params()) == (payload(), FRESH)
+    clock.now += 1
+    assert cache.get(SEARCH, params()) == (payload(), STALE)
+    clock.now += 540
+    assert cache.get(SEARCH, params()) == (None, MISS)
+
+
+def test_fetch_calls_the_loader_only_on_a_miss(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    loader = Loader(payload())
+    assert cache.fetch(SEARCH, params(), loader) == payload()
+    assert cache.fetch(SEARCH, params(), loader) == payload()
+    assert loader.calls == 1
+
+    # A failed load is not cached
+    failing = Loader()
+    assert cache.fetch(SEARCH, params('63119'), failing) is None
+    assert cache.get(SEARCH, params('63119')) == (None, MISS)
+
+
+def test_stale_entries_are_served_while_revalidating(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=60, stale_ttl=600)
+    cache.set(SEARCH, params(), payload(n=1))
+    clock.now += 120
+
+    release = threading.Event()
+    refreshed = payload(n=5)
+
+    def slow_loader():
+        release.wait(5)
+        return refreshed
+
+    start = time.monotonic()
+    assert cache.fetch(SEARCH, params(), slow_loader) == payload(n=1)
+    # A second caller neither waits nor starts another refresh
+    second = Loader(payload(n=9))
+    assert cache.fetch(SEARCH, params(), second) == payload(n=1)
+    assert time.monotonic() - start < 1
+    assert second.calls == 0
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while cache.get(SEARCH, params())[1] != FRESH and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get(SEARCH, params()) == (refreshed, FRESH)
+
+
+def test_failed_revalidation_keeps_the_stale_entry(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=60, stale_ttl=600)
+    cache.set(SEARCH, params(), payload())
+    clock.now += 120
+
+    def broken():
+        raise RuntimeError("API down")
+
+    assert cache.fetch(SEARCH, params(), broken) == payload()
+    loader = Loader(payload(n=7))
+    # Once the failed refresh is over the key can be refreshed again
+    deadline = time.monotonic() + 5
+    while not loader.done.is_set() and time.monotonic() < deadline:
+        assert cache.fetch(SEARCH, params(), loader) == payload()
+        time.sleep(0.01)
+    assert loader.calls == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    for zip_code in ['63101', '63102', '63103']:
+        clock.now += 1
+        cache.set(SEARCH, params(zip_code), payload(zip_code, n=50))
+    with cache._connect() as conn:
+        sizes = dict(conn.execute("SELECT params, size FROM responses").fetchall())
+    # Room for three entries; reading 63101 makes 63102 the least recently used
+    cache.max_bytes = sum(sizes.values()) + 50
+    clock.now += 1
+    assert cache.get(SEARCH, params('63101'))[1] == FRESH
+
+    clock.now += 1
+    cache.set(SEARCH, params('63104'), payload('63104', n=50))
+    assert cache.get(SEARCH, params('63102')) == (None, MISS)
+    for zip_code in ['63101', '63103', '63104']:
+        assert cache.get(SEARCH, params(zip_code))[0] == payload(zip_code, n=50)
+
+
+def test_offline_serves_any_cached_entry_and_never_loads(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    ResponseCache(path, ttl=60, stale_ttl=600).set(SEARCH, params(), payload())
+    clock.now += 10_000
+
+    offline = ResponseCache(path, ttl=60, stale_ttl=600, offline=True)
+    loader = Loader(payload(n=9))
+    # Long expired, still served offline
+    assert offline.fetch(SEARCH, params(), loader) == payload()
+    assert offline.fetch(SEARCH, params('63119'), loader) is None
+    assert loader.calls == 0
+
+
+def test_cached_search_without_a_cache_always_loads(tmp_path):
+    loader = Loader(payload(), payload(n=2))
+    assert cached_search(SEARCH, params(), loader, cache=False) == payload()
+    assert cached_search(SEARCH, params(), loader, cache=False) == payload(n=2)
+
+
+def test_bodies_decompress_in_bounded_chunks(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    big = payload(n=5000)
+    cache.set(SEARCH, params(), big)
+    body, _ = cache.get_body(SEARCH, params())
+
+    chunks = list(iter_body_chunks(body, chunk_size=4096))
+    assert max(len(chunk) for chunk in chunks) <= 4096
+    assert b''.join(chunks) == json.dumps(big).encode()
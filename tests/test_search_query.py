@@ -0,0 +1,24 @@
+import pandas as pd
+
+from search_query import SearchQuery
+
+
+def test_params_send_prices_in_full():
+    query = SearchQuery(min_price=1234567.0, max_price=1500000.0, min_beds=2, min_baths=1.5)
+    assert query.params() == {'price_min': '1234567', 'price_max': '1500000',
+                              'beds_min': '2', 'baths_min': '1.5'}
+    assert SearchQuery(max_price=1999.99).params() == {'price_max': '1999.99'}
+    assert SearchQuery(min_price=12345678.5).params() == {'price_min': '12345678.5'}
+    # A float price and the same int price are one query, with one cache key
+    assert SearchQuery(max_price=1500000.0) == SearchQuery(max_price=1500000)
+    assert SearchQuery(max_price=1500000.0).params() == SearchQuery(max_price=1500000).params()
+
+
+def test_filters_without_a_param_are_applied_to_the_frame():
+    query = SearchQuery(max_price=1500000.0, property_types=['condos'], statuses=['ACTIVE'])
+    assert query.params() == {'price_max': '1500000'}
+    df = pd.DataFrame({'Price': [1200000, 1500000, 1600000, 900000],
+                       'Beds': [2, 3, 3, 1], 'Baths': [1.0, 2.0, 2.0, 1.0],
+                       'Property Type': ['condos', 'condos', 'condos', 'single_family'],
+                       'Status': ['ACTIVE', 'ACTIVE, PRICE REDUCED', 'ACTIVE', 'ACTIVE']})
+    assert query.apply(df)['Price'].tolist() == [1200000, 1500000]
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from stream_json import iter_array_items, iter_array_pages
+
+
+def byte_chunks(text, size):
+    data = text.encode('utf-8')
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+DOCUMENT = json.dumps({
+    'meta': {'count': 3, 'tags': ['a', {'b': [1, 2]}]},
+    'properties': [
+        {'property_id': '1', 'list_price': 125000, 'lat': 38.61234567, 'note': 'Café – “quoted” ü'},
+        {'property_id': '2', 'list_price': -1.5e3, 'flags': {'is_new': True, 'is_pending': None}},
+        {'property_id': '3', 'list_price': 99999999999, 'name': 'brace } bracket ] comma ,'},
+    ],
+    'trailer': 'after the array',
+}, ensure_ascii=False)
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 1 << 20])
+def test_items_survive_any_chunk_boundary(size):
+    expected = json.loads(DOCUMENT)['properties']
+    assert list(iter_array_items(byte_chunks(DOCUMENT, size))) == expected
+
+
+def test_numbers_split_at_the_end_of_a_chunk():
+    # The first chunk ends inside the number, which must not be decoded as 12
+    chunks = [b'{"properties": [12', b'34.5', b'6, 7]}']
+    assert list(iter_array_items(chunks)) == [1234.56, 7]
+
+
+def test_multibyte_characters_split_across_chunks():
+    text = '{"properties": ["€uro"]}'
+    data = text.encode('utf-8')
+    split = data.index('€'.encode('utf-8')) + 1
+    assert list(iter_array_items([data[:split], data[split:]])) == ['€uro']
+
+
+def test_str_chunks_and_empty_chunks():
+    assert list(iter_array_items(['', '{"properties"', '', ': [1, 2]}'])) == [1, 2]
+
+
+@pytest.mark.parametrize('text', [
+    '{}',
+    '{"other": [1, 2]}',
+    '{"properties": null}',
+    '{"properties": []}',
+    '  {"properties" : [ ] , "more": 1}  ',
+])
+def test_missing_null_or_empty_array_yields_nothing(text):
+    assert list(iter_array_items(byte_chunks(text, 1))) == []
+
+
+def test_other_key():
+    text = '{"properties": [1], "results": [{"a": 1}, {"a": 2}]}'
+    assert list(iter_array_items(byte_chunks(text, 4), key='results')) == [{'a': 1}, {'a': 2}]
+
+
+def test_pages():
+    text = json.dumps({'properties': list(range(7))})
+    pages = list(iter_array_pages(byte_chunks(text, 5), page_size=3))
+    assert pages == [{'properties': [0, 1, 2]}, {'properties': [3, 4, 5]}, {'properties': [6]}]
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '   ',
+    '[1, 2]',
+    '{"properties": [1, 2',
+    '{"properties": [1, 2,',
+    '{"properties": [{"a": 1}',
+    '{"properties": [{"a": ',
+    '{"properties": [1 2]}',
+    '{"properties" [1]}',
+    '{"other": 1 "properties": [1]}',
+    '{"other": tru',
+    '{"properties": ["unterminated]}',
+])
+def test_malformed_or_truncated_documents_raise(text):
+    # json.JSONDecodeError is a ValueError
+    with pytest.raises(ValueError):
+        list(iter_array_items(byte_chunks(text, 3)))
+
+
+def test_items_before_the_error_are_still_yielded():
+    items = iter_array_items([b'{"properties": [{"a": 1}, {"a": 2}, {"a"'])
+    assert next(items) == {'a': 1}
+    assert next(items) == {'a': 2}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_invalid_utf8_raises():
+    with pytest.raises(ValueError):
+        list(iter_array_items([b'{"properties": ["\xff\xfe"]}']))
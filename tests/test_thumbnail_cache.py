@@ -0,0 +1,79 @@
+import io
+
+from PIL import Image
+
+from thumbnail_cache import ThumbnailCache, placeholder_image
+
+
+def jpeg(size=(64, 48)):
+    out = io.BytesIO()
+    Image.new('RGB', size, (200, 10, 10)).save(out, 'JPEG')
+    return out.getvalue()
+
+
+class FakeResponse:
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            self.read += chunk_size
+            yield self.body[start:start + chunk_size]
+
+
+class FakeSession:
+    """Stands in for requests.Session, serving one body per URL"""
+
+    def __init__(self, bodies, send_length=True):
+        self.bodies = bodies
+        self.send_length = send_length
+        self.responses = []
+
+    def get(self, url, timeout=None, stream=False):
+        assert stream
+        body = self.bodies[url]
+        response = FakeResponse(body, {'Content-Length': str(len(body))} if self.send_length else {})
+        self.responses.append(response)
+        return response
+
+
+def test_photos_over_the_limit_are_not_downloaded(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_photo_bytes=100_000)
+    cache.session = FakeSession({'https://x/small.jpg': jpeg(), 'https://x/huge.jpg': b'\xff' * 10_000_000})
+
+    assert cache.fetch('https://x/small.jpg') is not None
+    assert cache.fetch('https://x/huge.jpg') is None
+    # Refused from its Content-Length, nothing was read
+    assert cache.session.responses[-1].read == 0
+    # Remembered as failed, shown as the placeholder
+    assert cache.get_many(['https://x/huge.jpg']) == {'https://x/huge.jpg': None}
+
+
+def test_photos_without_a_length_stop_at_the_limit(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_photo_bytes=100_000)
+    cache.session = FakeSession({'https://x/huge.jpg': b'\xff' * 10_000_000}, send_length=False)
+
+    assert cache.fetch('https://x/huge.jpg') is None
+    assert cache.session.responses[-1].read <= 100_000 + 65536
+
+
+def test_decompression_bombs_are_refused(tmp_path, monkeypatch):
+    # Pillow raises DecompressionBombError, not an OSError, past twice this many pixels
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    cache = ThumbnailCache(str(tmp_path), max_photo_bytes=100_000)
+    cache.session = FakeSession({'https://x/bomb.jpg': jpeg((64, 48)), 'https://x/card.jpg': jpeg((64, 48))})
+
+    assert cache.fetch('https://x/bomb.jpg') is None
+    # A card page shows the placeholder instead of failing
+    assert cache.thumbnails(['https://x/card.jpg']) == [placeholder_image(cache.size)]
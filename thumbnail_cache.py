@@ -0,0 +1,314 @@
+### Card-sized thumbnails of listing photos, cached on disk
+# Primary photos are downloaded concurrently, shrunk to JPEG thumbnails and
+# stored content-addressed as <root>/<hash[:2]>/<hash>.jpg, so listings sharing
+# a photo share one file. A SQLite index maps each photo URL to its thumbnail
+# and tracks when every file was last used; once the files exceed max_bytes
+# the least recently used ones are evicted.
+import functools
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageDraw, ImageOps, UnidentifiedImageError
+
+from instrumentation import count, log_event, span
+
+DEFAULT_THUMBNAIL_PATH = os.environ.get('REALTOR_THUMBNAIL_PATH', os.path.join('.cache', 'thumbnails'))
+DEFAULT_THUMBNAIL_MAX_BYTES = int(os.environ.get('REALTOR_THUMBNAIL_MAX_BYTES', 256 * 2 ** 20))
+# Largest photo downloaded, listing photos are well under a few MB
+DEFAULT_MAX_PHOTO_BYTES = int(os.environ.get('REALTOR_MAX_PHOTO_BYTES', 15 * 2 ** 20))
+
+# Width and height the photos are shrunk to fit, about twice a card column
+THUMBNAIL_SIZE = (480, 360)
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE, quality=80):
+    """
+    Shrink an image to fit size, keeping its aspect ratio
+
+    JPEGs are decoded at a reduced scale directly (Image.draft), so large
+    originals are never fully decompressed.
+
+    Parameters:
+        data (bytes): Encoded image in any format Pillow reads
+        size (tuple): Largest (width, height) of the thumbnail
+        quality (int): JPEG quality of the thumbnail
+
+    Returns:
+        bytes: JPEG thumbnail
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=quality)
+        return out.getvalue()
+
+
+@functools.lru_cache(maxsize=4)
+def placeholder_image(size=THUMBNAIL_SIZE):
+    """PNG shown on cards whose listing has no photo"""
+    image = Image.new('RGB', size, (234, 234, 234))
+    draw = ImageDraw.Draw(image)
+    draw.text((size[0] // 2, size[1] // 2), 'No photo available', fill=(130, 130, 130), anchor='mm')
+    out = io.BytesIO()
+    image.save(out, 'PNG')
+    return out.getvalue()
+
+
+def is_photo_url(url):
+    return isinstance(url, str) and url.startswith(('http://', 'https://'))
+
+
+class PhotoTooLarge(ValueError):
+    """A photo is larger than the download limit"""
+
+
+def read_capped(response, max_bytes, chunk_size=65536):
+    """
+    Body of a streamed response, read no further than max_bytes
+
+    Raises:
+        PhotoTooLarge: Content-Length or the bytes received exceed max_bytes
+    """
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise PhotoTooLarge(f"{length} bytes, over the {max_bytes} byte limit")
+    data = bytearray()
+    for chunk in response.iter_content(chunk_size):
+        data += chunk
+        if len(data) > max_bytes:
+            raise PhotoTooLarge(f"Over the {max_bytes} byte limit")
+    return bytes(data)
+
+
+class ThumbnailCache:
+    """
+    Disk cache of listing photo thumbnails
+
+    Photos that cannot be downloaded or read are remembered for negative_ttl
+    seconds and shown as the placeholder meanwhile.
+
+    Parameters:
+        root (str): Directory of the thumbnail files and index
+        max_bytes (int): Size of the thumbnail files kept, least recently used are evicted beyond it
+        size (tuple): Largest (width, height) of the thumbnails
+        quality (int): JPEG quality of the thumbnails
+        ttl (float): Seconds a thumbnail stays valid before its photo is downloaded again
+        negative_ttl (float): Seconds a failed download is not retried
+        timeout (float or tuple): (connect, read) timeout in seconds of each download
+        max_workers (int): Photos downloaded at once
+        max_photo_bytes (int): Larger photos are not downloaded further and count as failed
+    """
+
+    def __init__(self, root=DEFAULT_THUMBNAIL_PATH, max_bytes=DEFAULT_THUMBNAIL_MAX_BYTES,
+                 size=THUMBNAIL_SIZE, quality=80, ttl=30 * 86400, negative_ttl=3600,
+                 timeout=(3.05, 10), max_workers=8, max_photo_bytes=DEFAULT_MAX_PHOTO_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size = tuple(size)
+        self.quality = quality
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_photo_bytes = max_photo_bytes
+        self.path = os.path.join(root, 'index.sqlite')
+        self._write_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS photos (
+                    url TEXT PRIMARY KEY,
+                    hash TEXT,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS photos_hash ON photos (hash)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _file(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.jpg")
+
+    def thumbnails(self, urls):
+        """
+        Thumbnails of many photos, downloading the ones not cached concurrently
+
+        Parameters:
+            urls (sequence): Photo URLs, 'N/A' or None for listings without a photo
+
+        Returns:
+            list: Encoded image bytes aligned with urls, the placeholder where
+                  there is no photo or it could not be downloaded
+        """
+        with span('thumbnails'):
+            wanted = list({url for url in urls if is_photo_url(url)})
+            found = self.get_many(wanted)
+            missing = [url for url in wanted if url not in found]
+            if missing:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as pool:
+                    found.update(zip(missing, pool.map(self.fetch, missing)))
+                self.evict()
+        placeholder = placeholder_image(self.size)
+        return [(found.get(url) if is_photo_url(url) else None) or placeholder for url in urls]
+
+    def get_many(self, urls):
+        """
+        Look up cached thumbnails
+
+        Returns:
+            dict: url -> thumbnail bytes, or None for a photo known not to load.
+                  Missing or expired entries are omitted.
+        """
+        now = time.time()
+        hashes = {}
+        with self._connect() as conn:
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT url, hash, created FROM photos WHERE url IN ({placeholders})", chunk).fetchall()
+                for url, digest, created in rows:
+                    if now - created <= (self.ttl if digest else self.negative_ttl):
+                        hashes[url] = digest
+
+        found = {}
+        for url, digest in hashes.items():
+            if digest is None:
+                found[url] = None
+                continue
+            try:
+                with open(self._file(digest), 'rb') as f:
+                    found[url] = f.read()
+            except FileNotFoundError:
+                continue
+        used = {digest for url, digest in hashes.items() if url in found and digest}
+        if used:
+            with self._write_lock, self._connect() as conn:
+                conn.executemany("UPDATE blobs SET last_used = ? WHERE hash = ?",
+                                 [(now, digest) for digest in used])
+        count('realtor_cache_requests_total', len(found), cache='thumbnail', result='hit')
+        count('realtor_cache_requests_total', len(urls) - len(found), cache='thumbnail', result='miss')
+        return found
+
+    def fetch(self, url):
+        """Download one photo and cache its thumbnail, returns None when it cannot be read"""
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                data = read_capped(response, self.max_photo_bytes)
+            thumbnail = make_thumbnail(data, self.size, self.quality)
+        except (requests.exceptions.RequestException, UnidentifiedImageError, OSError, PhotoTooLarge,
+                Image.DecompressionBombError) as e:
+            log_event('thumbnail_error', logging.WARNING, url=url, error=str(e))
+            self.put(url, None)
+            return None
+        self.put(url, thumbnail)
+        return thumbnail
+
+    def put(self, url, thumbnail):
+        """Store the thumbnail of a photo, None for a photo that could not be loaded"""
+        now = time.time()
+        digest = None
+        if thumbnail is not None:
+            digest = hashlib.sha256(thumbnail).hexdigest()
+            path = self._file(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write then rename so readers never see a partial file
+                temp = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp, 'wb') as f:
+                    f.write(thumbnail)
+                os.replace(temp, path)
+        with self._write_lock, self._connect() as conn:
+            if digest is not None:
+                conn.execute("INSERT OR REPLACE INTO blobs (hash, size, last_used) VALUES (?, ?, ?)",
+                             (digest, len(thumbnail), now))
+            conn.execute("INSERT OR REPLACE INTO photos (url, hash, created) VALUES (?, ?, ?)",
+                         (url, digest, now))
+
+    def total_bytes(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def evict(self):
+        """
+        Delete the least recently used thumbnails until the cache fits max_bytes
+
+        Returns:
+            int: Number of thumbnail files deleted
+        """
+        with self._write_lock, self._connect() as conn:
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return 0
+            evicted = []
+            for digest, size in conn.execute("SELECT hash, size FROM blobs ORDER BY last_used"):
+                if excess <= 0:
+                    break
+                evicted.append(digest)
+                excess -= size
+            conn.executemany("DELETE FROM blobs WHERE hash = ?", [(d,) for d in evicted])
+            conn.executemany("DELETE FROM photos WHERE hash = ?", [(d,) for d in evicted])
+        for digest in evicted:
+            try:
+                os.remove(self._file(digest))
+            except FileNotFoundError:
+                pass
+        return len(evicted)
+
+    def clear(self):
+        """Delete every cached thumbnail"""
+        with self._write_lock, self._connect() as conn:
+            digests = [row[0] for row in conn.execute("SELECT hash FROM blobs")]
+            conn.execute("DELETE FROM blobs")
+            conn.execute("DELETE FROM photos")
+        for digest in digests:
+            try:
+                os.remove(self._file(digest))
+            except FileNotFoundError:
+                pass
+
+
+_default_thumbnail_cache = None
+_default_thumbnail_cache_lock = threading.Lock()
+
+
+def get_default_thumbnail_cache():
+    """Return the process-wide thumbnail cache"""
+    global _default_thumbnail_cache
+    with _default_thumbnail_cache_lock:
+        if _default_thumbnail_cache is None:
+            _default_thumbnail_cache = ThumbnailCache()
+        return _default_thumbnail_cache
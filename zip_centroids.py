@@ -0,0 +1,57 @@
+### Offline ZIP code centroid table
+# data/zip_centroids.csv.gz lists every active US ZIP code with its primary
+# city, state, other accepted city names and the latitude/longitude of its
+# center. It was exported from the MIT-licensed `zipcodes` package and is used
+# to place listings on the map approximately when they carry no coordinates.
+import functools
+import os
+
+import pandas as pd
+
+DEFAULT_ZIP_CENTROIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                          'data', 'zip_centroids.csv.gz')
+
+
+@functools.lru_cache(maxsize=4)
+def load_zip_centroids(path=DEFAULT_ZIP_CENTROIDS_PATH):
+    """
+    Load the ZIP centroid table, once per process
+
+    Returns:
+        pd.DataFrame: Indexed by 5-digit zip with city, state, other_cities,
+                      latitude and longitude columns
+    """
+    return pd.read_csv(path, dtype={'zip': str, 'city': str, 'state': str, 'other_cities': str},
+                       keep_default_na=False, na_values={'latitude': [''], 'longitude': ['']},
+                       index_col='zip')
+
+
+def zip_centroid_coordinates(zips):
+    """
+    Look up the centroids of many zips
+
+    Parameters:
+        zips (iterable): Zip codes, non-zip values are ignored
+
+    Returns:
+        tuple: (latitude Series, longitude Series) aligned with zips, NaN when unknown
+    """
+    centroids = load_zip_centroids()
+    keys = pd.Index([str(z).strip()[:5] for z in zips])
+    matched = centroids.reindex(keys)
+    return matched['latitude'].to_numpy(), matched['longitude'].to_numpy()
+
+
+def zips_for_city(city, state):
+    """
+    List the zips whose primary or accepted city name matches, e.g. zips_for_city("Kirkwood", "MO")
+
+    Returns:
+        list: Matching zip codes in ascending order
+    """
+    centroids = load_zip_centroids()
+    city = city.strip().lower()
+    in_state = centroids[centroids['state'] == state.strip().upper()]
+    primary = in_state['city'].str.lower() == city
+    other = in_state['other_cities'].str.lower().str.split(';').apply(lambda names: city in names)
+    return sorted(in_state.index[primary | other])